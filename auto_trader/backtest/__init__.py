@@ -0,0 +1,5 @@
+"""__init__.py
+"""
+
+from .backtester import BacktestConfig, run_backtest, simulate, summarize
+from .sweep import grid, random_search, run_sweep
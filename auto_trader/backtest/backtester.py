@@ -0,0 +1,182 @@
+"""backtester.py
+"""
+
+import datetime
+
+import numpy as np
+import polars as pl
+from pydantic import BaseModel
+
+from ..trader.trader0 import import_stock, train_features
+from ..utils.feature_cache import FeatureCache
+
+TAKE_PROFIT = "take_profit"
+LOSSCUT = "losscut"
+END = "end"
+
+
+class BacktestConfig(BaseModel):
+    """`Trader0`の売買ロジックのパラメータ"""
+
+    entry_atr_ratio: float = 0.8  # 新規注文の価格 = close - ATR * entry_atr_ratio
+    exit_atr_ratio: float = 0.8  # 利益確定注文の価格 = close + ATR * exit_atr_ratio
+    losscut_ratio: float = 0.92  # losscutの価格 = 新規注文の価格 * losscut_ratio
+    volume: float = 0.01
+    fee_rate: float = 0.0
+    warmup: int = 100  # 最初の`warmup`本のbarでは発注しない
+    horizon: int = 256  # 1回のベクトル演算で決済を判定するbarの本数
+    max_cells: int = 1 << 24  # 1回のベクトル演算で扱う(注文数 x bar数)の上限
+
+
+def prepare_features(
+    df: pl.DataFrame,
+    cache: FeatureCache | None = None,
+    symbol: str | None = None,
+    interval: str | datetime.timedelta | None = None,
+) -> pl.DataFrame:
+    """全期間の特徴量をまとめて計算する。`cache`を指定した場合は計算済みの特徴量を`symbol`, `interval`で再利用する"""
+    if cache is not None:
+        assert symbol is not None and interval is not None
+        return cache.get(symbol, interval, df)
+    return import_stock().crypto.feature.calc_features(df.sort("datetime"))
+
+
+def predict(df: pl.DataFrame, model) -> np.ndarray:
+    """全てのbarのモデルのスコアをまとめて計算する"""
+    return np.asarray(model.predict(df.select(*train_features).to_numpy()), dtype=np.float64)
+
+
+def simulate(
+    df: pl.DataFrame, scores: np.ndarray, config: BacktestConfig = BacktestConfig()
+) -> pl.DataFrame:
+    """`Trader0`の売買ロジックを、barの高値・安値から約定を判定してシミュレーションする。
+
+    bar tの確定時にスコアが正の場合、close[t] - ATR[t] * entry_atr_ratioで買い注文を出し、bar t+1の間だけ有効とする。
+    約定後は、各barの確定時に利益確定注文をclose + ATR * exit_atr_ratioに置き直し、次のbarの高値で約定を判定する。
+    安値がlosscutの価格を下回った場合は同じbar内でlosscutする。同じbarで両方の条件を満たす場合はlosscutを優先する。
+    取引余力による発注の制限は考慮しない。
+
+    Args:
+        df (pl.DataFrame) : datetime, open, high, low, close, ATRの列を持つbar
+        scores (np.ndarray) : 各barの確定時のモデルのスコア
+    Return:
+        pl.DataFrame : 1行1取引の結果
+    """
+    open_ = df["open"].to_numpy().astype(np.float64)
+    high = df["high"].to_numpy().astype(np.float64)
+    low = df["low"].to_numpy().astype(np.float64)
+    close = df["close"].to_numpy().astype(np.float64)
+    atr = df["ATR"].to_numpy().astype(np.float64)
+    n = len(df)
+
+    entry_price = close - atr * config.entry_atr_ratio
+    target_price = close + atr * config.exit_atr_ratio
+
+    # 新規注文と約定の判定
+    signal = np.zeros(n, dtype=bool)
+    start = max(config.warmup - 1, 0)
+    signal[start : n - 1] = (scores[start : n - 1] > 0) & np.isfinite(entry_price[start : n - 1])
+    order_index = np.flatnonzero(signal)
+    order_index = order_index[low[order_index + 1] <= entry_price[order_index]]
+    fill_price = np.minimum(entry_price[order_index], open_[order_index + 1])
+    losscut_price = entry_price[order_index] * config.losscut_ratio
+
+    exit_index, exit_price, reason = _find_exits(
+        order_index, fill_price, losscut_price, target_price, open_, high, low, close, config
+    )
+
+    pnl = (exit_price - fill_price) * config.volume
+    pnl -= (fill_price + exit_price) * config.volume * config.fee_rate
+    datetime = df["datetime"]
+    return pl.DataFrame(
+        {
+            "entry_datetime": datetime.gather(order_index + 1),
+            "entry_price": fill_price,
+            "exit_datetime": datetime.gather(exit_index),
+            "exit_price": exit_price,
+            "reason": np.array([END, TAKE_PROFIT, LOSSCUT])[reason],
+            "volume": np.full(len(order_index), config.volume),
+            "pnl": pnl,
+        }
+    )
+
+
+def _find_exits(
+    order_index: np.ndarray,
+    fill_price: np.ndarray,
+    losscut_price: np.ndarray,
+    target_price: np.ndarray,
+    open_: np.ndarray,
+    high: np.ndarray,
+    low: np.ndarray,
+    close: np.ndarray,
+    config: BacktestConfig,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """各注文の決済bar、決済価格、決済理由(0: END, 1: TAKE_PROFIT, 2: LOSSCUT)を求める。
+    (注文数 x `horizon`本)の行列で判定し、決済されなかった注文だけ次の`horizon`本で判定する。
+    """
+    n = len(close)
+    exit_index = np.full(len(order_index), n - 1)
+    exit_price = np.full(len(order_index), close[-1] if n > 0 else np.nan)
+    reason = np.zeros(len(order_index), dtype=np.int8)
+
+    horizon = config.horizon
+    chunk_size = max(1, config.max_cells // horizon)
+    for chunk_start in range(0, len(order_index), chunk_size):
+        pending = np.arange(chunk_start, min(chunk_start + chunk_size, len(order_index)))
+        offset = 0
+        while len(pending) > 0:
+            first_bar = order_index[pending] + 1  # 約定したbar
+            bars = first_bar[:, None] + np.arange(offset, offset + horizon)[None, :]
+            valid = bars < n
+            bars = np.minimum(bars, n - 1)
+
+            losscut_hit = valid & (low[bars] < losscut_price[pending][:, None])
+            # 利益確定注文は約定したbarの確定後に発注されるので、その次のbarから判定する
+            target_hit = valid & (bars > first_bar[:, None]) & (high[bars] >= target_price[bars - 1])
+            hit = losscut_hit | target_hit
+            has_hit = hit.any(axis=1)
+            first = hit.argmax(axis=1)
+
+            rows = np.flatnonzero(has_hit)
+            idx = pending[rows]
+            bar = bars[rows, first[rows]]
+            lc = losscut_hit[rows, first[rows]]
+            # 窓を開けて価格が飛んだ場合は始値で約定したとみなす
+            lc_price = np.where(
+                bar == first_bar[rows],
+                np.minimum(losscut_price[idx], fill_price[idx]),
+                np.minimum(losscut_price[idx], open_[bar]),
+            )
+            tp_price = np.maximum(target_price[bar - 1], open_[bar])
+            exit_index[idx] = bar
+            exit_price[idx] = np.where(lc, lc_price, tp_price)
+            reason[idx] = np.where(lc, 2, 1)
+
+            # 最後のbarまで決済されなかった注文は最後の終値で決済したとみなす
+            pending = pending[~has_hit & valid[:, -1]]
+            offset += horizon
+
+    return exit_index, exit_price, reason
+
+
+def summarize(trades: pl.DataFrame) -> dict[str, float]:
+    """取引結果の統計量を計算する"""
+    if len(trades) == 0:
+        return {"trades": 0, "win_rate": 0.0, "total_pnl": 0.0, "mean_pnl": 0.0, "max_drawdown": 0.0}
+    pnl = trades.sort("exit_datetime")["pnl"].to_numpy()
+    equity = np.cumsum(pnl)
+    drawdown = np.maximum.accumulate(np.maximum(equity, 0.0)) - equity
+    return {
+        "trades": len(pnl),
+        "win_rate": float((pnl > 0).mean()),
+        "total_pnl": float(pnl.sum()),
+        "mean_pnl": float(pnl.mean()),
+        "max_drawdown": float(drawdown.max()),
+    }
+
+
+def run_backtest(df: pl.DataFrame, model, config: BacktestConfig = BacktestConfig()) -> pl.DataFrame:
+    """保存済みのbarに対して`Trader0`の売買ロジックのバックテストを実行する"""
+    df = prepare_features(df)
+    return simulate(df, predict(df, model), config)
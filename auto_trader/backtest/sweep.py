@@ -0,0 +1,112 @@
+"""sweep.py
+"""
+
+import itertools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import polars as pl
+
+from .backtester import BacktestConfig, simulate, summarize
+
+# 共有メモリに置く列。datetimeはepochからのマイクロ秒をfloat64で表す(2^53未満なので誤差は無い)
+SHARED_COLUMNS = ("datetime", "open", "high", "low", "close", "ATR", "score")
+
+_worker_state: dict = {}
+
+
+def grid(**params: list) -> list[dict]:
+    """パラメータの全ての組み合わせを返す。`grid(losscut_ratio=[0.9, 0.92], volume=[0.01])`"""
+    names = list(params)
+    return [dict(zip(names, values)) for values in itertools.product(*params.values())]
+
+
+def random_search(space: dict[str, tuple[float, float] | list], n: int, seed: int = 0) -> list[dict]:
+    """パラメータを`n`組ランダムに選ぶ。tupleの場合は(最小値, 最大値)の一様分布、listの場合はその中から選ぶ"""
+    rng = np.random.default_rng(seed)
+    params = []
+    for _ in range(n):
+        param = {}
+        for name, values in space.items():
+            if isinstance(values, tuple):
+                param[name] = float(rng.uniform(*values))
+            else:
+                param[name] = values[rng.integers(len(values))]
+        params.append(param)
+    return params
+
+
+def _attach(name: str, n: int):
+    """workerの初期化。共有メモリ上の行列からコピーせずにbarを参照する"""
+    shm = SharedMemory(name=name)
+    matrix = np.ndarray((len(SHARED_COLUMNS), n), dtype=np.float64, buffer=shm.buf)
+    columns = dict(zip(SHARED_COLUMNS, matrix))
+    df = pl.DataFrame(
+        {
+            "datetime": pl.Series(columns["datetime"].astype(np.int64)).cast(pl.Datetime("us")),
+            **{name: columns[name] for name in SHARED_COLUMNS[1:-1]},
+        }
+    )
+    _worker_state.update(shm=shm, df=df, scores=columns["score"])
+
+
+def _evaluate(args: tuple[dict, dict]) -> dict:
+    base, param = args
+    config = BacktestConfig(**{**base, **param})
+    trades = simulate(_worker_state["df"], _worker_state["scores"], config)
+    return {**param, **summarize(trades)}
+
+
+def run_sweep(
+    df: pl.DataFrame,
+    scores: np.ndarray,
+    params: list[dict],
+    base: BacktestConfig = BacktestConfig(),
+    max_workers: int | None = None,
+    sort_by: str = "total_pnl",
+) -> pl.DataFrame:
+    """`params`の各パラメータで`simulate`を実行し、`sort_by`の降順に並べた結果を返す。
+
+    特徴量の計算とモデルの実行は全てのパラメータで共通なので、呼び出し側で1度だけ行う。
+    barとスコアは共有メモリに1度だけ書き込み、各workerはそれを参照するのでpickleしない。
+    パラメータは`BacktestConfig`のフィールド名で指定する。`warmup`は最初のbarで発注しないだけなので、
+    特徴量を計算するbarの本数(`Trader0`の`data_length`)は変えられない。特徴量は`df`の計算時に決まる。
+
+    Args:
+        df (pl.DataFrame) : `prepare_features`で特徴量を計算したbar
+        scores (np.ndarray) : `predict`で計算した各barのスコア
+        params (list[dict]) : `grid`や`random_search`で作成したパラメータ
+        base (BacktestConfig) : `params`で指定しないパラメータ
+    Return:
+        pl.DataFrame : 1行1パラメータの、パラメータと`summarize`の結果
+    """
+    n = len(df)
+    shm = SharedMemory(create=True, size=max(1, len(SHARED_COLUMNS) * n * 8))
+    try:
+        matrix = np.ndarray((len(SHARED_COLUMNS), n), dtype=np.float64, buffer=shm.buf)
+        matrix[0] = df["datetime"].dt.epoch("us").to_numpy()
+        for i, name in enumerate(SHARED_COLUMNS[1:-1], start=1):
+            matrix[i] = df[name].cast(pl.Float64).to_numpy()
+        matrix[-1] = scores
+        del matrix  # unlinkする前に共有メモリへの参照を残さない
+
+        tasks = [(base.model_dump(), param) for param in params]
+        max_workers = max_workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_attach,
+            initargs=(shm.name, n),
+        ) as executor:
+            chunksize = max(1, len(tasks) // (4 * max_workers))
+            results = list(executor.map(_evaluate, tasks, chunksize=chunksize))
+    finally:
+        shm.close()
+        shm.unlink()
+
+    if len(results) == 0:
+        return pl.DataFrame()
+    return pl.from_dicts(results).sort(sort_by, descending=True)
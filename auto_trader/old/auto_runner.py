@@ -26,11 +26,20 @@ class AutoRunner:
             self.run_step()
             await fut
 
+    def run_replay(self, step: float | None = None):
+        """`SimulatorDataFetcher.replay`で記録した約定を待たずに流し、`step`秒分の約定ごとに`run_step`を実行する"""
+        self.is_running = True
+        for _ in self.data_fetcher.replay(step if step is not None else self.loop_interval):
+            self.run_step()
+            if not self.is_running:
+                break
+        self.is_running = False
+
     def run_step(self):
-        while not self.data_fetcher.que.empty():
-            data = self.data_fetcher.que.get()
+        batch = self.data_fetcher.pop_batch()
+        if len(batch) > 0:
             for strategy in self.strategy_list:
-                strategy.add_new_data(data)
+                strategy.add_new_batch(batch)
 
         for strategy in self.strategy_list:
             strategy.run()
@@ -1,20 +1,48 @@
 """base_data_fetcher.py
 """
 
-import queue
+import threading
 
-from ..types import TickData
+from ..types import TickBatch
 
 
 class BaseDataFetcher:
+    """受信したtick dataを列ごとに溜めておき、`pop_batch`でまとめて取り出す。
+    tickごとにqueueへ入れる代わりに、listへのappendとlockの取得を`pop_batch`1回につき1度で済ませる。
+    """
 
     def __init__(self, symbol):
         self._symbol = symbol
-        self._que = queue.Queue()
-
-    @property
-    def que(self) -> queue.Queue[TickData]:
-        return self._que
+        self._lock = threading.Lock()
+        self._columns: tuple[list, list, list, list] = ([], [], [], [])  # side, price, volume, timestamp
+        self._batches: list[TickBatch] = []
+
+    def put(self, side: int, price: float, volume: float, timestamp: int):
+        """tick dataを1件追加する。`timestamp`はepochからのミリ秒"""
+        with self._lock:
+            for column, value in zip(self._columns, (side, price, volume, timestamp)):
+                column.append(value)
+
+    def put_batch(self, batch: TickBatch):
+        """まとまったtick dataを追加する"""
+        with self._lock:
+            self._flush_columns()
+            self._batches.append(batch)
+
+    def pop_batch(self) -> TickBatch:
+        """前回の呼び出し以降に追加されたtick dataを全て取り出す"""
+        with self._lock:
+            self._flush_columns()
+            batches, self._batches = self._batches, []
+        if len(batches) == 0:
+            return TickBatch.from_columns(self._symbol, [], [], [], [])
+        return TickBatch.concat(self._symbol, batches)
+
+    def _flush_columns(self):
+        if len(self._columns[0]) == 0:
+            return
+        self._batches.append(TickBatch.from_columns(self._symbol, *self._columns))
+        self._columns = ([], [], [], [])
 
     def start_subscribe(self):
         raise NotImplementedError
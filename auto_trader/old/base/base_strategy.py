@@ -1,7 +1,7 @@
 """base_strategy.py
 """
 
-from ..types import TickData
+from ..types import TickBatch, TickData
 
 
 class BaseStrategy:
@@ -12,6 +12,11 @@ class BaseStrategy:
     def add_new_data(self, data: TickData):
         raise NotImplementedError
 
+    def add_new_batch(self, batch: TickBatch):
+        """まとめて受信したtick dataを追加する。batchに対応したstrategyはoverrideする"""
+        for data in batch.to_ticks():
+            self.add_new_data(data)
+
     def run(self):
         raise NotImplementedError
 
@@ -8,7 +8,7 @@ import threading
 import websocket
 
 from ..base import BaseDataFetcher
-from ..types import TickData
+from ..types.tick_batch import SIDE_BUY
 
 
 class GMODataFetcher(BaseDataFetcher):
@@ -24,20 +24,13 @@ class GMODataFetcher(BaseDataFetcher):
             message = {"command": "subscribe", "channel": "trades", "symbol": symbol}
             self.send(json.dumps(message))
 
-        que = self._que
+        put = self.put
 
         def on_message(self, message):
             data = json.loads(message)
             if data["side"] == "BUY":
-                que.put(
-                    TickData(
-                        side=data["side"],
-                        symbol=data["symbol"],
-                        price=data["price"],
-                        volume=data["size"],
-                        timestamp=datetime.datetime.fromisoformat(data["timestamp"]),
-                    )
-                )
+                timestamp = datetime.datetime.fromisoformat(data["timestamp"]).timestamp()
+                put(SIDE_BUY, float(data["price"]), float(data["size"]), int(timestamp * 1000))
 
         websocket.enableTrace(True)
         self.ws = websocket.WebSocketApp("wss://api.coin.z.com/ws/public/v1")
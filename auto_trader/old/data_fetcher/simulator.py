@@ -3,37 +3,85 @@
 
 import asyncio
 import threading
+import time
+from typing import Iterator
 
+import numpy as np
 import polars as pl
 
+from ...utils.clock import SimulatedClock
 from ..base import BaseDataFetcher
-from ..types import TickData
+from ..types import TickBatch
+from ..types.tick_batch import SIDE_BUY, SIDE_SELL
 
 
 class SimulatorDataFetcher(BaseDataFetcher):
+    """記録した約定を再生する。
+    `speed`がNoneの場合は`loop_interval`秒ごとに1件ずつ流す。
+    `speed`を指定した場合は約定時刻に合わせて`speed`倍速で、`loop_interval`秒ごとにまとめて流す。
+    `replay`を使うと待たずに最大速度で流す。再生中の約定時刻は`clock`で取得できる。
+    """
 
-    def __init__(self, symbol, df: pl.DataFrame, loop_interval: float = 0.5):
+    def __init__(self, symbol, df: pl.DataFrame, loop_interval: float = 0.5, speed: float | None = None):
         super().__init__(symbol)
-        self._df = df.sort(pl.col("datetime"))
+        datetime = pl.col("datetime")
+        if df.schema["datetime"].time_zone is None:
+            datetime = datetime.dt.replace_time_zone("Asia/Tokyo")  # timezoneの無い場合はJSTとみなす
+        self._df = df.sort(pl.col("datetime")).with_columns(
+            pl.when(pl.col("side") == "BUY").then(SIDE_BUY).otherwise(SIDE_SELL).alias("side"),
+            datetime.dt.epoch("ms").alias("timestamp"),
+        )
+        # 再生時はnumpy配列をsliceするだけで済むように、列を先に変換しておく
+        self._side = self._df["side"].to_numpy().astype(np.int8)
+        self._price = self._df["price"].cast(pl.Float64).to_numpy()
+        self._volume = self._df["size"].cast(pl.Float64).to_numpy()
+        self._timestamp = self._df["timestamp"].to_numpy()
         self._interval = loop_interval
+        self._speed = speed
+        self.clock = SimulatedClock(self._timestamp[0] / 1000 if len(self._df) > 0 else 0.0)
         self._thread = None
         self._running = False
 
+    def chunks(self, step: float) -> Iterator[tuple[float, TickBatch]]:
+        """約定時刻で`step`秒ごとに区切ったtick dataを、区切りの終了時刻(epochからの秒数)とともに返す"""
+        if len(self._timestamp) == 0:
+            return
+        step_ms = max(1, int(step * 1000))
+        start = self._timestamp[0] - self._timestamp[0] % step_ms
+        ends = np.arange(start + step_ms, self._timestamp[-1] + step_ms + 1, step_ms)
+        stops = np.searchsorted(self._timestamp, ends, side="left")
+        begin = 0
+        for end, stop in zip(ends.tolist(), stops.tolist()):
+            batch = TickBatch.from_columns(
+                self._symbol,
+                self._side[begin:stop],
+                self._price[begin:stop],
+                self._volume[begin:stop],
+                self._timestamp[begin:stop],
+            )
+            yield end / 1000, batch
+            begin = stop
+
+    def replay(self, step: float) -> Iterator[float]:
+        """待たずに`step`秒分ずつ約定を追加し、そのたびにシミュレーションの時刻をyieldする"""
+        for now, batch in self.chunks(step):
+            self.clock.set_time(now)
+            if len(batch) > 0:
+                self.put_batch(batch)
+            yield now
+
     def start_subscribe(self):
         self._running = True
+        if self._speed is not None:
+            self._thread = threading.Thread(target=self._run_accelerated)
+            self._thread.start()
+            return
 
         async def run():
-            for i in range(len(self._df)):
+            rows = self._df.select("side", "price", "size", "timestamp").iter_rows()
+            for row in rows:
                 fut = asyncio.sleep(self._interval)
-                self._que.put(
-                    TickData(
-                        side=self._df["side"][i],
-                        symbol=self._df["symbol"][i],
-                        price=self._df["price"][i],
-                        volume=self._df["size"][i],
-                        timestamp=self._df["datetime"][i],
-                    )
-                )
+                self.put(*row)
                 await fut
                 if not self._running:
                     break
@@ -41,6 +89,16 @@ class SimulatorDataFetcher(BaseDataFetcher):
         self._thread = threading.Thread(target=asyncio.run, args=(run(),))
         self._thread.start()
 
+    def _run_accelerated(self):
+        start = time.monotonic()
+        for i, (now, batch) in enumerate(self.chunks(self._interval * self._speed)):
+            time.sleep(max(0.0, start + (i + 1) * self._interval - time.monotonic()))
+            if not self._running:
+                break
+            self.clock.set_time(now)
+            if len(batch) > 0:
+                self.put_batch(batch)
+
     def stop_subscribe(self):
         self._running = False
         if self._thread is not None:
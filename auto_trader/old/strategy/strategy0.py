@@ -3,14 +3,14 @@
 
 import datetime
 
-import numpy as np
 import polars as pl
 from sklearn.base import RegressorMixin
 from stock.crypto.feature import calc_features
 
+from ...utils import gmo
+from ...utils.bar_aggregator import BarAggregator, to_epoch_ms
 from ..base import BaseStrategy, BaseTrader, BaseWallet
-from ..types import TickData
-from ..utils import gmo
+from ..types import TickBatch, TickData
 
 # from ..utils.feature import calc_features
 
@@ -18,9 +18,11 @@ from ..utils import gmo
 def fetch_initial_df(
     symbol: str,
     interval: datetime.timedelta,
-    start_date: datetime.datetime = datetime.datetime.now(),
+    start_date: datetime.datetime | None = None,
     min_length: int = 30,
 ):
+    if start_date is None:
+        start_date = datetime.datetime.now()
     df = gmo.get_ohlc(symbol, interval, date=start_date)
     while len(df) < min_length:
         start_date -= datetime.timedelta(days=1)
@@ -35,12 +37,6 @@ def fetch_initial_df(
     return df
 
 
-def push_back_data(arr: np.ndarray, val):
-    arr = np.roll(arr, -1)
-    arr[-1] = val
-    return arr
-
-
 class Strategy0(BaseStrategy):
     """ """
 
@@ -106,7 +102,7 @@ class Strategy0(BaseStrategy):
         wallet: BaseWallet,
         trader: BaseTrader,
         estimator: RegressorMixin,
-        start_date: datetime.datetime = datetime.datetime.now(),
+        start_date: datetime.datetime | None = None,
     ):
         self._symbol = symbol
         self._interval = interval
@@ -114,52 +110,26 @@ class Strategy0(BaseStrategy):
         self._trader = trader
         self._estimator = estimator
 
-        df = fetch_initial_df(symbol, interval, start_date=start_date).sort(
-            "datetime"
-        )  # .select("open", "high", "low", "close", "datetime").sort("datetime")
-        self._open = df["open"].to_numpy()
-        self._high = df["high"].to_numpy()
-        self._low = df["low"].to_numpy()
-        self._close = df["close"].to_numpy()
-        self._volume = df["volume"].to_numpy()
+        df = fetch_initial_df(symbol, interval, start_date=start_date).sort("datetime")
+        # tick dataからのbarの作成は`Trader0`と共通の`BarAggregator`で行う
+        self._aggregator = BarAggregator(symbol, [interval], capacity=len(df))
+        self._aggregator.seed(interval, df)
+        self._bars = self._aggregator.buffers[interval]
 
-        self._next_wall = df["datetime"][-1] + self._interval  # 次のbarの終了時刻
-        self._next_data_list = []  # 次のbarに含まれるtick data (date, price, volume)
+    @property
+    def _next_wall(self) -> datetime.datetime:
+        """作成中のbarの開始時刻"""
+        return self._bars.last_datetime + self._interval
 
     @property
     def df(self):
-        return pl.DataFrame(
-            {
-                "open": self._open,
-                "high": self._high,
-                "low": self._low,
-                "close": self._close,
-                "volume": self._volume,
-            }
-        )
+        return self._bars.to_df().drop("datetime")
 
     def add_new_data(self, data: TickData):
-        print("New data : {}".format(data))
-        tick_date = data.timestamp
-        while tick_date >= self._next_wall:
-            if len(self._next_data_list) > 0:
-                # 次のbarのohlcを計算
-                volume = sum([d[2] for d in self._next_data_list])
-                high = max([d[1] for d in self._next_data_list])
-                low = min([d[1] for d in self._next_data_list])
-                open = self._next_data_list[0][1]
-                close = self._next_data_list[-1][1]
-                # 配列を更新
-                self._open = push_back_data(self._open, open)
-                self._high = push_back_data(self._high, high)
-                self._low = push_back_data(self._low, low)
-                self._close = push_back_data(self._close, close)
-                self._volume = push_back_data(self._volume, volume)
-
-            self._next_data_list.clear()
-            self._next_wall += self._interval
-
-        self._next_data_list.append([tick_date, float(data.price), float(data.volume)])
+        self._aggregator.add_tick(to_epoch_ms(data.timestamp), float(data.price), float(data.volume))
+
+    def add_new_batch(self, batch: TickBatch):
+        self._aggregator.add_ticks(batch.timestamp, batch.price, batch.volume)
 
     def run(self):
         df = calc_features(self.df)
@@ -4,5 +4,6 @@
 """
 
 from .tick_data import TickData
+from .tick_batch import TickBatch
 from .trade_history import TradeHistory
 from .order import Order
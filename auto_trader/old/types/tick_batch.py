@@ -0,0 +1,66 @@
+"""tick_batch.py
+"""
+
+import datetime
+
+import numpy as np
+from pydantic import BaseModel, ConfigDict
+
+from .tick_data import TickData
+
+SIDE_BUY = 1
+SIDE_SELL = -1
+
+
+class TickBatch(BaseModel):
+    """複数のtick dataを列ごとのnumpy配列でまとめたもの。
+    1つのシンボルの約定を時刻順に保持する。`timestamp`はepochからのミリ秒、`side`は`SIDE_BUY`または`SIDE_SELL`。
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    symbol: str
+    side: np.ndarray
+    price: np.ndarray
+    volume: np.ndarray
+    timestamp: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.timestamp)
+
+    @classmethod
+    def from_columns(cls, symbol: str, side, price, volume, timestamp) -> "TickBatch":
+        return cls(
+            symbol=symbol,
+            side=np.asarray(side, dtype=np.int8),
+            price=np.asarray(price, dtype=np.float64),
+            volume=np.asarray(volume, dtype=np.float64),
+            timestamp=np.asarray(timestamp, dtype=np.int64),
+        )
+
+    @classmethod
+    def concat(cls, symbol: str, batches: list["TickBatch"]) -> "TickBatch":
+        if len(batches) == 1:
+            return batches[0]
+        return cls.from_columns(
+            symbol,
+            *(
+                np.concatenate([getattr(batch, name) for batch in batches])
+                for name in ("side", "price", "volume", "timestamp")
+            ),
+        )
+
+    def to_ticks(self) -> list[TickData]:
+        """1件ずつの`TickData`に変換する。batchに対応していないstrategy向け"""
+        return [
+            TickData(
+                side="BUY" if side == SIDE_BUY else "SELL",
+                symbol=self.symbol,
+                price=price,
+                volume=volume,
+                timestamp=datetime.datetime.fromtimestamp(timestamp / 1000, tz=datetime.timezone.utc),
+            )
+            for side, price, volume, timestamp in zip(
+                self.side.tolist(), self.price.tolist(), self.volume.tolist(), self.timestamp.tolist()
+            )
+        ]
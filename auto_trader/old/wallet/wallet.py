@@ -1,69 +1,121 @@
 """wallet.py
 """
 
-from pydantic import BaseModel
+import numpy as np
 
 from ..base import BaseWallet
 from ..types import Order, TradeHistory
 
 
-class Position(BaseModel):
-    symbol: str
-    volume: float  # positive value: long position, negative value: short position
+class Position:
+    """`Wallet`の1シンボル分のポジション。値は`Wallet.volumes`を参照する"""
+
+    def __init__(self, wallet: "Wallet", symbol: str):
+        self._wallet = wallet
+        self.symbol = symbol
+
+    @property
+    def volume(self) -> float:
+        """positive value: long position, negative value: short position"""
+        return float(self._wallet.volumes[self._wallet.symbol_index[self.symbol]])
+
+    @volume.setter
+    def volume(self, value: float):
+        self._wallet.volumes[self._wallet.symbol_index[self.symbol]] = value
+
+    def __repr__(self) -> str:
+        return f"Position(symbol={self.symbol!r}, volume={self.volume})"
 
 
 class Wallet(BaseWallet):
-    def __init__(self, initial_cash: float):
+    """シンボル -> indexのdictと、ポジションの数量のnumpy配列で資産を管理する。
+    多数のシンボルの評価額の計算や、多数の約定の反映をまとめてベクトル演算で行う。
+    """
+
+    def __init__(self, initial_cash: float, capacity: int = 16):
         self.initial_cash = initial_cash
         self.current_cash = initial_cash
-        self.current_positions: list[Position] = []
+        self.symbols: list[str] = []
+        self.symbol_index: dict[str, int] = {}
+        self._volumes = np.zeros(max(1, capacity), dtype=np.float64)
+
+    @property
+    def volumes(self) -> np.ndarray:
+        """`symbols`の順に並んだポジションの数量"""
+        return self._volumes[: len(self.symbols)]
+
+    @property
+    def current_positions(self) -> list[Position]:
+        return [Position(self, symbol) for symbol in self.symbols]
+
+    def _index(self, symbol: str) -> int:
+        """`symbol`のindexを返す。存在しない場合は数量0で追加する"""
+        index = self.symbol_index.get(symbol)
+        if index is not None:
+            return index
+        index = len(self.symbols)
+        if index == len(self._volumes):
+            self._volumes = np.concatenate([self._volumes, np.zeros_like(self._volumes)])
+        self.symbols.append(symbol)
+        self.symbol_index[symbol] = index
+        return index
+
+    def price_vector(self, current_prices: dict[str, float]) -> np.ndarray:
+        """`symbols`の順に並んだ価格。ポジションが無いシンボルの価格は無くても良い"""
+        volumes = self.volumes
+        return np.array(
+            [
+                current_prices[symbol] if volumes[i] != 0 else current_prices.get(symbol, 0.0)
+                for i, symbol in enumerate(self.symbols)
+            ],
+            dtype=np.float64,
+        )
+
+    def valuate(self, prices: np.ndarray) -> np.ndarray | float:
+        """`symbols`の順に並んだ価格での総資産。`prices`が(bar数, シンボル数)の場合はbarごとの総資産を返す"""
+        return self.current_cash + np.asarray(prices, dtype=np.float64) @ self.volumes
 
     def get_current_total_assets(self, current_prices: dict[str, float]) -> float:
-        total_assets = self.current_cash
-        print(f"current cash : {self.current_cash}")
-        for pos in self.current_positions:
-            print(f"pos: {pos}, {current_prices[pos.symbol] * pos.volume}}}")
-            total_assets += current_prices[pos.symbol] * pos.volume
-        return total_assets
+        return float(self.valuate(self.price_vector(current_prices)))
 
     def calc_trade_volume(self, symbol: str, price: float, volume: float, fee: float) -> float:
         """要求されたトレードの取引量に対して、実際に取引可能な量を計算して返す"""
         tradable_volume = 0  # 取引可能量
-        for pos in self.current_positions:
-            if (pos.symbol == symbol) and pos.volume * volume < 0:
-                tradable_volume = (
-                    -pos.volume * 2
-                )  # 反対トレード + （反対トレードで得た資金を使った）新規トレード
-                if abs(volume) < abs(tradable_volume):
-                    tradable_volume = volume
-                break
+        index = self.symbol_index.get(symbol)
+        position_volume = self._volumes[index] if index is not None else 0.0
+        if position_volume * volume < 0:
+            # 反対トレード + （反対トレードで得た資金を使った）新規トレード
+            tradable_volume = -position_volume * 2
+            if abs(volume) < abs(tradable_volume):
+                tradable_volume = volume
 
         if abs(tradable_volume) < abs(volume):
             cost = price * abs(volume - tradable_volume) * (1.0 + fee)
             if cost <= self.current_cash:
                 tradable_volume = volume
 
-        return tradable_volume
+        return float(tradable_volume)
 
     def get_target_position(self, symbol: str) -> Position:
-        for pos in self.current_positions:
-            if pos.symbol == symbol:
-                return pos
+        self._index(symbol)
+        return Position(self, symbol)
 
-        position = Position(symbol=symbol, volume=0)
-        self.current_positions.append(position)
-        return position
+    def update_wallet(self, order: Order | TradeHistory):
+        self.update_wallet_batch([order])
 
-    def update_wallet(self, order: Order):
-        position = self.get_target_position(order.symbol)
-        # positionの増減
-        position.volume += order.volume
-        # 現金の増減
-        self.current_cash -= order.volume * order.price
-        # 手数料
-        fee = abs(order.volume) * order.price * order.fee
-        self.current_cash -= fee
-        if self.current_cash < 0:
+    def update_wallet_batch(self, orders: list[Order | TradeHistory]):
+        """複数の約定をまとめて反映する。現金が不足する場合は何も反映せずにRuntimeErrorを送出する"""
+        if len(orders) == 0:
+            return
+        volume = np.array([order.volume for order in orders], dtype=np.float64)
+        price = np.array([order.price for order in orders], dtype=np.float64)
+        fee_rate = np.array([order.fee for order in orders], dtype=np.float64)
+        # 現金の増減と手数料
+        cash = self.current_cash - volume @ price - np.abs(volume) @ (price * fee_rate)
+        if cash < 0:
             raise RuntimeError("Failed to update wallet")
-
-        print(f"Update wallet: {position}, {self.current_cash}, {fee}")
+        # 反映できることを確認してから新しいsymbolを追加する
+        index = np.array([self._index(order.symbol) for order in orders])
+        # positionの増減
+        np.add.at(self._volumes, index, volume)
+        self.current_cash = float(cash)
@@ -4,3 +4,5 @@
 from .base_order import BaseOrder
 from .leverage_order import LeverageOrder
 from .order import Order
+from .journal import OrderJournal
+from .order_state import OrderState
@@ -3,6 +3,9 @@
 
 from pydantic import BaseModel
 
+from ..utils import gmo
+from .order_state import OrderState
+
 
 class BaseOrder(BaseModel):
     symbol: str
@@ -10,28 +13,54 @@ class BaseOrder(BaseModel):
     closed: bool = False
 
     @staticmethod
-    def new_order(symbol: str, price: float, volume: float, losscut_price: float):
+    def new_order(
+        symbol: str, price: float, volume: float, losscut_price: float, state: OrderState | None = None
+    ):
+        raise NotImplementedError
+
+    def is_closed(self, state: OrderState | None = None):
         raise NotImplementedError
 
-    def is_closed(self):
+    def losscut(self, state: OrderState | None = None):
         raise NotImplementedError
 
-    def losscut(self):
+    def cancel_order(self, order_id: str | None = None, state: OrderState | None = None):
         raise NotImplementedError
 
-    def cancel_order(self, order_id: str | None = None):
+    def check_losscut(self, current_price: float, state: OrderState | None = None):
         raise NotImplementedError
 
-    def check_losscut(self, current_price: float):
+    def update_target_price(self, target_price: float, state: OrderState | None = None):
         raise NotImplementedError
 
-    def update_target_price(self, target_price: float):
+    def summary(self, state: OrderState | None = None) -> list[dict]:
         raise NotImplementedError
 
-    def summary(self):
+    def order_ids(self) -> list[str]:
+        """この注文に関連する全ての注文IDを返す"""
         raise NotImplementedError
 
-    def __del__(self):
-        # object消滅時には注文をキャンセルする
-        self.cancel_order()
-        self.losscut()
+    @staticmethod
+    def _is_order_finished(order_id: str, state: OrderState | None) -> bool:
+        """`state`が与えられた場合はスナップショットを、そうでない場合はAPIを参照する"""
+        if state is None:
+            return gmo.is_order_finished(order_id)
+        return state.is_order_finished(order_id)
+
+    @staticmethod
+    def _calc_executed_volume(order_id: str, state: OrderState | None) -> float:
+        if state is None:
+            return gmo.calc_executed_volume(order_id)
+        return state.calc_executed_volume(order_id)
+
+    @staticmethod
+    def _get_executions(order_id: str, state: OrderState | None) -> list[dict]:
+        if state is None:
+            return gmo.get_executions(order_id)
+        return state.get_executions(order_id)
+
+    @staticmethod
+    def _get_open_positions(order_id: str, state: OrderState | None) -> list[dict]:
+        if state is None:
+            return gmo.get_open_positions(order_id)
+        return state.get_open_positions(order_id)
@@ -0,0 +1,103 @@
+"""journal.py
+"""
+
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from .base_order import BaseOrder
+from .leverage_order import LeverageOrder
+from .order import Order
+
+ORDER_TYPES: dict[str, type[BaseOrder]] = {"Order": Order, "LeverageOrder": LeverageOrder}
+
+NEW = "new"
+UPDATE = "update"
+CLOSED = "closed"
+
+
+class OrderJournal:
+    """注文の状態の変化を追記していくSQLite(WAL)のjournal。
+    プロセスが落ちても、再起動時に`load_open`で終了していない注文を復元できる。
+    同じ状態を続けて記録しようとした場合は書き込まないので、価格の更新ごとに`record`を呼んでも良い。
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")  # WALではプロセスが落ちても書き込みは失われない
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS order_events (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                time REAL NOT NULL,
+                owner TEXT NOT NULL,
+                order_id TEXT NOT NULL,
+                event TEXT NOT NULL,
+                order_type TEXT NOT NULL,
+                data TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS order_events_owner ON order_events (owner, order_id, seq)"
+        )
+        self._last: dict[tuple[str, str], str] = {}  # (owner, order_id) -> 最後に記録した状態
+        self._lock = threading.Lock()
+
+    def record(self, owner: str, order: BaseOrder, event: str = UPDATE):
+        """`owner`(`Trader0`ごとのkey)の注文の状態を記録する"""
+        order_id = order.order_ids()[0]
+        data = order.model_dump_json()
+        key = (owner, order_id)
+        with self._lock:
+            if event != CLOSED and self._last.get(key) == data:
+                return
+            self._conn.execute(
+                "INSERT INTO order_events (time, owner, order_id, event, order_type, data) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (time.time(), owner, order_id, event, type(order).__name__, data),
+            )
+            if event == CLOSED:
+                self._last.pop(key, None)
+            else:
+                self._last[key] = data
+
+    def load_open(self, owner: str | None = None) -> list[BaseOrder]:
+        """`owner`の注文のうち、最後の記録が終了でないものを記録順に復元する。Noneの場合は全ての`owner`の注文"""
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT owner, order_id, order_type, data FROM order_events
+                WHERE seq IN (
+                    SELECT MAX(seq) FROM order_events WHERE ? IS NULL OR owner = ? GROUP BY owner, order_id
+                )
+                AND event != ?
+                ORDER BY seq
+                """,
+                (owner, owner, CLOSED),
+            ).fetchall()
+            orders = []
+            for order_owner, order_id, order_type, data in rows:
+                orders.append(ORDER_TYPES[order_type].model_validate_json(data))
+                self._last[(order_owner, order_id)] = data
+        return orders
+
+    def compact(self):
+        """終了した注文の記録と、各注文の最新以外の記録を削除する"""
+        with self._lock:
+            self._conn.execute(
+                """
+                DELETE FROM order_events WHERE seq NOT IN (
+                    SELECT MAX(seq) FROM order_events GROUP BY owner, order_id
+                ) OR event = ?
+                """,
+                (CLOSED,),
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
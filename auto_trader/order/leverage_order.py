@@ -4,6 +4,7 @@
 from ..logging import logger
 from ..utils import gmo
 from .base_order import BaseOrder
+from .order_state import OrderState
 
 
 class LeverageOrder(BaseOrder):
@@ -17,11 +18,15 @@ class LeverageOrder(BaseOrder):
     closed: bool = False
 
     @staticmethod
-    def new_order(symbol: str, price: float, volume: float, losscut_price: float):
+    def new_order(
+        symbol: str, price: float, volume: float, losscut_price: float, state: OrderState | None = None
+    ):
         order = gmo.post_order(symbol, price, volume)
         logger.info(
             f"New order : symbol = {symbol}, price = {price}, volume = {volume}, order_id = {order['data']}"
         )
+        if state is not None:
+            state.on_order_posted(order["data"])
         return LeverageOrder(
             symbol=symbol,
             order_id=order["data"],
@@ -29,46 +34,43 @@ class LeverageOrder(BaseOrder):
             side="BUY" if volume > 0 else "SELL",
         )
 
-    def is_closed(self):
+    def is_closed(self, state: OrderState | None = None):
         """注文がすべて終了状態で、持ち高が0の状態の場合はTrue、そうでない場合はFalse"""
         if self.closed:
             return self.closed
 
         def _is_closed():
-            if not gmo.is_order_finished(self.order_id):
+            if state is not None and state.is_stale(self.order_id):
+                return False  # 状態がまだスナップショットに反映されていない場合
+            if not self._is_order_finished(self.order_id, state):
                 return False  # 注文がまだ有効な場合
-            if len(gmo.get_open_positions(self.order_id)) > 0:
+            if len(self._get_open_positions(self.order_id, state)) > 0:
                 return False  # positionが残っている場合
             return True
 
         self.closed = _is_closed()
         return self.closed
 
-    def losscut(self):
+    def losscut(self, state: OrderState | None = None):
         """losscutを実行する
         Return:
             bool : Trueの場合は持ち高精算済み、そうでない場合（losscut注文発行）はFalse
         """
-        self.cancel_order()  # 注文が有効な場合はキャンセル
+        self.cancel_order(state=state)  # 注文が有効な場合はキャンセル
 
         if len(self.close_order_ids) > 0:  # 反対取引の注文が発行されている場合
             for order in self.close_order_ids:
-                self.cancel_order(order)
+                self.cancel_order(order, state=state)
 
-        open_positions = gmo.get_open_positions(self.order_id)
+        open_positions = self._get_open_positions(self.order_id, state)
         if len(open_positions) == 0:
-            self.closed = True
-            return True
+            if state is None or not state.is_stale(self.order_id):
+                self.closed = True
+                return True
+            return False
 
-        for pos in open_positions:
-            res = gmo.post_leverage_close_order(
-                symbol=pos["symbol"],
-                price=-1.0,
-                volume=pos["size"],
-                position_id=pos["positionId"],
-                side="SELL" if pos["side"] == "BUY" else "BUY",
-            )
-            self.close_order_ids.append(res["data"]["orderId"])
+        # 全ての建玉を成り行きでまとめて決済
+        self._post_close_order([(pos, pos["size"]) for pos in open_positions], -1.0, state)
 
         logger.info(
             "losscut order issued : original order_id = {}, close_order_ids = {}".format(
@@ -77,66 +79,77 @@ class LeverageOrder(BaseOrder):
         )
         return False
 
-    def check_losscut(self, current_price: float):
+    def check_losscut(self, current_price: float, state: OrderState | None = None):
         """losscutの条件を満たしているか確認し、満たしている場合はlosscutを実行する"""
-        if self.is_closed():
+        if self.is_closed(state):
             return
 
         if current_price < self.losscut_price:
-            self.losscut()
+            self.losscut(state)
 
-    def cancel_order(self, order_id=None):
+    def cancel_order(self, order_id=None, state: OrderState | None = None):
         """注文をキャンセルする"""
         if order_id is None:
             order_id = self.order_id
-        if not gmo.is_order_finished(order_id):
+        if not self._is_order_finished(order_id, state):
             gmo.private_api("/v1/cancelOrder", parameters={"orderId": order_id}, method="POST")
+            if state is not None:
+                state.on_order_canceled(order_id)
             logger.debug("Order canceled : order_id = {}".format(order_id))
 
-    def update_target_price(self, target_price: float):
-        """利益確定注文の価格を変更する"""
-        if self.is_closed():
+    def update_target_price(self, target_price: float, state: OrderState | None = None):
+        """利益確定注文の価格を変更する。
+        有効な決済注文は`/v1/changeOrder`で価格だけを変更するので、決済注文の無い時間が発生しない。
+        変更できなかった場合は、決済注文を全てキャンセルして発行し直す。
+        """
+        if self.is_closed(state):
             return
 
-        # 注文中の決済取引を一旦全てキャンセル
-        for order in self.close_order_ids:
-            self.cancel_order(order)
-
-        # 現在の未決済ポジションを取得
-        open_positions = gmo.get_open_positions(self.order_id)
-        if len(open_positions) == 0:
+        open_positions = self._get_open_positions(self.order_id, state)
+        active_ids = [i for i in self.close_order_ids if not self._is_order_finished(i, state)]
+        try:
+            for close_order_id in active_ids:
+                gmo.change_order(close_order_id, target_price)
+        except RuntimeError:
+            logger.warning("Failed to change close orders : order_id = {}".format(self.order_id))
+            for close_order_id in active_ids:
+                self.cancel_order(close_order_id, state=state)
+            self._post_close_order([(pos, pos["size"]) for pos in open_positions], target_price, state)
             return
 
-        # 決済取引を再度発行
+        # 発行直後の決済注文の数量はスナップショットの建玉に反映されていないので、次回に確認する
+        if state is not None and any(state.is_stale(i) for i in active_ids):
+            return
+        # 決済注文の無い建玉(新規注文の追加の約定など)の決済注文を発行
+        uncovered = []
         for pos in open_positions:
-            self.close_order_ids.append(
-                gmo.post_leverage_close_order(
-                    symbol=pos["symbol"],
-                    price=target_price,
-                    volume=pos["size"],
-                    position_id=pos["positionId"],
-                    side="SELL" if pos["side"] == "BUY" else "BUY",
-                )["data"]
-            )
-            logger.debug(
-                "Update target price : order_id = {}, target_price = {}, volume = {}, position_id = {}".format(
-                    self.order_id, target_price, pos["size"], pos["positionId"]
-                )
-            )
-
-    def summary(self):
-        executions = []
-        res = gmo.private_api("/v1/executions", parameters={"orderId": self.order_id}, method="GET")
-        if "list" in res["data"]:
-            executions += res["data"]["list"]
-
-        for order_id in self.close_order_ids:
-            res = gmo.private_api(
-                "/v1/executions",
-                parameters={"orderId": order_id},
-                method="GET",
-            )
-            if "list" in res["data"]:
-                executions += res["data"]["list"]
+            size = round(float(pos["size"]) - float(pos.get("orderdSize", 0)), 8)
+            if size > 0:
+                uncovered.append((pos, size))
+        self._post_close_order(uncovered, target_price, state)
+        logger.debug(
+            "Update target price : order_id = {}, target_price = {}".format(self.order_id, target_price)
+        )
 
-        return executions
+    def _post_close_order(
+        self, positions: list[tuple[dict, str | float]], price: float, state: OrderState | None
+    ):
+        """(建玉, 数量)を`price`で決済する注文を発行する。`price`が負の場合は成り行き"""
+        for i in range(0, len(positions), gmo.MAX_SETTLE_POSITIONS):
+            chunk = positions[i : i + gmo.MAX_SETTLE_POSITIONS]
+            close_order_id = gmo.post_leverage_close_positions(
+                symbol=self.symbol,
+                price=price,
+                positions=[(pos["positionId"], size) for pos, size in chunk],
+                side="SELL" if chunk[0][0]["side"] == "BUY" else "BUY",
+            )["data"]
+            self.close_order_ids.append(close_order_id)
+            if state is not None:
+                state.on_order_posted(close_order_id)
+
+    def order_ids(self) -> list[str]:
+        return [self.order_id, *self.close_order_ids]
+
+    def summary(self, state: OrderState | None = None):
+        """この注文と決済注文の約定を返す"""
+        return sum([self._get_executions(order_id, state) for order_id in self.order_ids()], [])
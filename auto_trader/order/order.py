@@ -4,6 +4,7 @@
 from ..logging import logger
 from ..utils import gmo
 from .base_order import BaseOrder
+from .order_state import OrderState
 
 
 class Order(BaseOrder):
@@ -17,8 +18,12 @@ class Order(BaseOrder):
     closed: bool = False
 
     @staticmethod
-    def new_order(symbol: str, price: float, volume: float, losscut_price: float):
+    def new_order(
+        symbol: str, price: float, volume: float, losscut_price: float, state: OrderState | None = None
+    ):
         order = gmo.post_order(symbol, price, volume)
+        if state is not None:
+            state.on_order_posted(order["data"])
         return Order(
             symbol=symbol,
             order_id=order["data"],
@@ -26,22 +31,26 @@ class Order(BaseOrder):
             side="BUY" if volume > 0 else "SELL",
         )
 
-    def is_closed(self):
+    def is_closed(self, state: OrderState | None = None):
         """注文がすべて終了状態で、持ち高が0の状態の場合はTrue、そうでない場合はFalse"""
         if self.closed:
             return self.closed
 
         def _is_closed():
-            if not gmo.is_order_finished(self.order_id):
+            if state is not None and (
+                state.is_stale(self.order_id) or state.is_stale(self.close_order_id)
+            ):
+                return False  # 状態がまだスナップショットに反映されていない場合
+            if not self._is_order_finished(self.order_id, state):
                 return False  # 注文がまだ有効な場合
-            executed = gmo.calc_executed_volume(self.order_id)
+            executed = self._calc_executed_volume(self.order_id, state)
             if abs(executed) < 1e-5:
                 return True  # 持ち高が0の場合
             if self.close_order_id == "":
                 return False  # 持ち高がある状態で、反対取引が発行されていない
-            if not gmo.is_order_finished(self.close_order_id):
+            if not self._is_order_finished(self.close_order_id, state):
                 return False  # 反対取引が有効な場合
-            executed -= gmo.calc_executed_volume(self.close_order_id)
+            executed += self._calc_executed_volume(self.close_order_id, state)
             if abs(executed) < 1e-5:
                 return True  # 反対取引が約定済みで持ち高が0の場合
             return False  # 反対取引は約定済みだが持ち高がまだある場合
@@ -49,63 +58,65 @@ class Order(BaseOrder):
         self.closed = _is_closed()
         return self.closed
 
-    def losscut(self):
+    def losscut(self, state: OrderState | None = None):
         """losscutを実行する
         Return:
             bool : Trueの場合は持ち高精算済み、そうでない場合（losscut注文発行）はFalse
         """
-        self.cancel_order()  # 注文が有効な場合はキャンセル
-        executed = gmo.calc_executed_volume(self.order_id)
+        self.cancel_order(state=state)  # 注文が有効な場合はキャンセル
+        executed = self._calc_executed_volume(self.order_id, state)
 
         if self.close_order_id != "":  # 反対取引の注文が発行されている場合
-            self.cancel_order(self.close_order_id)
-            executed -= gmo.calc_executed_volume(self.order_id)
+            self.cancel_order(self.close_order_id, state=state)
+            executed += self._calc_executed_volume(self.close_order_id, state)
 
         if abs(executed) < 1e-5:
-            self.closed = True
-            return True
-        self.close_order_id = gmo.post_order(
-            symbol=self.symbol, price=-1.0, volume=-executed
-        )  # losscutは成り行きで実行
+            if state is None or not state.is_stale(self.order_id):
+                self.closed = True
+                return True
+            return False
+        # losscutは成り行きで実行
+        self.close_order_id = gmo.post_order(symbol=self.symbol, price=-1.0, volume=-executed)["data"]
+        if state is not None:
+            state.on_order_posted(self.close_order_id)
         return False
 
-    def check_losscut(self, current_price: float):
+    def check_losscut(self, current_price: float, state: OrderState | None = None):
         """losscutの条件を満たしているか確認し、満たしている場合はlosscutを実行する"""
-        if self.is_closed():
+        if self.is_closed(state):
             return
 
         if current_price < self.losscut_price:
-            self.losscut()
+            self.losscut(state)
 
-    def cancel_order(self, order_id=None):
+    def cancel_order(self, order_id=None, state: OrderState | None = None):
         """注文をキャンセルする"""
         if order_id is None:
             order_id = self.order_id
-        if not gmo.is_order_finished(order_id):
+        if not self._is_order_finished(order_id, state):
             gmo.private_api("/v1/cancelOrder", parameters={"orderId": order_id}, method="POST")
+            if state is not None:
+                state.on_order_canceled(order_id)
 
-    def update_target_price(self, target_price: float):
+    def update_target_price(self, target_price: float, state: OrderState | None = None):
         """利益確定注文の価格を変更する"""
-        if self.is_closed():
+        if self.is_closed(state):
             return
 
-        executed = gmo.calc_executed_volume(self.order_id)
+        executed = self._calc_executed_volume(self.order_id, state)
         if self.close_order_id != "":
-            self.cancel_order(self.close_order_id)
-            executed -= gmo.calc_executed_volume(self.close_order_id)
+            self.cancel_order(self.close_order_id, state=state)
+            executed += self._calc_executed_volume(self.close_order_id, state)
 
-        self.close_order_id = gmo.post_order(self.symbol, target_price, executed)["data"]["orderId"]
+        self.close_order_id = gmo.post_order(self.symbol, target_price, -executed)["data"]
+        if state is not None:
+            state.on_order_posted(self.close_order_id)
 
-    def summary(self):
-        executions = []
-        res = gmo.private_api("/v1/executions", parameters={"orderId": self.order_id}, method="POST")
-        executions += res["data"]["list"]
+    def order_ids(self) -> list[str]:
+        if self.close_order_id == "":
+            return [self.order_id]
+        return [self.order_id, self.close_order_id]
 
-        if self.close_order_id != "":
-            res = gmo.private_api(
-                "/v1/executions",
-                parameters={"orderId": self.close_order_id},
-                method="POST",
-            )
-            executions += res["data"]["list"]
-        return executions
+    def summary(self, state: OrderState | None = None):
+        """この注文と決済注文の約定を返す"""
+        return sum([self._get_executions(order_id, state) for order_id in self.order_ids()], [])
@@ -0,0 +1,143 @@
+"""order_state.py
+"""
+
+import contextvars
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ..utils import gmo
+
+
+class OrderState:
+    """1シンボル分の有効な注文・建玉・約定を1回のポーリングでまとめて取得し、orderId/positionIdで引けるようにする。
+    各注文の状態確認はこのスナップショットを参照するので、`refresh`1回あたりのAPI呼び出し回数は注文数によらない。
+
+    `refresh`後に発注・キャンセルした注文は、次の`refresh`までは状態が未確定(`is_stale`)として扱う。
+    """
+
+    def __init__(self, symbol: str, max_execution_pages: int = 10):
+        self.symbol = symbol
+        self.max_execution_pages = max_execution_pages
+        self.active_orders: dict[str, dict] = {}  # orderId -> order
+        self.positions: dict[int, dict] = {}  # positionId -> position
+        self.executions: dict[str, list[dict]] = {}  # orderId -> executions
+        self.position_ids: dict[str, dict[int, None]] = {}  # orderId -> 約定で建てた/決済したpositionId
+        self.updated_at: datetime.datetime | None = None
+        self._execution_ids: set[int] = set()
+        self._posted_order_ids: set[str] = set()  # refresh後に発注した注文
+        self._canceled_order_ids: set[str] = set()  # refresh後にキャンセルした注文
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2)
+
+    def refresh(self):
+        """有効な注文、建玉、直近の約定を取得してスナップショットを更新する"""
+        # 取得中に別スレッドで発注・キャンセルされた注文は今回の結果に含まれない可能性があるので残す
+        with self._lock:
+            posted_order_ids = set(self._posted_order_ids)
+            canceled_order_ids = set(self._canceled_order_ids)
+
+        # 有効な注文を先に取得し、その後に建玉と約定を並行に取得する。
+        # 逆の順序だと、間に約定した注文が終了済みなのに建玉が無い状態に見え、決済前に終了と判定してしまう
+        active_orders = gmo.get_active_orders(self.symbol)
+        positions = self._executor.submit(
+            contextvars.copy_context().run, gmo.get_all_positions, self.symbol
+        )
+        executions = self._fetch_new_executions()
+        positions = positions.result()
+
+        with self._lock:
+            self.active_orders = {str(order["orderId"]): order for order in active_orders}
+            self.positions = {int(pos["positionId"]): pos for pos in positions}
+            self._add_executions(executions)
+            self._posted_order_ids -= posted_order_ids
+            self._canceled_order_ids -= canceled_order_ids
+            self.updated_at = datetime.datetime.now()
+
+    def _fetch_new_executions(self) -> list[dict]:
+        """前回の`refresh`以降の約定を取得する"""
+        executions = []
+        for page in range(1, self.max_execution_pages + 1):
+            data = gmo.get_latest_executions(self.symbol, page=page)
+            executions += data
+            if len(data) < 100 or any(int(d["executionId"]) in self._execution_ids for d in data):
+                break
+        return executions
+
+    def _add_executions(self, executions: list[dict]):
+        for data in executions:
+            execution_id = int(data["executionId"])
+            if execution_id in self._execution_ids:
+                continue
+            self._execution_ids.add(execution_id)
+            self.executions.setdefault(str(data["orderId"]), []).append(data)
+            if "positionId" in data:
+                self.position_ids.setdefault(str(data["orderId"]), {})[int(data["positionId"])] = None
+
+    def on_order_posted(self, order_id: str):
+        """`refresh`後に発注した注文を登録する"""
+        with self._lock:
+            self._posted_order_ids.add(str(order_id))
+
+    def on_order_canceled(self, order_id: str):
+        """`refresh`後にキャンセルした注文を登録する"""
+        with self._lock:
+            self._canceled_order_ids.add(str(order_id))
+
+    def is_stale(self, order_id: str) -> bool:
+        """`refresh`後に発注・キャンセルされ、スナップショットに反映されていない注文の場合はTrue"""
+        order_id = str(order_id)
+        return order_id in self._posted_order_ids or order_id in self._canceled_order_ids
+
+    def is_order_finished(self, order_id: str) -> bool:
+        """`order_id`の注文が終了状態かどうかを返す"""
+        order_id = str(order_id)
+        if order_id in self._canceled_order_ids:
+            return True
+        if order_id in self._posted_order_ids:
+            return False
+        return order_id not in self.active_orders
+
+    def get_executions(self, order_id: str) -> list[dict]:
+        """`order_id`の注文の約定を返す。
+        直近の約定に含まれない終了済みの古い注文の場合のみAPIから取得してキャッシュする。
+        """
+        order_id = str(order_id)
+        if order_id in self.executions:
+            return self.executions[order_id]
+        if not self.is_order_finished(order_id) or self.is_stale(order_id):
+            return []  # 有効な注文の約定は次回の`refresh`で取得される
+
+        executions = gmo.get_executions(order_id)
+        with self._lock:
+            self._add_executions(executions)
+            self.executions.setdefault(order_id, [])
+        return self.executions[order_id]
+
+    def calc_executed_volume(self, order_id: str) -> float:
+        """`order_id`の注文で約定済みの数量を求める"""
+        executed_volume = 0.0
+        for data in self.get_executions(order_id):
+            if data["side"] == "BUY":
+                executed_volume += float(data["size"])
+            elif data["side"] == "SELL":
+                executed_volume -= float(data["size"])
+        return executed_volume
+
+    def get_open_positions(self, order_id: str) -> list[dict]:
+        """`order_id`の注文の約定で建てたポジションのうち、未決済のものを返す"""
+        order_id = str(order_id)
+        self.get_executions(order_id)  # 古い注文の場合は約定を取得してindexに追加する
+        position_ids = self.position_ids.get(order_id, {})
+        return [self.positions[pid] for pid in position_ids if pid in self.positions]
+
+    def get_position(self, position_id: int) -> dict | None:
+        """`position_id`の建玉を返す。決済済みの場合はNone"""
+        return self.positions.get(int(position_id))
+
+    def forget(self, order_ids: list[str]):
+        """終了した注文の約定をスナップショットから削除する"""
+        with self._lock:
+            for order_id in order_ids:
+                self.executions.pop(str(order_id), None)
+                self.position_ids.pop(str(order_id), None)
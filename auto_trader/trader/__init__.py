@@ -2,3 +2,4 @@
 """
 
 from .trader0 import Trader0
+from .engine import TradingEngine
@@ -0,0 +1,189 @@
+"""engine.py
+"""
+
+import datetime
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from pathlib import Path
+
+from ..logging import enable_logging_to_file, logger
+from ..order import OrderJournal, OrderState
+from ..utils import gmo
+from ..utils.bar_aggregator import BarAggregator
+from ..utils.clock import Clock, SystemClock
+from ..utils.margin import SharedMargin
+from ..utils.metrics import registry as metrics
+from ..utils.ticker_feed import TickerFeed, TradeFeed
+from .trader0 import Trader0
+
+
+class TradingEngine:
+    """複数のシンボル・時間足の`Trader0`を1プロセスで動かす。
+    価格、取引余力、シンボルごとの注文・建玉の状態は1ループにつき1回だけ取得して全てのpipelineで共有する。
+    barの確定時の処理はスレッドプールで並行に実行するので、同時刻に確定するbarの処理が直列にならない。
+    """
+
+    def __init__(
+        self,
+        model_path: Path,
+        log_dir: Path,
+        wait_second: int = 1,
+        max_workers: int = 16,
+        use_ticker_feed: bool = False,
+        use_trade_feed: bool = False,
+        clock: Clock | None = None,
+        journal_path: Path | None = None,
+        snapshot_dir: Path | None = None,
+    ):
+        self.model_path = model_path
+        self.log_dir = log_dir
+        self.wait_second = wait_second
+        self.use_ticker_feed = use_ticker_feed
+        self.use_trade_feed = use_trade_feed
+        self.clock = SystemClock() if clock is None else clock
+        # 全てのpipelineの注文を1つのjournalに記録する
+        self.journal = OrderJournal(journal_path) if journal_path is not None else None
+        # pipelineごとに終了時のbarと特徴量を保存し、再起動時に読み込む
+        self.snapshot_dir = snapshot_dir
+        self.pipelines: list[Trader0] = []
+        self.order_states: dict[str, OrderState] = {}
+        self.shared_margin = SharedMargin()
+        self.ticker_feed: TickerFeed | None = None
+        self.bar_aggregators: dict[str, BarAggregator] = {}
+        self.is_running = False
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        # barの処理は別のスレッドプールで実行し、refreshとlosscutがbarの処理の後ろで待たないようにする
+        self._bar_executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._bar_futures: dict[int, Future] = {}
+
+    def add_pipeline(self, symbol: str, interval: datetime.timedelta, **kwargs) -> Trader0:
+        """`symbol`, `interval`の売買ロジックを追加する"""
+        if symbol not in self.order_states:
+            self.order_states[symbol] = OrderState(symbol)
+        if self.snapshot_dir is not None:
+            interval_str = gmo.convert_timedelta_to_str(interval)
+            kwargs.setdefault("snapshot_path", self.snapshot_dir / f"{symbol}_{interval_str}.pkl")
+        # modelは同じ`model_path`の全てのpipelineで共有し、起動時にバックグラウンドで読み込む
+        trader = Trader0(
+            symbol,
+            interval,
+            self.model_path,
+            self.log_dir,
+            wait_second=self.wait_second,
+            order_state=self.order_states[symbol],
+            shared_margin=self.shared_margin,
+            clock=self.clock,
+            journal=self.journal,
+            **kwargs,
+        )
+        self.pipelines.append(trader)
+        return trader
+
+    def refresh(self) -> dict[str, float]:
+        """価格、取引余力、全シンボルの注文・建玉の状態を並行に取得する"""
+        futures = [self._executor.submit(state.refresh) for state in self.order_states.values()]
+        futures.append(self._executor.submit(self.shared_margin.refresh))
+        if self.ticker_feed is not None and all(
+            self.ticker_feed.is_alive(symbol) for symbol in self.order_states
+        ):
+            prices = dict(self.ticker_feed.last_prices)
+        else:
+            res = gmo.public_api("/v1/ticker")["data"]
+            prices = {data["symbol"]: float(data["last"]) for data in res}
+        for future in futures:
+            future.result()
+        return prices
+
+    def schedule_new_bars(self):
+        """barが確定したpipelineの処理をスレッドプールに投入する。前のbarの処理中の場合は終わるまで待つ"""
+        for trader in self.pipelines:
+            future = self._bar_futures.get(id(trader))
+            if future is not None:
+                if not future.done():
+                    continue
+                future.result()  # 例外が発生していた場合は送出する
+                del self._bar_futures[id(trader)]
+            if trader.scheduler.bar_due():
+                self._bar_futures[id(trader)] = self._bar_executor.submit(trader.on_new_tick_added)
+
+    def seconds_until_next(self, deadline: float) -> float:
+        """`deadline`(`clock.monotonic`の時刻)か、処理中でないpipelineの次のbarの境界までの秒数"""
+        seconds = deadline - self.clock.monotonic()
+        now = self.clock.now()
+        for trader in self.pipelines:
+            if id(trader) not in self._bar_futures:
+                seconds = min(seconds, (trader.scheduler.next_wall - now).total_seconds())
+        return max(0.0, seconds)
+
+    def run_loop(self):
+        self.is_running = True
+        date_str = self.clock.now().isoformat()
+        enable_logging_to_file(self.log_dir / f"engine_{date_str}.log")
+        for trader in self.pipelines:
+            interval_str = gmo.convert_timedelta_to_str(trader.interval)
+            trader.start_history(
+                self.log_dir / f"trade_history_{trader.symbol}_{interval_str}_{date_str}"
+            )
+        logger.debug("Start trading engine : {} pipelines".format(len(self.pipelines)))
+
+        if self.use_trade_feed:
+            self.ticker_feed = self._create_trade_feed()
+        elif self.use_ticker_feed:
+            self.ticker_feed = TickerFeed(list(self.order_states.keys()))
+        if self.ticker_feed is not None:
+            for trader in self.pipelines:
+                trader.ticker_feed = self.ticker_feed
+                self.ticker_feed.add_listener(trader.on_price_updated)
+            self.ticker_feed.start_subscribe()
+        for future in [self._executor.submit(trader.warm_start) for trader in self.pipelines]:
+            future.result()
+        metrics.log_summary(prefix="startup.")
+
+        while self.is_running:
+            deadline = self.clock.monotonic() + self.wait_second
+            with metrics.timer("engine.loop"):
+                with metrics.timer("engine.refresh"):
+                    prices = self.refresh()
+                # WebSocketで価格を受信できていないシンボルのpipelineはpollingでlosscutのチェック
+                polling = [trader for trader in self.pipelines if not trader.feed_is_alive()]
+                if len(polling) > 0:
+                    with metrics.timer("engine.losscut"):
+                        wait([self._executor.submit(trader.losscut, prices) for trader in polling])
+
+                self.schedule_new_bars()
+
+                with metrics.timer("engine.close_detection"):
+                    for trader in self.pipelines:
+                        trader.log_closed_orders(trader.pop_closed_orders())
+            metrics.maybe_log_summary()
+
+            # 次の定期処理か、いずれかのpipelineのbarの境界のうち早い方まで待つ
+            self.clock.sleep(self.seconds_until_next(deadline))
+
+        wait(list(self._bar_futures.values()))
+        if self.ticker_feed is not None:
+            self.ticker_feed.stop_subscribe()
+        for trader in self.pipelines:
+            trader.save_snapshot()
+            trader.cancel_all_orders()
+            trader.stop_history()
+        if self.journal is not None:
+            self.journal.compact()
+            self.journal.close()
+        logger.debug("Stop trading engine")
+
+    def _create_trade_feed(self) -> TradeFeed:
+        """tradesチャンネルを1本だけ購読し、シンボルごとに全ての時間足のbarをまとめて作成する"""
+        feed = TradeFeed(list(self.order_states.keys()))
+        for symbol in self.order_states:
+            traders = [trader for trader in self.pipelines if trader.symbol == symbol]
+            intervals = sorted({trader.interval for trader in traders})
+            capacity = max(trader.data_length for trader in traders)
+            aggregator = BarAggregator(symbol, intervals, capacity=capacity)
+            feed.add_trade_listener(aggregator.on_trade)
+            for trader in traders:
+                trader.bar_aggregator = aggregator
+            self.bar_aggregators[symbol] = aggregator
+        return feed
+
+    def stop_loop(self):
+        self.is_running = False
@@ -2,17 +2,29 @@
 """
 
 import asyncio
+import contextvars
 import datetime
+import functools
 import pickle
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import polars as pl
 
-import stock
 from ..logging import enable_logging_to_file, logger
-from ..order import BaseOrder, LeverageOrder, Order
+from ..order import BaseOrder, LeverageOrder, Order, OrderJournal, OrderState
+from ..order.journal import CLOSED, NEW, ORDER_TYPES, UPDATE
 from ..utils import gmo, history
+from ..utils.bar_aggregator import BarAggregator
+from ..utils.bar_buffer import BarBuffer
+from ..utils.clock import BarScheduler, Clock, SystemClock
+from ..utils.indicators import StreamingFeatures
+from ..utils.margin import SharedMargin
+from ..utils.metrics import registry as metrics
+from ..utils.rate_limiter import Priority, priority
+from ..utils.ticker_feed import TickerFeed
 
 train_features = sorted(
     [
@@ -69,17 +81,49 @@ train_features = sorted(
     ]
 )
 
+# 保存したbarからこれ以上経過している場合はsnapshotを使わずに全て取得し直す
+MAX_SNAPSHOT_AGE = datetime.timedelta(days=1)
+
+_model_lock = threading.Lock()
+_models: dict[Path, object] = {}
+
+
+@functools.cache
+def import_stock():
+    """`stock`はsklearnとTA-Libをimportするので、起動時ではなく最初に特徴量を計算する時にimportする"""
+    with metrics.timer("startup.import_stock"):
+        import stock
+    return stock
+
+
+def load_model(model_path: Path):
+    """modelを読み込む。同じpathのmodelは1度だけ読み込み、全ての`Trader0`で共有する"""
+    with _model_lock:
+        if model_path not in _models:
+            with metrics.timer("startup.load_model"), open(model_path, "rb") as f:
+                _models[model_path] = pickle.load(f)
+        return _models[model_path]
+
 
 def fetch_df(
     symbol: str,
     interval: datetime.timedelta,
-    start_date: datetime.datetime = datetime.datetime.now(),
+    start_date: datetime.datetime | None = None,
     min_length: int = 30,
+    now: datetime.datetime | None = None,
 ):
-    df = gmo.get_ohlc(symbol, interval, date=start_date)
-    while len(df) < min_length:
+    if now is None:
+        now = datetime.datetime.now()
+    if start_date is None:
+        start_date = now
+    # 1日ずつ遡って取得し、最後に1回だけ結合する
+    frames = [gmo.get_ohlc(symbol, interval, date=start_date, now=now)]
+    length = len(frames[0])
+    while length < min_length:
         start_date -= datetime.timedelta(days=1)
-        df = df.vstack(gmo.get_ohlc(symbol, interval, date=start_date))
+        frames.append(gmo.get_ohlc(symbol, interval, date=start_date, now=now))
+        length += len(frames[-1])
+    df = pl.concat([frame for frame in frames if len(frame) > 0])
     df = df.sort(pl.col("datetime")).with_columns(
         pl.col("open").cast(pl.Float64),
         pl.col("high").cast(pl.Float64),
@@ -101,119 +145,543 @@ class Trader0:
         wait_second: int = 1,
         data_length: int = 100,
         volume: float = 0.01,
+        entry_atr_ratio: float = 0.8,
+        exit_atr_ratio: float = 0.8,
+        losscut_ratio: float = 0.92,
+        ticker_feed: TickerFeed | None = None,
+        model=None,
+        snapshot_path: Path | None = None,
+        order_state: OrderState | None = None,
+        shared_margin: SharedMargin | None = None,
+        streaming_features: bool = False,
+        verify_features: bool = False,
+        bar_aggregator: BarAggregator | None = None,
+        clock: Clock | None = None,
+        journal: OrderJournal | None = None,
     ):
         self.ORDER_TYPE = LeverageOrder if symbol in gmo.LEVERAGE_SYMBOLS else Order
         self.leverage = 2 if symbol in gmo.LEVERAGE_SYMBOLS else 1
         self.symbol = symbol
         self.interval = interval
         self.data_length = data_length
-        current = datetime.datetime.now()
-        interval_minutes = int(interval / datetime.timedelta(minutes=1))
-        next_wall_minute = (current.minute // interval_minutes + 1) * interval_minutes
-        offset = 1 if next_wall_minute > 59 else 0
-        next_wall_minute = next_wall_minute % 60
-        self.next_wall = datetime.datetime(
-            year=current.year,
-            month=current.month,
-            day=current.day,
-            hour=current.hour + offset,
-            minute=next_wall_minute,
-        )
+        self.bars = BarBuffer(data_length)
+        # 特徴量をbarごとに差分更新する場合は`StreamingFeatures`を使う
+        self.features = StreamingFeatures() if streaming_features else None
+        self.verify_features = verify_features
+        # WebSocketの約定からbarを作成している場合は、klinesのAPIの代わりに使う
+        self.bar_aggregator = bar_aggregator
+        # 時刻の取得と待機は全て`clock`を通すので、シミュレーションの時計に差し替えて再生できる
+        self.clock = SystemClock() if clock is None else clock
+        self.scheduler = BarScheduler(self.clock, interval, wait_second)
         self.orders: list[BaseOrder] = []
+        self.order_state = OrderState(symbol) if order_state is None else order_state
+        self.shared_margin = shared_margin
+        self._orders_lock = threading.Lock()
+        self._order_locks: dict[int, threading.Lock] = {}
+        self.history_writer: history.HistoryWriter | None = None
+        # 注文の状態の変化を記録し、再起動時に復元する
+        self.journal = journal
+        self.journal_key = f"{symbol}_{gmo.convert_timedelta_to_str(interval)}"
         self.wait_second = wait_second
         self.log_dir = log_dir
         self.volume = volume
+        # 売買ロジックのパラメータ。`backtest.BacktestConfig`と同じ意味
+        self.entry_atr_ratio = entry_atr_ratio
+        self.exit_atr_ratio = exit_atr_ratio
+        self.losscut_ratio = losscut_ratio
 
         self.is_running = False
 
-        # modelの読み込み
-        with open(model_path, "rb") as f:
-            self.model = pickle.load(f)
+        # WebSocketで価格を受信している場合は、価格の更新ごとにlosscutをチェックする
+        self.ticker_feed = ticker_feed
+        if ticker_feed is not None:
+            ticker_feed.add_listener(self.on_price_updated)
+
+        # modelは最初の予測までにバックグラウンドで読み込む
+        self.model_path = model_path
+        self._model = model
+        # 終了時にbarと特徴量の状態を保存し、再起動時には足りないbarだけ取得する
+        self.snapshot_path = snapshot_path
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = load_model(self.model_path)
+        return self._model
 
-    def losscut(self):
+    def preload(self):
+        """modelと`stock`の読み込みをバックグラウンドで開始する。その間にbarの取得を進められる"""
+
+        def _load():
+            try:
+                self.model
+                if self.features is None or self.verify_features:
+                    import_stock()
+            except Exception:
+                logger.exception("Failed to preload model")  # 予測時に改めて読み込んで例外を送出する
+
+        threading.Thread(target=_load, daemon=True).start()
+
+    def fetch_latest_prices(self) -> dict[str, float]:
+        """全シンボルの最新の価格を取得する"""
+        if self.feed_is_alive():
+            return dict(self.ticker_feed.last_prices)
+        return {data["symbol"]: float(data["last"]) for data in gmo.public_api("/v1/ticker")["data"]}
+
+    def losscut(self, prices: dict[str, float] | None = None):
         """毎ステップ実行するlosscutチェック"""
         # 最新の価格を更新
-        latest_data = gmo.public_api("/v1/ticker")["data"]
-        for order in self.orders:
-            for data in latest_data:
-                if data["symbol"] == order.symbol:
-                    order.check_losscut(float(data["last"]))
-                    break
+        if prices is None:
+            prices = self.fetch_latest_prices()
+        for order in list(self.orders):
+            self.check_losscut(order, prices)
+
+    def feed_is_alive(self) -> bool:
+        return self.ticker_feed is not None and self.ticker_feed.is_alive(self.symbol)
+
+    def on_price_updated(self, symbol: str, price: float):
+        """WebSocketで価格を受信した際のlosscutチェック"""
+        for order in list(self.orders):
+            if order.symbol != symbol:
+                continue
+            lock = self._order_lock(order)
+            if not lock.acquire(blocking=False):
+                continue  # 目標価格の更新中の場合は次の価格の更新時にチェックする
+            try:
+                with priority(Priority.LOSSCUT):
+                    order.check_losscut(price, state=self.order_state)
+                    self._record(order)
+            finally:
+                lock.release()
+
+    def check_losscut(self, order: BaseOrder, prices: dict[str, float]):
+        if order.symbol not in prices:
+            return
+        lock = self._order_lock(order)
+        if not lock.acquire(blocking=False):
+            return  # 目標価格の更新中の場合は次のループでチェックし、他の注文のチェックを待たせない
+        try:
+            with priority(Priority.LOSSCUT):
+                order.check_losscut(prices[order.symbol], state=self.order_state)
+                self._record(order)
+        finally:
+            lock.release()
 
     def get_order_volume(self, price: float) -> float:
         """注文する数量を返す"""
+        if self.shared_margin is not None:
+            if self.shared_margin.reserve(self.volume * price / self.leverage):
+                return self.volume
+            return 0.0
         res = gmo.private_api("/v1/account/margin", parameters={}, method="GET")
         if float(res["data"]["availableAmount"]) * self.leverage > self.volume * price:
             return self.volume
         return 0.0
 
+    def seed_bars(self):
+        """起動時に直近`data_length`本の確定済みbarをバッファに読み込む"""
+        # 確定済みの日かどうかも`clock`の時刻で判定し、SimulatedClockでの再生を実時刻に依存させない
+        now = self.clock.now()
+        df = fetch_df(
+            self.symbol,
+            self.interval,
+            start_date=now,
+            min_length=self.data_length + 1,
+            now=now,
+        )
+        self._add_bars(df.filter(pl.col("datetime") + self.interval <= now))
+
+    def update_bars(self):
+        """前回の更新以降に確定したbarをバッファに追加する"""
+        if len(self.bars) == 0:
+            self.seed_bars()
+            return
+        if self.bar_aggregator is not None and self._update_bars_from_stream():
+            return
+
+        now = self.clock.now()
+        last = self.bars.last_datetime
+        date = now
+        new_bars = []
+        for _ in range(2):  # GMOの日付の切り替わりをまたぐ場合は前日分も確認する
+            df = gmo.get_ohlc(self.symbol, self.interval, date=date, now=now)
+            if len(df) > 0:
+                new_bars.append(df.filter(pl.col("datetime") > last))
+                if df["datetime"].min() <= last:
+                    break
+            date -= datetime.timedelta(days=1)
+
+        if len(new_bars) == 0:
+            return
+        df = pl.concat(new_bars).filter(pl.col("datetime") + self.interval <= now)
+        self._add_bars(df)
+
+    def _update_bars_from_stream(self) -> bool:
+        """`bar_aggregator`で確定したbarを追加する。barが欠けている場合は追加せずにFalseを返す"""
+        aggregator = self.bar_aggregator
+        lateness = aggregator.allowed_lateness.total_seconds()
+        # barの境界の直後は、境界の直前の約定が届くまで待ってからbarを確定させる
+        elapsed = self.clock.time() % self.interval.total_seconds()
+        if elapsed < lateness:
+            self.clock.sleep(lateness - elapsed)
+        aggregator.advance(int((self.clock.time() - lateness) * 1000))
+        last = self.bars.last_datetime
+        df = aggregator.to_df(self.interval, since=last)
+        if len(df) == 0 or df["datetime"][0] != last + self.interval:
+            return False  # 購読開始前や約定の無かったbarはAPIから取得する
+        self._add_bars(df)
+        return True
+
+    def _add_bars(self, df: pl.DataFrame):
+        df = df.sort("datetime")
+        self.bars.extend(df)
+        if self.features is not None:
+            self.features.extend(df)
+
+    def predict(self) -> tuple[float, float, float]:
+        """barを更新して特徴量を計算し、モデルのスコアと目標価格(買い, 売り)を返す"""
+        self.update_bars()
+        if self.features is None:
+            df = import_stock().crypto.feature.calc_features(self.bars.to_df())
+            # 使うのは最後のbarのスコアだけなので、モデルは最後の行だけに対して実行する
+            feat = df.select(*train_features)[-1:].to_numpy()
+            close, atr = df["close"][-1], df["ATR"][-1]
+        else:
+            feat = self.features.vector(train_features)[None, :]
+            close, atr = self.bars.column("close")[-1], self.features.values["ATR"]
+            if self.verify_features:
+                # バッファより前のbarから更新している再帰的な指標は、バッチ計算と僅かに異なることがある
+                batch = import_stock().crypto.feature.calc_features(self.bars.to_df())
+                self.features.verify(batch, [*train_features, "ATR"])
+        preds = self.model.predict(feat)
+
+        target_buy_price = close - atr * self.entry_atr_ratio
+        target_sell_price = close + atr * self.exit_atr_ratio
+        return preds[-1], target_buy_price, target_sell_price
+
+    def update_order(self, order: BaseOrder, target_buy_price: float, target_sell_price: float):
+        """発注済みの注文の目標株価を更新する"""
+        with self._order_lock(order), priority(Priority.REPRICE):
+            order.cancel_order(state=self.order_state)  # 既存の新規注文はキャンセル
+            if order.side == "BUY":
+                order.update_target_price(target_sell_price, state=self.order_state)
+            else:
+                order.update_target_price(target_buy_price, state=self.order_state)
+            self._record(order)
+
+    def place_new_order(self, target_buy_price: float):
+        """新規注文を発行する"""
+        volume = self.get_order_volume(target_buy_price)
+        if volume > 1e-5:
+            order = self.ORDER_TYPE.new_order(
+                symbol=self.symbol,
+                price=target_buy_price,
+                volume=volume,
+                losscut_price=target_buy_price * self.losscut_ratio,
+                state=self.order_state,
+            )
+            self._record(order, NEW)
+            with self._orders_lock:
+                self.orders.append(order)
+
     def on_new_tick_added(self):
         """新しい価格データが追加された際の処理"""
         # 特徴量の計算、モデルの実行
-        df = fetch_df(self.symbol, self.interval, min_length=self.data_length).sort(pl.col("datetime"))[
-            -self.data_length - 1 : -1
-        ]
-        df = stock.crypto.feature.calc_features(df)
-        feat = df.select(*train_features).to_numpy()
-        preds = self.model.predict(feat)
+        with metrics.timer("trader0.predict"):
+            score, target_buy_price, target_sell_price = self.predict()
 
         # 発注済みの注文の目標株価を更新
-        target_buy_price = df["close"][-1] - df["ATR"][-1] * 0.8
-        target_sell_price = df["close"][-1] + df["ATR"][-1] * 0.8
-        for order in self.orders:
-            order.cancel_order()  # 既存の新規注文はキャンセル
-            if order.side == "BUY":
-                order.update_target_price(target_sell_price)
+        with metrics.timer("trader0.update_orders"):
+            for order in list(self.orders):
+                self.update_order(order, target_buy_price, target_sell_price)
+
+        if score > 0:  # モデルのスコアが良い場合は新規注文
+            with metrics.timer("trader0.place_new_order"):
+                self.place_new_order(target_buy_price)
+
+    def pop_closed_orders(self) -> list[BaseOrder]:
+        """終了した注文を`self.orders`から取り除いて返す"""
+        closed_orders = []
+        for order in list(self.orders):
+            lock = self._order_lock(order)
+            if not lock.acquire(blocking=False):
+                continue  # 目標価格の更新中の注文は次のループで確認する
+            try:
+                if order.is_closed(self.order_state):
+                    closed_orders.append(order)
+                    self._record(order, CLOSED)
+            finally:
+                lock.release()
+        closed_ids = {id(order) for order in closed_orders}
+        with self._orders_lock:
+            self.orders = [order for order in self.orders if id(order) not in closed_ids]
+        for order in closed_orders:
+            self._order_locks.pop(id(order), None)
+        return closed_orders
+
+    def _record(self, order: BaseOrder, event: str = UPDATE):
+        if self.journal is not None:
+            self.journal.record(self.journal_key, order, event)
+
+    def restore_orders(self):
+        """journalから前回終了していなかった注文を復元し、取引所の状態と照合する。
+        注文・建玉・約定はシンボルごとにまとめて1回取得し、既に終了していた注文は取り除く。
+        """
+        if self.journal is None:
+            return
+        # 同じシンボルの他の`Trader0`の注文も有効な注文に含まれるので、journalの全ての注文を既知とする
+        known_ids = {order_id for order in self.journal.load_open() for order_id in order.order_ids()}
+        self._reconcile_orders(self.journal.load_open(self.journal_key), "journal", known_ids)
+
+    def _reconcile_orders(self, orders: list[BaseOrder], source: str, known_ids: set[str] | None = None):
+        if len(orders) == 0:
+            return
+        if known_ids is None:
+            known_ids = set()
+        self.order_state.refresh()
+        with self._orders_lock:
+            known = {order_id for order in self.orders for order_id in order.order_ids()}
+            self.orders += [order for order in orders if order.order_ids()[0] not in known]
+        closed_orders = self.pop_closed_orders()
+        logger.info(
+            "Restored {} orders from {} ({} already closed)".format(
+                len(orders), source, len(closed_orders)
+            )
+        )
+        if self.history_writer is not None:
+            self.log_closed_orders(closed_orders)
+        # 復元元に無い有効な注文は手動で確認できるように警告する
+        known = known_ids | {order_id for order in self.orders for order_id in order.order_ids()}
+        unknown = [order_id for order_id in self.order_state.active_orders if order_id not in known]
+        if len(unknown) > 0:
+            logger.warning("Active orders not in {} : {}".format(source, ", ".join(unknown)))
+
+    def save_snapshot(self):
+        """barのバッファと特徴量の状態を保存する。journalを使わない場合は終了していない注文も保存する"""
+        if self.snapshot_path is None:
+            return
+        orders = None
+        if self.journal is None:
+            orders = [(type(order).__name__, order.model_dump_json()) for order in self.orders]
+        snapshot = {
+            "symbol": self.symbol,
+            "interval": self.interval,
+            "bars": self.bars.to_df().clone(),
+            "features": self.features,
+            "orders": orders,
+        }
+        self.snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.snapshot_path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump(snapshot, f)
+        tmp_path.replace(self.snapshot_path)  # 書き込み中に落ちても前回のsnapshotは壊れない
+
+    def load_snapshot(self) -> bool:
+        """前回終了時のsnapshotを読み込む。使えるsnapshotが無い場合はFalseを返す"""
+        if self.snapshot_path is None or not self.snapshot_path.exists():
+            return False
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                snapshot = pickle.load(f)
+        except Exception:
+            logger.exception("Failed to load snapshot : {}".format(self.snapshot_path))
+            return False
+        if snapshot["symbol"] != self.symbol or snapshot["interval"] != self.interval:
+            return False
+        bars: pl.DataFrame = snapshot["bars"]
+        # 足りないbarが多い場合は、APIから取得し直す方が速い
+        max_age = min(MAX_SNAPSHOT_AGE, self.interval * self.data_length)
+        if len(bars) == 0 or self.clock.now() - bars["datetime"][-1] > max_age:
+            logger.info("Snapshot is too old : {}".format(self.snapshot_path))
+            return False
+
+        self.bars.extend(bars)
+        if self.features is not None:
+            if snapshot["features"] is not None:
+                self.features = snapshot["features"]
             else:
-                order.update_target_price(target_buy_price)
-
-        if preds[-1] > 0:  # モデルのスコアが良い場合は新規注文
-            volume = self.get_order_volume(target_buy_price)
-            if volume > 1e-5:
-                self.orders.append(
-                    self.ORDER_TYPE.new_order(
-                        symbol=self.symbol,
-                        price=target_buy_price,
-                        volume=volume,
-                        losscut_price=target_buy_price * 0.92,
-                    )
-                )
+                self.features.extend(bars)
+        if snapshot["orders"] is not None:
+            orders = [ORDER_TYPES[name].model_validate_json(data) for name, data in snapshot["orders"]]
+            self._reconcile_orders(orders, "snapshot")
+        logger.info("Loaded {} bars from snapshot".format(len(bars)))
+        return True
+
+    def warm_start(self):
+        """起動時の準備。注文を復元し、snapshotがあれば足りないbarだけを取得する。
+        modelと`stock`の読み込みは最初の予測まで不要なので、barの取得と並行に行う。
+        """
+        with metrics.timer("startup.total"):
+            self.preload()
+            with metrics.timer("startup.restore_orders"):
+                self.restore_orders()
+            with metrics.timer("startup.load_snapshot"):
+                self.load_snapshot()
+            with metrics.timer("startup.update_bars"):
+                self.update_bars()  # snapshotを読み込めなかった場合は直近のbarを全て取得する
+
+    def log_closed_orders(self, closed_orders: list[BaseOrder]):
+        """終了した注文を履歴の書き込み待ちのキューに入れる。書き込みはバックグラウンドで行う"""
+        assert self.history_writer is not None
+        self.history_writer.submit(closed_orders, self.order_state)
+
+    def _order_lock(self, order: BaseOrder) -> threading.Lock:
+        """注文ごとのlock。同じ注文に対するlosscutと目標価格の更新が同時に実行されないようにする"""
+        return self._order_locks.setdefault(id(order), threading.Lock())
+
+    def _start_logging(self):
+        date_str = self.clock.now().isoformat()
+        enable_logging_to_file(self.log_dir / f"trader_{date_str}.log")
+        self.start_history(self.log_dir / f"trade_history_{date_str}")
+
+    def start_history(self, history_dir: Path):
+        """`history_dir`への取引履歴の書き込みを開始する"""
+        self.history_writer = history.HistoryWriter(history_dir)
+        self.history_writer.start()
+
+    def stop_history(self):
+        """残っている注文を履歴に書き込んで終了する"""
+        if self.history_writer is None:
+            return
+        self.log_closed_orders(self.orders)
+        self.history_writer.close()
+        self.history_writer = None
 
     def run_loop(self):
         self.is_running = True
-        date_str = datetime.datetime.now().isoformat()
-        trade_history_csv = self.log_dir / f"trade_history_{date_str}.csv"
-        enable_logging_to_file(self.log_dir / f"trader_{date_str}.log")
+        self._start_logging()
         logger.debug("Start auto trade")
-        # fut = asyncio.sleep(self.wait_second)
+        self.warm_start()
+        metrics.log_summary(prefix="startup.")
         while self.is_running:
-            self.losscut()  # losscutのチェック
-            # next wallに到達した場合の処理
-            if self.next_wall < datetime.datetime.now():
-                self.next_wall += self.interval  # next wallの更新
-                self.on_new_tick_added()
+            self.scheduler.poll_due()  # 次の定期処理の時刻に進める
+            with metrics.timer("trader0.loop"):
+                with metrics.timer("trader0.refresh"):
+                    self.order_state.refresh()  # 注文・建玉・約定の状態をまとめて取得
+                if not self.feed_is_alive():
+                    with metrics.timer("trader0.losscut"):
+                        self.losscut()  # WebSocketが使えない場合はpollingでlosscutのチェック
+                # next wallに到達した場合の処理
+                if self.scheduler.bar_due():
+                    with metrics.timer("trader0.on_new_tick_added"):
+                        self.on_new_tick_added()
 
-            closed_orders = [order for order in self.orders if order.is_closed()]
-            self.orders = [order for order in self.orders if not order.is_closed()]
-            history.log_closed_order(closed_orders, trade_history_csv)
+                with metrics.timer("trader0.close_detection"):
+                    closed_orders = self.pop_closed_orders()
+                self.log_closed_orders(closed_orders)
+            metrics.maybe_log_summary()
 
-            # loop頻度制御
-            # await fut
-            # fut = asyncio.sleep(self.wait_second)
-            time.sleep(self.wait_second)
+            # 次の定期処理かbarの境界のうち早い方まで待つ
+            self.scheduler.wait()
 
+        self.save_snapshot()
         self.cancel_all_orders()
-        history.log_closed_order(self.orders, trade_history_csv)
+        self.stop_history()
+        logger.debug("Stop auto trade")
+
+    async def _run_blocking(self, func, *args):
+        """同時実行数を制限しつつ、ブロッキングする処理をスレッドで実行する"""
+        async with self._semaphore:
+            return await asyncio.to_thread(func, *args)
+
+    async def _run_bar_blocking(self, func, *args):
+        """barの処理を`_run_blocking`とは別のセマフォとスレッドプールで実行し、
+        refreshとlosscutがbarの処理の後ろで待たないようにする
+        """
+        async with self._bar_semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._bar_executor, contextvars.copy_context().run, func, *args
+            )
+
+    async def losscut_async(self, prices: dict[str, float]):
+        await asyncio.gather(
+            *[self._run_blocking(self.check_losscut, o, prices) for o in list(self.orders)]
+        )
+
+    async def on_new_tick_added_async(self):
+        """`on_new_tick_added`の非同期版。各注文の目標株価の更新を並行に実行する"""
+        with metrics.timer("trader0.on_new_tick_added"):
+            with metrics.timer("trader0.predict"):
+                score, target_buy_price, target_sell_price = await self._run_bar_blocking(self.predict)
+            with metrics.timer("trader0.update_orders"):
+                await asyncio.gather(
+                    *[
+                        self._run_bar_blocking(
+                            self.update_order, order, target_buy_price, target_sell_price
+                        )
+                        for order in list(self.orders)
+                    ]
+                )
+            if score > 0:
+                with metrics.timer("trader0.place_new_order"):
+                    await self._run_bar_blocking(self.place_new_order, target_buy_price)
+
+    async def run_loop_async(self, max_concurrency: int = 8):
+        """`run_loop`の非同期版。
+        API呼び出しを最大`max_concurrency`並列で実行するので、1ループの時間は最も遅い呼び出し程度になる。
+        barの更新処理は別のセマフォとスレッドプールでバックグラウンドで実行するので、
+        時間がかかってもlosscutのチェックは遅れない。
+        """
+        self.is_running = True
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._bar_semaphore = asyncio.Semaphore(max_concurrency)
+        self._bar_executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self._start_logging()
+        logger.debug("Start auto trade")
+        await asyncio.to_thread(self.warm_start)
+        metrics.log_summary(prefix="startup.")
+
+        bar_task: asyncio.Task | None = None
+        while self.is_running:
+            self.scheduler.poll_due()
+            loop_start = time.perf_counter()
+            with metrics.timer("trader0.refresh"):
+                _, prices = await asyncio.gather(
+                    self._run_blocking(self.order_state.refresh),
+                    self._run_blocking(self.fetch_latest_prices),
+                )
+            if not self.feed_is_alive():
+                with metrics.timer("trader0.losscut"):
+                    await self.losscut_async(prices)
+
+            if bar_task is not None and bar_task.done():
+                bar_task.result()  # 例外が発生していた場合は送出する
+                bar_task = None
+            # next wallに到達した場合の処理。前のbarの処理が終わっていない場合は終わるまで待つ
+            if bar_task is None and self.scheduler.bar_due():
+                bar_task = asyncio.create_task(self.on_new_tick_added_async())
+
+            with metrics.timer("trader0.close_detection"):
+                closed_orders = await asyncio.to_thread(self.pop_closed_orders)
+            metrics.record("trader0.loop", time.perf_counter() - loop_start)
+            metrics.maybe_log_summary()
+            self.log_closed_orders(closed_orders)
+
+            # 次の定期処理かbarの境界のうち早い方まで待つ。barの処理中は定期処理の時刻まで待つ
+            await self.scheduler.wait_async(include_bar=bar_task is None)
+
+        if bar_task is not None:
+            await bar_task
+        self._bar_executor.shutdown()
+        await asyncio.to_thread(self.save_snapshot)
+        await asyncio.to_thread(self.cancel_all_orders)
+        await asyncio.to_thread(self.stop_history)
         logger.debug("Stop auto trade")
 
     def cancel_all_orders(self):
         is_closed = False
         while not is_closed:
             is_closed = True
+            self.order_state.refresh()
             for order in self.orders:
-                order.cancel_order()
-                order.losscut()
-                is_closed &= order.is_closed()
+                order.cancel_order(state=self.order_state)
+                with priority(Priority.LOSSCUT):
+                    order.losscut(self.order_state)
+                self._record(order)
+                is_closed &= order.is_closed(self.order_state)
+        for order in self.orders:
+            self._record(order, CLOSED)
 
     def stop_loop(self):
         self.is_running = False
@@ -0,0 +1,206 @@
+"""bar_aggregator.py
+"""
+
+import datetime
+import threading
+from typing import Callable
+
+import numpy as np
+import polars as pl
+
+from .bar_buffer import BarBuffer
+
+DEFAULT_INTERVALS = (
+    datetime.timedelta(minutes=1),
+    datetime.timedelta(minutes=5),
+    datetime.timedelta(minutes=15),
+    datetime.timedelta(hours=1),
+)
+JST_OFFSET = datetime.timedelta(hours=9)
+
+# 確定前のbarの値 (open, high, low, close, volume, openの約定時刻, closeの約定時刻)
+_OPEN, _HIGH, _LOW, _CLOSE, _VOLUME, _FIRST_TS, _LAST_TS = range(7)
+
+
+def _to_ms(delta: datetime.timedelta) -> int:
+    return int(delta / datetime.timedelta(milliseconds=1))
+
+
+def to_epoch_ms(dt: datetime.datetime) -> int:
+    """約定時刻をepochからのミリ秒に変換する。timezoneの無いdatetimeはJSTとみなす"""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone(JST_OFFSET))
+    return int(dt.timestamp() * 1000)
+
+
+class BarAggregator:
+    """1つの約定のストリームから、複数の時間足のbarを同時に作成する。
+    確定したbarは時間足ごとの`BarBuffer`に書き込むので、barごとの配列のコピーは発生しない。
+    barの日時はklinesのAPIと同じくJSTのbarの開始時刻とする。
+
+    約定の順序が前後しても良いように、確定前のbarは最新の約定時刻から`allowed_lateness`経過するまで保持する。
+    open, closeは到着順ではなく約定時刻が最も早い・遅い約定の価格になる。
+    既に確定したbarに含まれる約定が届いた場合は捨て、`late_ticks`に数える。
+    購読を開始した時点で既に始まっていたbarは一部の約定しか含まないので書き込まない。
+    ただし`seed`した時間足は、`seed`した最後のbarの次のbarから書き込む。
+    """
+
+    def __init__(
+        self,
+        symbol: str,
+        intervals: tuple[datetime.timedelta, ...] | list[datetime.timedelta] = DEFAULT_INTERVALS,
+        capacity: int = 1000,
+        allowed_lateness: datetime.timedelta = datetime.timedelta(seconds=2),
+        utc_offset: datetime.timedelta = JST_OFFSET,
+    ):
+        self.symbol = symbol
+        self.intervals = list(intervals)
+        self.allowed_lateness = allowed_lateness
+        self.buffers = {interval: BarBuffer(capacity) for interval in self.intervals}
+        self.late_ticks = 0
+        self._interval_ms = [_to_ms(interval) for interval in self.intervals]
+        self._lateness_ms = _to_ms(allowed_lateness)
+        self._offset_ms = _to_ms(utc_offset)
+        # 時間足ごとの、開始時刻(offset適用後のミリ秒) -> 確定前のbar
+        self._pending: list[dict[int, list[float]]] = [{} for _ in self.intervals]
+        # 時間足ごとの、確定済みのbarの終了時刻。これより前の約定は捨てる
+        self._closed_until: list[int | None] = [None] * len(self.intervals)
+        self._watermark: int | None = None
+        # 時間足ごとの、一部の約定しか含まないbarの終了時刻。最初の約定か`seed`で決める
+        self._partial_until: list[int | None] = [None] * len(self.intervals)
+        self._listeners: list[Callable[[datetime.timedelta, tuple], None]] = []
+        self._lock = threading.RLock()  # listenerから`to_df`を呼べるようにする
+
+    def add_listener(self, listener: Callable[[datetime.timedelta, tuple], None]):
+        """barの確定時に`listener(interval, (datetime, open, high, low, close, volume))`を呼び出す"""
+        self._listeners.append(listener)
+
+    def seed(self, interval: datetime.timedelta, df: pl.DataFrame):
+        """APIから取得した確定済みのbarを書き込む。これより前の約定は確定済みとして扱う"""
+        if len(df) == 0:
+            return
+        k = self.intervals.index(interval)
+        with self._lock:
+            self.buffers[interval].extend(df)
+            last = self.buffers[interval].last_datetime
+            self._close_until(k, self._local_ms(last) + self._interval_ms[k])
+            # 次のbarからは全ての約定を受け取るので、最初の約定が途中からでも捨てない
+            if self._partial_until[k] is None:
+                self._partial_until[k] = self._closed_until[k]
+
+    def on_trade(self, symbol: str, timestamp: int, price: float, size: float):
+        """`TradeFeed`のlistener。他のシンボルの約定は無視する"""
+        if symbol == self.symbol:
+            self.add_tick(timestamp, price, size)
+
+    def add_tick(self, timestamp: int, price: float, size: float):
+        """約定を1つ追加する。`timestamp`はepochからのミリ秒"""
+        with self._lock:
+            if None in self._partial_until:
+                self._start(timestamp)
+            local = timestamp + self._offset_ms
+            for k, interval_ms in enumerate(self._interval_ms):
+                start = local - local % interval_ms
+                self._merge(k, start, [price, price, price, price, size, timestamp, timestamp])
+            self._advance(timestamp - self._lateness_ms)
+
+    def add_ticks(self, timestamps: np.ndarray, prices: np.ndarray, sizes: np.ndarray):
+        """約定をまとめて追加する。barごとの集計はnumpyでまとめて行う"""
+        if len(timestamps) == 0:
+            return
+        order = np.argsort(timestamps, kind="stable")
+        timestamps = np.asarray(timestamps, dtype=np.int64)[order]
+        prices = np.asarray(prices, dtype=np.float64)[order]
+        sizes = np.asarray(sizes, dtype=np.float64)[order]
+        local = timestamps + self._offset_ms
+        with self._lock:
+            if None in self._partial_until:
+                self._start(int(timestamps[0]))
+            for k, interval_ms in enumerate(self._interval_ms):
+                starts = local - local % interval_ms
+                # 約定時刻でsortしているので、同じbarの約定は連続している
+                first = np.flatnonzero(np.r_[True, starts[1:] != starts[:-1]])
+                last = np.r_[first[1:], len(starts)] - 1
+                highs = np.maximum.reduceat(prices, first)
+                lows = np.minimum.reduceat(prices, first)
+                volumes = np.add.reduceat(sizes, first)
+                for i in range(len(first)):
+                    bar = [
+                        prices[first[i]],
+                        highs[i],
+                        lows[i],
+                        prices[last[i]],
+                        volumes[i],
+                        timestamps[first[i]],
+                        timestamps[last[i]],
+                    ]
+                    self._merge(k, int(starts[first[i]]), bar)
+            self._advance(int(timestamps[-1]) - self._lateness_ms)
+
+    def advance(self, timestamp: int):
+        """約定が無くても`timestamp`(epochからのミリ秒)までに終了したbarを確定させる"""
+        with self._lock:
+            self._advance(timestamp)
+
+    def to_df(
+        self, interval: datetime.timedelta, since: datetime.datetime | None = None
+    ) -> pl.DataFrame:
+        """`interval`の確定済みのbarのうち、開始時刻が`since`より後のものをコピーして返す"""
+        with self._lock:
+            df = self.buffers[interval].to_df().clone()
+        if since is not None:
+            df = df.filter(pl.col("datetime") > since)
+        return df
+
+    def _local_ms(self, dt: datetime.datetime) -> int:
+        return _to_ms(dt - datetime.datetime(1970, 1, 1))
+
+    def _merge(self, k: int, start: int, bar: list[float]):
+        closed_until = self._closed_until[k]
+        if closed_until is not None and start < closed_until:
+            if k == 0:
+                self.late_ticks += 1
+            return
+        pending = self._pending[k].get(start)
+        if pending is None:
+            self._pending[k][start] = bar
+            return
+        pending[_HIGH] = max(pending[_HIGH], bar[_HIGH])
+        pending[_LOW] = min(pending[_LOW], bar[_LOW])
+        pending[_VOLUME] += bar[_VOLUME]
+        if bar[_FIRST_TS] < pending[_FIRST_TS]:
+            pending[_OPEN], pending[_FIRST_TS] = bar[_OPEN], bar[_FIRST_TS]
+        if bar[_LAST_TS] >= pending[_LAST_TS]:
+            pending[_CLOSE], pending[_LAST_TS] = bar[_CLOSE], bar[_LAST_TS]
+
+    def _start(self, timestamp: int):
+        """最初の約定の時点で既に始まっていたbarは一部の約定しか含まないので、確定時に捨てるようにする"""
+        local = timestamp + self._offset_ms
+        for k, interval_ms in enumerate(self._interval_ms):
+            if self._partial_until[k] is None:
+                self._partial_until[k] = local - local % interval_ms + interval_ms
+
+    def _advance(self, timestamp: int):
+        if self._watermark is not None and timestamp <= self._watermark:
+            return
+        self._watermark = timestamp
+        local = timestamp + self._offset_ms
+        for k, interval_ms in enumerate(self._interval_ms):
+            closed = sorted(start for start in self._pending[k] if start + interval_ms <= local)
+            for start in closed:
+                bar = self._pending[k].pop(start)
+                if start < self._partial_until[k]:
+                    continue
+                dt = datetime.datetime(1970, 1, 1) + datetime.timedelta(milliseconds=start)
+                values = (dt, *bar[_OPEN : _VOLUME + 1])
+                self.buffers[self.intervals[k]].append(*values)
+                for listener in self._listeners:
+                    listener(self.intervals[k], values)
+            self._close_until(k, local - local % interval_ms)
+
+    def _close_until(self, k: int, end: int):
+        """`k`番目の時間足の`end`より前のbarを確定済みとし、確定前のbarから取り除く"""
+        if self._closed_until[k] is not None and self._closed_until[k] >= end:
+            return
+        self._closed_until[k] = end
+        self._pending[k] = {start: bar for start, bar in self._pending[k].items() if start >= end}
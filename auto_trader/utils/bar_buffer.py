@@ -0,0 +1,71 @@
+"""bar_buffer.py
+"""
+
+import datetime
+
+import numpy as np
+import polars as pl
+
+OHLCV_COLUMNS = ("open", "high", "low", "close", "volume")
+
+
+class BarBuffer:
+    """固定長のOHLCVのリングバッファ。
+    各値を`i`と`i + capacity`の2箇所に書き込むことで、最新`capacity`本のbarが常に連続したメモリ領域に並ぶ。
+    そのため`to_df`はコピーせずにDataFrameを作成できる。
+    """
+
+    def __init__(self, capacity: int):
+        if capacity <= 0:
+            raise ValueError(f"Invalid capacity: {capacity}")
+        self.capacity = capacity
+        self._values = np.full((len(OHLCV_COLUMNS), 2 * capacity), np.nan, dtype=np.float64)
+        self._datetime = np.zeros(2 * capacity, dtype="datetime64[us]")
+        self._pos = 0  # 次に書き込むindex
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def is_full(self) -> bool:
+        return self._size == self.capacity
+
+    @property
+    def last_datetime(self) -> datetime.datetime | None:
+        """最新のbarの開始時刻"""
+        if self._size == 0:
+            return None
+        return self._datetime[self._pos - 1 + self.capacity].astype(datetime.datetime)
+
+    def append(
+        self, dt: datetime.datetime, open: float, high: float, low: float, close: float, volume: float
+    ):
+        """barを1本追加する。容量を超えた場合は最も古いbarが捨てられる"""
+        i, j = self._pos, self._pos + self.capacity
+        self._values[:, i] = self._values[:, j] = (open, high, low, close, volume)
+        self._datetime[i] = self._datetime[j] = np.datetime64(dt, "us")
+        self._pos = (self._pos + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+    def extend(self, df: pl.DataFrame):
+        """`df`のbarを古い順に追加する"""
+        df = df.sort("datetime")[-self.capacity :]
+        for row in df.select("datetime", *OHLCV_COLUMNS).iter_rows():
+            self.append(*row)
+
+    def column(self, name: str) -> np.ndarray:
+        """`name`列の古い順に並んだviewを返す"""
+        start = (self._pos - self._size) % self.capacity
+        if name == "datetime":
+            return self._datetime[start : start + self._size]
+        return self._values[OHLCV_COLUMNS.index(name), start : start + self._size]
+
+    def to_df(self) -> pl.DataFrame:
+        """バッファの内容をDataFrameとして返す。OHLCV列はバッファのメモリを共有する"""
+        return pl.DataFrame(
+            {
+                "datetime": self.column("datetime"),
+                **{name: self.column(name) for name in OHLCV_COLUMNS},
+            }
+        )
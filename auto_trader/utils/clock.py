@@ -0,0 +1,124 @@
+"""clock.py
+"""
+
+import asyncio
+import datetime
+import threading
+import time
+
+
+class Clock:
+    """現在時刻の取得と待機のinterface。実際の時刻の代わりにシミュレーションの時刻を使えるようにする"""
+
+    def time(self) -> float:
+        """epochからの秒数"""
+        raise NotImplementedError
+
+    def now(self) -> datetime.datetime:
+        """`datetime.datetime.now()`と同じくtimezoneの無いローカル時刻"""
+        return datetime.datetime.fromtimestamp(self.time())
+
+    def monotonic(self) -> float:
+        """経過時間の計測用。システムの時刻の変更の影響を受けない"""
+        raise NotImplementedError
+
+    def sleep(self, seconds: float):
+        raise NotImplementedError
+
+    async def sleep_async(self, seconds: float):
+        raise NotImplementedError
+
+
+class SystemClock(Clock):
+    def time(self) -> float:
+        return time.time()
+
+    def now(self) -> datetime.datetime:
+        return datetime.datetime.now()
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def sleep(self, seconds: float):
+        time.sleep(max(0.0, seconds))
+
+    async def sleep_async(self, seconds: float):
+        await asyncio.sleep(max(0.0, seconds))
+
+
+class SimulatedClock(Clock):
+    """`set_time`で進めるシミュレーション用の時計。`sleep`は待たずに時刻を進める"""
+
+    def __init__(self, start: float = 0.0):
+        self._time = start
+        self._lock = threading.Lock()
+
+    def time(self) -> float:
+        return self._time
+
+    def monotonic(self) -> float:
+        return self._time
+
+    def set_time(self, timestamp: float):
+        """時刻を`timestamp`(epochからの秒数)に進める。時刻は戻さない"""
+        with self._lock:
+            self._time = max(self._time, timestamp)
+
+    def sleep(self, seconds: float):
+        with self._lock:
+            self._time += max(0.0, seconds)
+
+    async def sleep_async(self, seconds: float):
+        self.sleep(seconds)
+        await asyncio.sleep(0)  # 他のtaskに処理を譲る
+
+
+def next_boundary(dt: datetime.datetime, interval: datetime.timedelta) -> datetime.datetime:
+    """`dt`より後の最初のbarの境界。境界は0時から`interval`ごととする"""
+    return dt - (dt - datetime.datetime.min) % interval + interval
+
+
+class BarScheduler:
+    """`poll_interval`秒ごとの定期処理と、`interval`ごとのbarの境界の時刻を管理する。
+    `wait`はどちらか早い方の時刻まで待つので、barの境界で定期処理の間隔分遅れることがない。
+    定期処理の間隔は`clock.monotonic`で測るので、システムの時刻の変更の影響を受けない。
+    """
+
+    def __init__(self, clock: Clock, interval: datetime.timedelta, poll_interval: float):
+        self.clock = clock
+        self.interval = interval
+        self.poll_interval = poll_interval
+        self.next_wall = next_boundary(clock.now(), interval)
+        self._next_poll = clock.monotonic()
+
+    def bar_due(self) -> bool:
+        """barの境界に到達した場合はTrueを返し、次の境界に進める。
+        処理が遅れて複数の境界を過ぎていた場合も1回だけTrueを返す"""
+        now = self.clock.now()
+        if now < self.next_wall:
+            return False
+        self.next_wall = next_boundary(now, self.interval)
+        return True
+
+    def poll_due(self) -> bool:
+        """定期処理の時刻に到達した場合はTrueを返し、次の時刻に進める"""
+        now = self.clock.monotonic()
+        if now < self._next_poll:
+            return False
+        self._next_poll += self.poll_interval
+        if self._next_poll <= now:
+            self._next_poll = now + self.poll_interval  # 遅れた分はまとめて飛ばす
+        return True
+
+    def seconds_until_next(self, include_bar: bool = True) -> float:
+        """次の定期処理、または`include_bar`がTrueの場合はbarの境界までの秒数"""
+        seconds = self._next_poll - self.clock.monotonic()
+        if include_bar:
+            seconds = min(seconds, (self.next_wall - self.clock.now()).total_seconds())
+        return max(0.0, seconds)
+
+    def wait(self, include_bar: bool = True):
+        self.clock.sleep(self.seconds_until_next(include_bar))
+
+    async def wait_async(self, include_bar: bool = True):
+        await self.clock.sleep_async(self.seconds_until_next(include_bar))
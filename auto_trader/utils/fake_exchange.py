@@ -0,0 +1,376 @@
+"""fake_exchange.py
+"""
+
+import datetime
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import polars as pl
+
+from .gmo import LEVERAGE_SYMBOLS
+from .kline_store import DAY_START_HOUR
+
+FINISHED_STATUS = ["CANCELED", "EXECUTED", "EXPIRED"]
+
+
+class FakeExchangeError(Exception):
+    def __init__(self, message_code: str, message_string: str):
+        super().__init__(message_string)
+        self.message_code = message_code
+        self.message_string = message_string
+
+
+def _timestamp() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="milliseconds")
+
+
+class FakeExchange:
+    """GMOコインのAPIのうち、このパッケージで使用するエンドポイントを模擬する取引所。
+    価格は`set_price`で与え、価格が更新されるたびに有効な指値注文を約定させる。
+    `LEVERAGE_SYMBOLS`の注文は建玉を作成し、`/v1/closeOrder`で決済する。指値注文の価格は`/v1/changeOrder`で変更できる。
+    """
+
+    def __init__(self, initial_cash: float = 1_000_000.0, leverage: float = 2.0):
+        self.cash = initial_cash
+        self.leverage = leverage
+        self.prices: dict[str, float] = {}
+        self.orders: dict[int, dict] = {}
+        self.executions: list[dict] = []
+        self.positions: dict[int, dict] = {}
+        self.klines: dict[tuple[str, str, str], list[dict]] = {}
+        self.request_counts: dict[str, int] = {}
+        self._next_id = 1
+        self._lock = threading.RLock()
+
+    def _new_id(self) -> int:
+        self._next_id += 1
+        return self._next_id
+
+    # ---------------------------------------------------------------- market data
+    def set_price(self, symbol: str, price: float):
+        """`symbol`の価格を更新し、約定条件を満たす指値注文を約定させる"""
+        with self._lock:
+            self.prices[symbol] = price
+            self._match(symbol)
+
+    def _match(self, symbol: str):
+        if symbol not in self.prices:
+            return
+        price = self.prices[symbol]
+        for order in list(self.orders.values()):
+            if order["symbol"] != symbol or order["status"] != "ORDERED":
+                continue
+            limit = float(order["price"])
+            if (order["side"] == "BUY" and price <= limit) or (
+                order["side"] == "SELL" and price >= limit
+            ):
+                self._execute(order, limit)
+
+    def add_klines(self, symbol: str, interval: str, df: pl.DataFrame):
+        """`/v1/klines`で返すデータを登録する。`df`はdatetime(JST), open, high, low, close, volumeの列を持つ"""
+        df = df.with_columns(
+            (pl.col("datetime") - pl.duration(hours=DAY_START_HOUR))
+            .dt.strftime("%Y%m%d")
+            .alias("_date"),
+            ((pl.col("datetime") - pl.duration(hours=9)).dt.epoch(time_unit="ms")).alias("_open_time"),
+        )
+        with self._lock:
+            for row in df.sort("datetime").iter_rows(named=True):
+                self.klines.setdefault((symbol, interval, row["_date"]), []).append(
+                    {
+                        "openTime": str(row["_open_time"]),
+                        **{key: str(row[key]) for key in ["open", "high", "low", "close", "volume"]},
+                    }
+                )
+
+    # ---------------------------------------------------------------- matching engine
+    def _execute(self, order: dict, price: float):
+        size = float(order["size"])
+        order["status"] = "EXECUTED"
+        order["executedSize"] = order["size"]
+        symbol = order["symbol"]
+
+        if order["settleType"] == "CLOSE":
+            for settle in order["settlePosition"]:
+                position = self.positions[int(settle["positionId"])]
+                settle_size = float(settle["size"])
+                sign = 1.0 if position["side"] == "BUY" else -1.0
+                loss_gain = (price - float(position["price"])) * settle_size * sign
+                self.cash += loss_gain
+                self._add_execution(order, price, settle_size, position["positionId"], loss_gain)
+                position["size"] = str(round(float(position["size"]) - settle_size, 8))
+                position["orderdSize"] = str(round(float(position["orderdSize"]) - settle_size, 8))
+                if float(position["size"]) < 1e-9:
+                    del self.positions[position["positionId"]]
+        elif symbol in LEVERAGE_SYMBOLS:
+            position_id = self._new_id()
+            self.positions[position_id] = {
+                "positionId": position_id,
+                "symbol": symbol,
+                "side": order["side"],
+                "size": order["size"],
+                "orderdSize": "0",
+                "price": str(price),
+                "lossGain": "0",
+                "leverage": str(self.leverage),
+                "losscutPrice": "0",
+                "timestamp": _timestamp(),
+            }
+            self._add_execution(order, price, size, position_id, 0.0)
+        else:
+            sign = 1.0 if order["side"] == "BUY" else -1.0
+            self.cash -= sign * size * price
+            self._add_execution(order, price, size, None, 0.0)
+
+    def _add_execution(self, order: dict, price: float, size: float, position_id, loss_gain: float):
+        execution = {
+            "executionId": self._new_id(),
+            "orderId": order["orderId"],
+            "symbol": order["symbol"],
+            "side": order["side"],
+            "settleType": order["settleType"],
+            "size": str(size),
+            "price": str(price),
+            "lossGain": str(loss_gain),
+            "fee": "0",
+            "timestamp": _timestamp(),
+        }
+        if position_id is not None:
+            execution["positionId"] = position_id
+        self.executions.append(execution)
+
+    def _new_order(self, params: dict, settle_type: str) -> dict:
+        symbol = params["symbol"]
+        if params["executionType"] == "MARKET" and symbol not in self.prices:
+            raise FakeExchangeError("ERR-5106", f"No price for {symbol}")
+        order = {
+            "orderId": self._new_id(),
+            "rootOrderId": 0,
+            "symbol": symbol,
+            "side": params["side"],
+            "orderType": "NORMAL",
+            "executionType": params["executionType"],
+            "settleType": settle_type,
+            "size": params.get("size", "0"),
+            "executedSize": "0",
+            "price": params.get("price", "0"),
+            "losscutPrice": "0",
+            "status": "ORDERED",
+            "timeInForce": params.get("timeInForce", "FAS"),
+            "timestamp": _timestamp(),
+        }
+        order["rootOrderId"] = order["orderId"]
+        if settle_type == "CLOSE":
+            order["settlePosition"] = params["settlePosition"]
+        elif symbol in LEVERAGE_SYMBOLS:
+            price = float(order["price"]) if order["executionType"] == "LIMIT" else self.prices[symbol]
+            if float(order["size"]) * price / self.leverage > self.cash - self._required_margin():
+                raise FakeExchangeError("ERR-201", "Trading margin is insufficient")
+        self.orders[order["orderId"]] = order
+        if params["executionType"] == "MARKET":
+            self._execute(order, self.prices[symbol])
+        else:
+            self._match(symbol)
+        return order
+
+    def _required_margin(self) -> float:
+        margin = sum(float(p["size"]) * float(p["price"]) for p in self.positions.values())
+        for order in self.orders.values():
+            if order["status"] == "ORDERED" and order["settleType"] == "OPEN":
+                margin += float(order["size"]) * float(order["price"])
+        return margin / self.leverage
+
+    # ---------------------------------------------------------------- endpoints
+    def handle(self, method: str, path: str, params: dict) -> dict:
+        """APIのリクエストを処理してレスポンスを返す"""
+        with self._lock:
+            self.request_counts[path] = self.request_counts.get(path, 0) + 1
+            try:
+                return {
+                    "status": 0,
+                    "data": self._dispatch(method, path, params),
+                    "responsetime": _timestamp(),
+                }
+            except FakeExchangeError as e:
+                return {
+                    "status": 1,
+                    "messages": [{"message_code": e.message_code, "message_string": e.message_string}],
+                    "responsetime": _timestamp(),
+                }
+
+    def _dispatch(self, method: str, path: str, params: dict):
+        if path == "/public/v1/ticker":
+            return [
+                {"symbol": symbol, "last": str(price), "ask": str(price), "bid": str(price)}
+                for symbol, price in self.prices.items()
+                if "symbol" not in params or params["symbol"] == symbol
+            ]
+        if path == "/public/v1/klines":
+            return self.klines.get((params["symbol"], params["interval"], params["date"]), [])
+        if path == "/private/v1/order":
+            return str(self._new_order(params, "OPEN")["orderId"])
+        if path == "/private/v1/closeOrder":
+            return str(self._close_order(params)["orderId"])
+        if path == "/private/v1/cancelOrder":
+            return self._cancel_order(int(params["orderId"]))
+        if path == "/private/v1/changeOrder":
+            return self._change_order(int(params["orderId"]), params["price"])
+        if path == "/private/v1/orders":
+            order_ids = [int(order_id) for order_id in str(params["orderId"]).split(",")]
+            return {"list": [self.orders[order_id] for order_id in order_ids if order_id in self.orders]}
+        if path == "/private/v1/activeOrders":
+            orders = [o for o in self.orders.values() if o["symbol"] == params["symbol"]]
+            return self._page([o for o in orders if o["status"] not in FINISHED_STATUS], params)
+        if path == "/private/v1/executions":
+            order_id = int(params["orderId"])
+            return self._list([e for e in self.executions if e["orderId"] == order_id])
+        if path == "/private/v1/latestExecutions":
+            executions = [e for e in reversed(self.executions) if e["symbol"] == params["symbol"]]
+            return self._page(executions, params)
+        if path == "/private/v1/openPositions":
+            positions = [p for p in self.positions.values() if p["symbol"] == params["symbol"]]
+            return self._page(positions, params)
+        if path == "/private/v1/account/margin":
+            required = self._required_margin()
+            return {
+                "actualProfitLoss": str(self.cash),
+                "availableAmount": str(self.cash - required),
+                "margin": str(required),
+            }
+        raise FakeExchangeError("ERR-5201", f"Unknown path: {method} {path}")
+
+    def _close_order(self, params: dict) -> dict:
+        if params["executionType"] == "MARKET" and params["symbol"] not in self.prices:
+            raise FakeExchangeError("ERR-5106", f"No price for {params['symbol']}")
+        for settle in params["settlePosition"]:
+            position = self.positions.get(int(settle["positionId"]))
+            if position is None:
+                raise FakeExchangeError("ERR-254", f"Position not found: {settle['positionId']}")
+            available = float(position["size"]) - float(position["orderdSize"])
+            if float(settle["size"]) > available + 1e-9:
+                raise FakeExchangeError("ERR-422", f"Insufficient position size: {settle['positionId']}")
+        for settle in params["settlePosition"]:
+            position = self.positions[int(settle["positionId"])]
+            position["orderdSize"] = str(round(float(position["orderdSize"]) + float(settle["size"]), 8))
+        size = sum(float(settle["size"]) for settle in params["settlePosition"])
+        return self._new_order({**params, "size": str(size)}, "CLOSE")
+
+    def _cancel_order(self, order_id: int):
+        order = self.orders.get(order_id)
+        if order is None or order["status"] in FINISHED_STATUS:
+            raise FakeExchangeError("ERR-5122", f"The order cannot be canceled: {order_id}")
+        order["status"] = "CANCELED"
+        if order["settleType"] == "CLOSE":
+            for settle in order["settlePosition"]:
+                position = self.positions.get(int(settle["positionId"]))
+                if position is not None:
+                    position["orderdSize"] = str(
+                        round(float(position["orderdSize"]) - float(settle["size"]), 8)
+                    )
+        return None
+
+    def _change_order(self, order_id: int, price: str):
+        order = self.orders.get(order_id)
+        if order is None or order["status"] in FINISHED_STATUS or order["executionType"] != "LIMIT":
+            raise FakeExchangeError("ERR-5122", f"The order cannot be changed: {order_id}")
+        order["price"] = price
+        self._match(order["symbol"])
+        return None
+
+    @staticmethod
+    def _list(items: list[dict]) -> dict:
+        # GMOのAPIは該当するデータがない場合は空のdictを返す
+        if len(items) == 0:
+            return {}
+        return {"list": items}
+
+    @staticmethod
+    def _page(items: list[dict], params: dict) -> dict:
+        page, count = int(params.get("page", 1)), int(params.get("count", 100))
+        items = items[(page - 1) * count : page * count]
+        if len(items) == 0:
+            return {}
+        return {"pagination": {"currentPage": page, "count": count}, "list": items}
+
+
+class FakeExchangeServer:
+    """`FakeExchange`をlocalhostのHTTPサーバーとして公開する。
+    `latency`秒(エンドポイントごとに`latencies`で指定も可能)だけ遅延させてレスポンスを返す。
+    """
+
+    def __init__(
+        self,
+        exchange: FakeExchange | None = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        latencies: dict[str, float] = {},
+    ):
+        self.exchange = FakeExchange() if exchange is None else exchange
+        self.latency = latency
+        self.latencies = latencies
+        self._server = ThreadingHTTPServer((host, port), self._create_handler())
+        self._server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def public_end_point(self) -> str:
+        return self.url + "/public"
+
+    @property
+    def private_end_point(self) -> str:
+        return self.url + "/private"
+
+    def _create_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-aliveを有効にする
+            disable_nagle_algorithm = True  # ヘッダーと本文を別々に送る際の遅延を避ける
+
+            def _handle(self, method: str):
+                url = urlparse(self.path)
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                if method != "GET":
+                    length = int(self.headers.get("Content-Length", 0))
+                    if length > 0:
+                        params.update(json.loads(self.rfile.read(length)))
+                time.sleep(server.latencies.get(url.path, server.latency))
+                body = json.dumps(server.exchange.handle(method, url.path, params)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+            def do_PUT(self):
+                self._handle("PUT")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
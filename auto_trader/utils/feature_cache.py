@@ -0,0 +1,186 @@
+"""feature_cache.py
+"""
+
+import datetime
+import hashlib
+import inspect
+import os
+import threading
+from pathlib import Path
+from typing import Callable
+
+import polars as pl
+
+from ..constants import PROJECT_ROOT
+from ..logging import logger
+from . import gmo
+from .metrics import registry as metrics
+
+FEATURE_CACHE_DIR = PROJECT_ROOT / "data" / "features"
+
+_DATETIME_FORMAT = "%Y%m%d%H%M%S"
+
+# 入力のbarの行ごとのhashを保存する列
+_BARS_HASH = "_bars_hash"
+_HASH_SEEDS = (0, 1, 2, 3)
+
+
+def _calc_features(df: pl.DataFrame) -> pl.DataFrame:
+    from stock.crypto.feature import calc_features  # sklearnとTA-Libのimportは使う時まで遅らせる
+
+    return calc_features(df)
+
+
+def _source_digest(func: Callable) -> str:
+    """`func`を定義しているモジュールのソースのhash。ソースが取得できない場合は名前を使う"""
+    try:
+        source = inspect.getsource(inspect.getmodule(func))
+    except (TypeError, OSError):
+        source = f"{func.__module__}.{func.__qualname__}"
+    return hashlib.sha256(source.encode()).hexdigest()
+
+
+def _hash_bars(df: pl.DataFrame) -> pl.Series:
+    # polarsのversionでhashの値が変わりうるので、versionは`feature_hash`に含める
+    return df.hash_rows(*_HASH_SEEDS).alias(_BARS_HASH)
+
+
+class FeatureCache:
+    """`calc_features`の結果を(symbol, interval, barの範囲, 特徴量の種類のhash)ごとにArrow IPCファイルに保存する。
+    `{root}/{symbol}/{interval}/{feature_hash}/{開始日時}_{終了日時}.arrow`に無圧縮で保存し、memory mapで読み込む。
+    `feature_hash`は計算する関数のモジュールのソース、`version`、出力される列から求める。
+
+    入力のbarの行ごとのhashも保存し、読み込む際に渡されたbarと比較する。
+    途中のbarが一致しない場合(確定前のbarを保存した場合や、klineが修正された場合)と、barが追加された場合は、
+    最初に一致しないbarから後ろだけを直前の`lookback`本と合わせて計算し、ファイルを置き換える。
+    EMAなどの再帰的な指標は計算を始めたbarに依存するので、全期間を計算し直した値とは僅かに異なる。
+    開始日時が後のbarを指定した場合は、それを含むファイルから切り出すので、指標はより前のbarから計算した値になる。
+    ファイルの合計サイズが`max_bytes`を超えた場合は、最後に使ってから長いファイルから削除する。
+    """
+
+    def __init__(
+        self,
+        calc: Callable[[pl.DataFrame], pl.DataFrame] | None = None,
+        root: Path = FEATURE_CACHE_DIR,
+        version: str = "",
+        lookback: int = 1000,
+        max_bytes: int = 10 << 30,
+    ):
+        self.calc = _calc_features if calc is None else calc
+        self.root = root
+        self.version = version
+        self.lookback = lookback
+        self.max_bytes = max_bytes
+        self.feature_hash: str | None = None  # 最初の`get`で出力される列を確認して決める
+        self._lock = threading.Lock()
+
+    def _feature_hash(self, df: pl.DataFrame) -> str:
+        """計算方法のソース、`version`、先頭の`lookback`本から計算した列名と型からhashを求める"""
+        if self.feature_hash is None:
+            schema = self.calc(df[: self.lookback]).schema
+            if self.calc is _calc_features:
+                from stock.crypto.feature import calc_features
+
+                source = _source_digest(calc_features)
+            else:
+                source = _source_digest(self.calc)
+            columns = ",".join(f"{name}:{dtype}" for name, dtype in schema.items())
+            key = f"{source}:{self.version}:{columns}:{pl.__version__}"
+            self.feature_hash = hashlib.sha256(key.encode()).hexdigest()[:16]
+        return self.feature_hash
+
+    def get(self, symbol: str, interval: str | datetime.timedelta, df: pl.DataFrame) -> pl.DataFrame:
+        """`df`の全てのbarの特徴量を返す。キャッシュに無いbarの分だけ計算する"""
+        if isinstance(interval, datetime.timedelta):
+            interval = gmo.convert_timedelta_to_str(interval)
+        df = df.sort("datetime")
+        if len(df) == 0:
+            return self.calc(df)
+        start, end = df["datetime"][0], df["datetime"][-1]
+        directory = self.root / symbol / interval / self._feature_hash(df)
+        bars_hash = _hash_bars(df)
+        with self._lock:
+            entry = self._find(directory, start)
+            if entry is None:
+                metrics.record("feature_cache.miss", 0.0)
+                features = self._extend(None, df, bars_hash)
+                path = self._write(directory, features)
+            else:
+                path, _ = entry
+                features = pl.read_ipc(path, memory_map=True)
+                cached = features.filter(pl.col("datetime") >= start)
+                mismatch = self._first_mismatch(cached, df, bars_hash)
+                if mismatch == len(df):
+                    metrics.record("feature_cache.hit", 0.0)
+                    os.utime(path)  # 最後に使った時刻を更新する
+                else:
+                    # 保存済みのbarと異なる場合は古い特徴量を捨てて計算し直し、barが追加された場合は追加分だけ計算する
+                    if mismatch < len(cached):
+                        metrics.record("feature_cache.stale", 0.0)
+                    else:
+                        metrics.record("feature_cache.extend", 0.0)
+                    valid = pl.concat([features.filter(pl.col("datetime") < start), cached[:mismatch]])
+                    features = self._extend(valid, df[mismatch:], bars_hash[mismatch:])
+                    new_path = self._write(directory, features)
+                    if new_path != path:
+                        path.unlink(missing_ok=True)  # 同じ開始日時の古い範囲は不要になる
+                    path = new_path
+            self._evict(keep=path)
+        return features.filter(pl.col("datetime").is_between(start, end)).drop(_BARS_HASH)
+
+    @staticmethod
+    def _first_mismatch(cached: pl.DataFrame, df: pl.DataFrame, bars_hash: pl.Series) -> int:
+        """`cached`の先頭から比較して、日時かbarのhashが最初に一致しない`df`の行番号。全て一致する場合は`len(df)`"""
+        n = min(len(cached), len(df))
+        same = (cached["datetime"][:n] == df["datetime"][:n]) & (cached[_BARS_HASH][:n] == bars_hash[:n])
+        if same.all():
+            return n
+        return int(same.arg_min())
+
+    def _extend(
+        self, features: pl.DataFrame | None, new_bars: pl.DataFrame, bars_hash: pl.Series
+    ) -> pl.DataFrame:
+        """`new_bars`の特徴量を直前の`lookback`本のbarと合わせて計算し、`features`の後ろに追加する"""
+        if features is None or len(features) == 0:
+            with metrics.timer("feature_cache.calc"):
+                return self.calc(new_bars).with_columns(bars_hash)
+        columns = [name for name in new_bars.columns if name in features.columns]
+        history = features.select(columns)[-self.lookback :]
+        with metrics.timer("feature_cache.calc"):
+            tail = self.calc(pl.concat([history, new_bars.select(columns)]))[len(history) :]
+        tail = tail.with_columns(bars_hash)
+        return pl.concat([features, tail.select(features.columns)], how="vertical_relaxed")
+
+    def _find(self, directory: Path, start: datetime.datetime) -> tuple[Path, datetime.datetime] | None:
+        """`start`のbarを含むファイルのうち、終了日時が最も遅いもの"""
+        best = None
+        for path in directory.glob("*.arrow"):
+            entry_start, entry_end = (
+                datetime.datetime.strptime(s, _DATETIME_FORMAT) for s in path.stem.split("_")
+            )
+            if entry_start <= start <= entry_end and (best is None or entry_end > best[1]):
+                best = (path, entry_end)
+        return best
+
+    def _write(self, directory: Path, features: pl.DataFrame) -> Path:
+        start, end = features["datetime"][0], features["datetime"][-1]
+        path = directory / f"{start.strftime(_DATETIME_FORMAT)}_{end.strftime(_DATETIME_FORMAT)}.arrow"
+        directory.mkdir(parents=True, exist_ok=True)
+        # memory mapで読めるように無圧縮で書き込み、書き込み途中のファイルを読まないようにrenameする
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        features.write_ipc(tmp_path, compression="uncompressed")
+        tmp_path.replace(path)
+        return path
+
+    def _evict(self, keep: Path):
+        """合計サイズが`max_bytes`以下になるまで、最後に使ってから長いファイルを削除する"""
+        files = [(path.stat(), path) for path in self.root.glob("*/*/*/*.arrow")]
+        total = sum(stat.st_size for stat, _ in files)
+        for stat, path in sorted(files, key=lambda file: file[0].st_mtime):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            path.unlink(missing_ok=True)
+            total -= stat.st_size
+            logger.debug("Evicted feature cache : {}".format(path))
@@ -1,22 +1,39 @@
 """gmo.py
 """
 
+import contextvars
 import datetime
 import hashlib
 import hmac
 import json
+import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
 import polars as pl
 import requests
+from requests.adapters import HTTPAdapter
+from requests_ratelimiter import LimiterAdapter
 
 from ..constants import PROJECT_ROOT
 from ..logging import logger
+from .kline_store import KlineStore, default_store, is_closed_day
+from .metrics import MetricsRegistry, registry
+from .rate_limiter import Priority, PriorityRateLimiter
 
 CERT_FILE = PROJECT_ROOT / "cert" / "gmo_api.json"
 
-PUBLIC_END_POINT = "https://api.coin.z.com/public"
-PRIVATE_END_POINT = "https://api.coin.z.com/private"
+# 環境変数で接続先を切り替えられる(ローカルの`FakeExchangeServer`を使う場合など)
+PUBLIC_END_POINT = os.environ.get("GMO_PUBLIC_END_POINT", "https://api.coin.z.com/public")
+PRIVATE_END_POINT = os.environ.get("GMO_PRIVATE_END_POINT", "https://api.coin.z.com/private")
+
+# 1秒あたりの呼び出し回数の上限でエラーになった場合のエラーコード
+RATE_LIMIT_ERROR_CODE = "ERR-5003"
+
+# `/v1/closeOrder`で1回に決済できる建玉の数
+MAX_SETTLE_POSITIONS = 10
 
 LEVERAGE_SYMBOLS = [
     "BTC_JPY",
@@ -62,68 +79,10 @@ def convert_timedelta_to_str(interval: datetime.timedelta):
     raise ValueError(f"Invalid interval: {interval}")
 
 
-def public_api(path: str, parameters: dict = {}):
-    if len(parameters) > 0:
-        path += "?{}".format("&".join([f"{k}={v}" for k, v in parameters.items()]))
-    res = requests.get(PUBLIC_END_POINT + path).json()
-    if res["status"] != 0:
-        raise RuntimeError("Failed to run GMO API. Response : {}".format(json.dumps(res, indent=2)))
-    return res
-
-
-def private_api(path: str, parameters: dict, method: str):
-    timestamp = "{0}000".format(int(time.mktime(datetime.datetime.now().timetuple())))
-
-    with open(CERT_FILE, "r") as f:
-        cert = json.load(f)
-        api_key = cert["api_key"]
-        secret_key = cert["api_secret"]
-
-    text = timestamp + method + path
-    if method != "GET":
-        text += json.dumps(parameters)
-    sign = hmac.new(
-        bytes(secret_key.encode("ascii")), bytes(text.encode("ascii")), hashlib.sha256
-    ).hexdigest()
-
-    headers = {"API-KEY": api_key, "API-TIMESTAMP": timestamp, "API-SIGN": sign}
-
-    if method == "GET":
-        res = requests.get(PRIVATE_END_POINT + path, headers=headers, params=parameters)
-    elif method == "POST":
-        res = requests.post(PRIVATE_END_POINT + path, headers=headers, data=json.dumps(parameters))
-    elif method == "PUT":
-        res = requests.put(PRIVATE_END_POINT + path, headers=headers, data=json.dumps(parameters))
-    else:
-        raise ValueError(f"Invalid method: {method}")
-
-    res = res.json()
-    if res["status"] != 0:
-        raise RuntimeError(
-            "Failed to run GMO API. Parameters = {}\nResponse : {}".format(
-                json.dumps(parameters, indent=2), json.dumps(res, indent=2)
-            )
-        )
-
-    return res
-
-
-def get_ohlc(symbol, interval: str | datetime.timedelta, date=datetime.datetime.now()) -> pl.DataFrame:
-    if isinstance(interval, datetime.timedelta):
-        interval = convert_timedelta_to_str(interval)
-    date_str = date.strftime("%Y%m%d")
-    path = f"/v1/klines?symbol={symbol}&interval={interval}&date={date_str}"
-
-    response = requests.get(PUBLIC_END_POINT + path)
-    res = response.json()
-    if res["status"] != 0:
-        raise RuntimeError("Failed to run GMO API. Response : {}".format(json.dumps(res, indent=2)))
-    if "data" not in res or len(res["data"]) == 0:
-        logger.warning(f"No data for {symbol} on {date}")
-        return pl.DataFrame()
-
+def parse_klines(data: list[dict]) -> pl.DataFrame:
+    """klinesのレスポンスをDataFrameに変換する"""
     df = (
-        pl.from_dicts(res["data"])
+        pl.from_dicts(data)
         .with_columns(
             pl.col("openTime").cast(pl.Float64),
             pl.col("open").cast(pl.Float64),
@@ -139,114 +98,425 @@ def get_ohlc(symbol, interval: str | datetime.timedelta, date=datetime.datetime.
     return df
 
 
-def post_order(symbol: str, price: float, volume):
-    side = "BUY" if volume > 0 else "SELL"
-    if price > 0:
+class GmoClient:
+    """GMOコインのREST APIクライアント。
+    keep-aliveのセッションで接続を使い回し、認証情報は最初のprivate APIの呼び出し時に一度だけ読み込む。
+    private APIは`rate_limiter`で優先度の高い呼び出しから順に実行し、rate limitを超える分はエラーにせず待たせる。
+    """
+
+    def __init__(
+        self,
+        public_end_point: str = PUBLIC_END_POINT,
+        private_end_point: str = PRIVATE_END_POINT,
+        cert_file: Path = CERT_FILE,
+        pool_maxsize: int = 16,
+        timeout: float | None = 10.0,
+        api_key: str | None = None,
+        api_secret: str | None = None,
+        metrics: MetricsRegistry = registry,
+        rate_limiter: PriorityRateLimiter | None = None,
+        public_rate_limit: float | None = 6.0,
+        max_rate_limit_retries: int = 3,
+    ):
+        self.public_end_point = public_end_point
+        self.private_end_point = private_end_point
+        self.cert_file = cert_file
+        self.timeout = timeout
+        self.metrics = metrics
+        self.rate_limiter = rate_limiter if rate_limiter is not None else PriorityRateLimiter()
+        self.max_rate_limit_retries = max_rate_limit_retries
+        self._public_session = self._create_session(pool_maxsize, public_rate_limit)
+        self._private_session = self._create_session(pool_maxsize)
+        self._api_key: str | None = api_key
+        self._signer: "hmac.HMAC | None" = None
+        if api_secret is not None:
+            self._signer = hmac.new(bytes(api_secret.encode("ascii")), digestmod=hashlib.sha256)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=pool_maxsize)
+
+    @staticmethod
+    def _create_session(pool_maxsize: int, rate_limit: float | None = None) -> requests.Session:
+        session = requests.Session()
+        if rate_limit is None:
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        else:
+            adapter = LimiterAdapter(
+                per_second=rate_limit, pool_connections=1, pool_maxsize=pool_maxsize
+            )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _load_credentials(self):
+        with self._lock:
+            if self._signer is not None:
+                return
+            with open(self.cert_file, "r") as f:
+                cert = json.load(f)
+            self._api_key = cert["api_key"]
+            self._signer = hmac.new(bytes(cert["api_secret"].encode("ascii")), digestmod=hashlib.sha256)
+
+    def _sign(self, text: str) -> str:
+        if self._signer is None:
+            self._load_credentials()
+        assert self._signer is not None
+        signer = self._signer.copy()
+        signer.update(bytes(text.encode("ascii")))
+        return signer.hexdigest()
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self._public_session.close()
+        self._private_session.close()
+
+    def public_api(self, path: str, parameters: dict = {}):
+        """public APIを呼び出す。rate limitのエラーが返ってきた場合は`max_rate_limit_retries`回まで再実行する"""
+        for retry in range(self.max_rate_limit_retries + 1):
+            with self.metrics.timer(f"api.GET {path}"):
+                res = self._public_api(path, parameters)
+                if not self._is_rate_limited(res) or retry == self.max_rate_limit_retries:
+                    return self._check_response(res, parameters)
+            logger.warning(f"Rate limit exceeded : GET {path}")
+            time.sleep(1.0)
+        raise AssertionError("unreachable")
+
+    def private_api(self, path: str, parameters: dict, method: str, priority: Priority | None = None):
+        """private APIを呼び出す。
+        優先度は`priority`、Noneの場合は`rate_limiter.priority`で設定された値を使う。
+        rate limitのエラーが返ってきた場合は、待ち行列に並び直して`max_rate_limit_retries`回まで再実行する。
+        """
+        for retry in range(self.max_rate_limit_retries + 1):
+            waited = self.rate_limiter.acquire(method, priority)
+            self.metrics.record(f"ratelimit.{method}", waited)
+            with self.metrics.timer(f"api.{method} {path}"):
+                res = self._private_api(path, parameters, method)
+                if not self._is_rate_limited(res) or retry == self.max_rate_limit_retries:
+                    return self._check_response(res, parameters)
+            logger.warning(f"Rate limit exceeded : {method} {path}")
+            time.sleep(1.0)
+        raise AssertionError("unreachable")
+
+    @staticmethod
+    def _is_rate_limited(res: dict) -> bool:
+        return res["status"] != 0 and any(
+            message.get("message_code") == RATE_LIMIT_ERROR_CODE for message in res.get("messages", [])
+        )
+
+    @staticmethod
+    def _check_response(res: dict, parameters: dict) -> dict:
+        if res["status"] != 0:
+            raise RuntimeError(
+                "Failed to run GMO API. Parameters = {}\nResponse : {}".format(
+                    json.dumps(parameters, indent=2), json.dumps(res, indent=2)
+                )
+            )
+        return res
+
+    def _public_api(self, path: str, parameters: dict):
+        return self._public_session.get(
+            self.public_end_point + path, params=parameters, timeout=self.timeout
+        ).json()
+
+    def _private_api(self, path: str, parameters: dict, method: str):
+        timestamp = "{0}".format(int(time.time() * 1000))
+        text = timestamp + method + path
+        if method != "GET":
+            text += json.dumps(parameters)
+        sign = self._sign(text)
+
+        headers = {"API-KEY": self._api_key, "API-TIMESTAMP": timestamp, "API-SIGN": sign}
+
+        url = self.private_end_point + path
+        if method == "GET":
+            res = self._private_session.get(
+                url, headers=headers, params=parameters, timeout=self.timeout
+            )
+        elif method == "POST":
+            res = self._private_session.post(
+                url, headers=headers, data=json.dumps(parameters), timeout=self.timeout
+            )
+        elif method == "PUT":
+            res = self._private_session.put(
+                url, headers=headers, data=json.dumps(parameters), timeout=self.timeout
+            )
+        else:
+            raise ValueError(f"Invalid method: {method}")
+
+        return res.json()
+
+    def get_ohlc(
+        self,
+        symbol,
+        interval: str | datetime.timedelta,
+        date: datetime.datetime | None = None,
+        store: KlineStore | None = default_store,
+        now: datetime.datetime | None = None,
+    ) -> pl.DataFrame:
+        """`date`の日のklineを取得する。
+        確定済みの日のデータは`store`から読み込み、存在しない場合のみAPIから取得して`store`に保存する。
+        `store`がNoneの場合は常にAPIから取得する。確定済みかどうかは`now`(Noneの場合は現在時刻)で判定する。
+        """
+        if isinstance(interval, datetime.timedelta):
+            interval = convert_timedelta_to_str(interval)
+        if now is None:
+            now = datetime.datetime.now()
+        if date is None:
+            date = now
+        date_str = date.strftime("%Y%m%d")
+
+        closed = is_closed_day(date, now)
+        if store is not None and closed:
+            df = store.load(symbol, interval, date_str)
+            if df is not None:
+                return df
+
+        res = self.public_api("/v1/klines", {"symbol": symbol, "interval": interval, "date": date_str})
+        if "data" not in res or len(res["data"]) == 0:
+            logger.warning(f"No data for {symbol} on {date}")
+            return pl.DataFrame()
+
+        df = parse_klines(res["data"])
+        if store is not None and closed:
+            store.save(symbol, interval, date_str, df)
+        return df
+
+    def post_order(self, symbol: str, price: float, volume):
+        side = "BUY" if volume > 0 else "SELL"
+        if price > 0:
+            params = {
+                "symbol": symbol,
+                "side": side,
+                "executionType": "LIMIT",
+                "timeInForce": "FAS",
+                "price": str(int(price)),
+                "size": str(abs(volume)),
+            }
+        else:
+            params = {
+                "symbol": symbol,
+                "side": side,
+                "executionType": "MARKET",
+                "timeInForce": "FAS",
+                "size": str(abs(volume)),
+            }
+        res = self.private_api("/v1/order", parameters=params, method="POST")
+        return res
+
+    def post_leverage_close_order(
+        self, symbol: int, price: float, volume: str | float, position_id: int, side: str
+    ):
+        return self.post_leverage_close_positions(symbol, price, [(position_id, volume)], side)
+
+    def post_leverage_close_positions(
+        self, symbol: str, price: float, positions: list[tuple[int, str | float]], side: str
+    ):
+        """複数の建玉(position_id, 数量)を1つの注文で決済する。建玉は`MAX_SETTLE_POSITIONS`件まで"""
+        assert 0 < len(positions) <= MAX_SETTLE_POSITIONS
         params = {
             "symbol": symbol,
             "side": side,
-            "executionType": "LIMIT",
+            "executionType": "LIMIT" if price > 0 else "MARKET",
             "timeInForce": "FAS",
-            "price": str(int(price)),
-            "size": str(abs(volume)),
+            "settlePosition": [
+                {"positionId": int(position_id), "size": str(volume)}
+                for position_id, volume in positions
+            ],
         }
-    else:
-        params = {
-            "symbol": symbol,
-            "side": side,
-            "executionType": "MARKET",
-            "timeInForce": "FAS",
-            "size": str(abs(volume)),
+        if price > 0:
+            params["price"] = str(int(price))
+        res = self.private_api("/v1/closeOrder", parameters=params, method="POST")
+        return res
+
+    def change_order(self, order_id: str, price: float):
+        """有効な指値注文の価格を変更する"""
+        return self.private_api(
+            "/v1/changeOrder",
+            parameters={"orderId": int(order_id), "price": str(int(price))},
+            method="POST",
+        )
+
+    def is_order_finished(self, order_id: str) -> bool:
+        """`order_id`の注文が終了状態かどうかを返す"""
+        res = self.private_api("/v1/orders", parameters={"orderId": order_id}, method="GET")
+        return res["data"]["list"][0]["status"] in ["CANCELED", "EXECUTED", "EXPIRED"]
+
+    def calc_executed_volume(self, order_id: str) -> float:
+        """`order_id`の注文で約定済みの数量を求める"""
+        executed_volume = 0.0
+        res = self.private_api("/v1/executions", parameters={"orderId": order_id}, method="GET")
+        if "list" not in res["data"]:
+            return executed_volume
+        for data in res["data"]["list"]:
+            if data["side"] == "BUY":
+                executed_volume += float(data["size"])
+            elif data["side"] == "SELL":
+                executed_volume -= float(data["size"])
+        return executed_volume
+
+    def get_all_pages(
+        self,
+        path: str,
+        parameters: dict,
+        count: int = 100,
+        max_pages: int | None = None,
+        concurrency: int = 1,
+    ) -> list[dict]:
+        """ページングされたprivate APIの結果を全ページ分取得する。
+        総ページ数は分からないので、1ページ目が埋まっていた場合は次の`concurrency`ページをまとめて並行に取得する。
+        """
+
+        def fetch(page: int) -> list[dict]:
+            res = self.private_api(
+                path,
+                parameters={**parameters, "page": page, "count": count},
+                method="GET",
+            )
+            return res["data"].get("list", [])
+
+        results = fetch(1)
+        page = 2
+        last_size = len(results)
+        while last_size == count and (max_pages is None or page <= max_pages):
+            last_page = page + concurrency - 1
+            if max_pages is not None:
+                last_page = min(last_page, max_pages)
+            pages = list(range(page, last_page + 1))
+            if len(pages) == 1:
+                batches = [fetch(page)]
+            else:
+                # ワーカースレッドでも呼び出し元の優先度でrate limitを待つように、contextをコピーして実行する
+                futures = [
+                    self._executor.submit(contextvars.copy_context().run, fetch, page) for page in pages
+                ]
+                batches = [future.result() for future in futures]
+            for batch in batches:
+                results += batch
+                last_size = len(batch)
+                if last_size != count:
+                    break
+            page = last_page + 1
+        return results
+
+    def get_all_positions(self, symbol: str, concurrency: int = 4) -> list[dict]:
+        """`symbol`の建玉を全て取得する。建玉が多い場合は複数ページを並行に取得する"""
+        return self.get_all_pages("/v1/openPositions", {"symbol": symbol}, concurrency=concurrency)
+
+    def get_active_orders(self, symbol: str) -> list[dict]:
+        """`symbol`の有効な注文を全て取得する"""
+        return self.get_all_pages("/v1/activeOrders", {"symbol": symbol})
+
+    def get_latest_executions(self, symbol: str, page: int = 1, count: int = 100) -> list[dict]:
+        """`symbol`の直近の約定を新しい順に取得する"""
+        res = self.private_api(
+            "/v1/latestExecutions",
+            parameters={"symbol": symbol, "page": page, "count": count},
+            method="GET",
+        )
+        return res["data"].get("list", [])
+
+    def get_executions(self, order_id: str) -> list[dict]:
+        """`order_id`の注文の約定を取得する"""
+        res = self.private_api("/v1/executions", parameters={"orderId": order_id}, method="GET")
+        return res["data"].get("list", [])
+
+    def get_open_positions(self, order_id: str) -> list[dict]:
+        res = self.private_api("/v1/executions", parameters={"orderId": order_id}, method="GET")
+        if "list" not in res["data"]:
+            return []
+
+        positions = {
+            int(pos["positionId"]): pos
+            for pos in self.get_all_positions(res["data"]["list"][0]["symbol"])
         }
-    res = private_api("/v1/order", parameters=params, method="POST")
-    return res
+        position_ids = dict.fromkeys(
+            int(data["positionId"]) for data in res["data"]["list"] if "positionId" in data
+        )
+        return [positions[pid] for pid in position_ids if pid in positions]
+
+
+_client: GmoClient | None = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> GmoClient:
+    """モジュール関数が使う共有クライアントを返す"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = GmoClient()
+    return _client
+
+
+def set_client(client: GmoClient | None):
+    """モジュール関数が使うクライアントを差し替える。Noneの場合は次回の呼び出し時に再作成する"""
+    global _client
+    _client = client
+
+
+def public_api(path: str, parameters: dict = {}):
+    return get_client().public_api(path, parameters)
+
+
+def private_api(path: str, parameters: dict, method: str, priority: Priority | None = None):
+    return get_client().private_api(path, parameters, method, priority)
+
+
+def get_ohlc(
+    symbol,
+    interval: str | datetime.timedelta,
+    date: datetime.datetime | None = None,
+    store: KlineStore | None = default_store,
+    now: datetime.datetime | None = None,
+) -> pl.DataFrame:
+    return get_client().get_ohlc(symbol, interval, date=date, store=store, now=now)
+
+
+def post_order(symbol: str, price: float, volume):
+    return get_client().post_order(symbol, price, volume)
 
 
 def post_leverage_close_order(
     symbol: int, price: float, volume: str | float, position_id: int, side: str
 ):
-    if price > 0:
-        params = {
-            "symbol": symbol,
-            "side": side,
-            "executionType": "LIMIT",
-            "timeInForce": "FAS",
-            "price": str(int(price)),
-            "settlePosition": [
-                {
-                    "positionId": int(position_id),
-                    "size": str(volume),
-                }
-            ],
-        }
-    else:
-        params = {
-            "symbol": symbol,
-            "side": side,
-            "executionType": "MARKET",
-            "timeInForce": "FAS",
-            "settlePosition": [
-                {
-                    "positionId": int(position_id),
-                    "size": str(volume),
-                }
-            ],
-        }
-    res = private_api("/v1/closeOrder", parameters=params, method="POST")
-    return res
+    return get_client().post_leverage_close_order(symbol, price, volume, position_id, side)
+
+
+def post_leverage_close_positions(
+    symbol: str, price: float, positions: list[tuple[int, str | float]], side: str
+):
+    return get_client().post_leverage_close_positions(symbol, price, positions, side)
+
+
+def change_order(order_id: str, price: float):
+    return get_client().change_order(order_id, price)
 
 
 def is_order_finished(order_id: str) -> bool:
     """`order_id`の注文が終了状態かどうかを返す"""
-    res = private_api("/v1/orders", parameters={"orderId": order_id}, method="GET")
-    return res["data"]["list"][0]["status"] in ["CANCELED", "EXECUTED", "EXPIRED"]
+    return get_client().is_order_finished(order_id)
 
 
 def calc_executed_volume(order_id: str) -> float:
     """`order_id`の注文で約定済みの数量を求める"""
-    executed_volume = 0.0
-    res = private_api("/v1/executions", parameters={"orderId": order_id}, method="GET")
-    if "list" not in res["data"]:
-        return executed_volume
-    for data in res["data"]["list"]:
-        if data["side"] == "BUY":
-            executed_volume += float(data["size"])
-        elif data["side"] == "SELL":
-            executed_volume -= float(data["size"])
-    return executed_volume
+    return get_client().calc_executed_volume(order_id)
 
 
 def get_all_positions(symbol: str) -> list[dict]:
-    page = 1
-    count = 100
+    return get_client().get_all_positions(symbol)
+
+
+def get_active_orders(symbol: str) -> list[dict]:
+    return get_client().get_active_orders(symbol)
+
+
+def get_latest_executions(symbol: str, page: int = 1, count: int = 100) -> list[dict]:
+    return get_client().get_latest_executions(symbol, page, count)
 
-    positions = []
-    while True:
-        res = private_api(
-            "/v1/openPositions",
-            parameters={"symbol": symbol, "page": page, "count": count},
-            method="GET",
-        )
-        if "list" not in res["data"]:
-            break
 
-        positions += res["data"]["list"]
-        if len(res["data"]["list"]) != count:
-            break
-        page += 1
-    return positions
+def get_executions(order_id: str) -> list[dict]:
+    return get_client().get_executions(order_id)
 
 
 def get_open_positions(order_id: str) -> list[dict]:
-    res = private_api("/v1/executions", parameters={"orderId": order_id}, method="GET")
-    if "list" not in res["data"]:
-        return []
-
-    all_positions = get_all_positions(res["data"]["list"][0]["symbol"])
-    open_positions = []
-    for data in res["data"]["list"]:
-        for pos in all_positions:
-            if pos["positionId"] == data["positionId"]:
-                open_positions.append(pos)
-                break
-    return open_positions
+    return get_client().get_open_positions(order_id)
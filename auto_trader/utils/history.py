@@ -1,19 +1,32 @@
 """history.py
 """
 
+import queue
+import threading
+import time
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 import polars as pl
 
-from ..order import BaseOrder
+from ..logging import logger
+from .metrics import registry as metrics
+from .rate_limiter import Priority, priority
 
+if TYPE_CHECKING:
+    from ..order import BaseOrder, OrderState
 
-def log_closed_order(closed_orders: list[BaseOrder], trade_history_csv: Path):
+FLOAT_COLUMNS = ["size", "price", "lossGain", "fee"]
+
+
+def log_closed_order(
+    closed_orders: list["BaseOrder"], trade_history_csv: Path, state: "OrderState | None" = None
+):
     """closed_ordersの情報をcsvに書き込む"""
     if len(closed_orders) == 0:
         return
 
-    history_list = sum([order.summary() for order in closed_orders], [])
+    history_list = sum([order.summary(state) for order in closed_orders], [])
     if len(history_list) == 0:
         # print("Failed to collect history data : {}".format(closed_orders))
         return
@@ -24,3 +37,98 @@ def log_closed_order(closed_orders: list[BaseOrder], trade_history_csv: Path):
     else:
         with open(trade_history_csv, "a") as f:
             df.write_csv(f, include_header=False)
+
+
+def read_history(history_dir: Path) -> pl.DataFrame:
+    """`HistoryWriter`が書き込んだ取引履歴をまとめて読み込む"""
+    paths = sorted(history_dir.glob("part-*.parquet"))
+    if len(paths) == 0:
+        return pl.DataFrame()
+    return pl.concat([pl.read_parquet(path) for path in paths], how="diagonal_relaxed")
+
+
+class HistoryWriter:
+    """終了した注文の約定をバックグラウンドで集めてメモリに溜め、まとめてParquetに書き込む。
+    `flush_interval`秒経過するか、`flush_size`件溜まった時点で`{history_dir}/part-{n}.parquet`に書き込む。
+    `submit`はキューに入れるだけなので、取引のループは約定の取得やファイルの書き込みを待たない。
+    """
+
+    def __init__(self, history_dir: Path, flush_interval: float = 60.0, flush_size: int = 1000):
+        self.history_dir = history_dir
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self._queue: queue.Queue[tuple[list["BaseOrder"], "OrderState | None"] | None] = queue.Queue()
+        self._rows: list[dict] = []
+        self._part = 0
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        self.history_dir.mkdir(parents=True, exist_ok=True)
+        self._part = len(list(self.history_dir.glob("part-*.parquet")))
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, closed_orders: list["BaseOrder"], state: "OrderState | None" = None):
+        """終了した注文を書き込み待ちのキューに入れる。
+        `state`が与えられた場合は、約定を`state`から取得し、取得後に`state`から削除する。
+        """
+        if len(closed_orders) > 0:
+            self._queue.put((list(closed_orders), state))
+
+    def close(self):
+        """キューに残っている注文を全て書き込んでから終了する"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            if item:
+                self._collect(*item)
+            if len(self._rows) >= self.flush_size or time.monotonic() >= deadline:
+                self._try_flush()
+                deadline = time.monotonic() + self.flush_interval
+        self._try_flush()
+
+    def _try_flush(self):
+        # 書き込みに失敗した場合は約定を残しておき、次回の書き込み時に再度試す
+        try:
+            with metrics.timer("history.flush"):
+                self.flush()
+        except Exception:
+            logger.exception("Failed to write history data to {}".format(self.history_dir))
+
+    def _collect(self, closed_orders: list["BaseOrder"], state: "OrderState | None"):
+        try:
+            with priority(Priority.SUMMARY), metrics.timer("history.collect"):
+                self._rows += sum([order.summary(state) for order in closed_orders], [])
+        except Exception:
+            logger.exception("Failed to collect history data : {}".format(closed_orders))
+            return
+        if state is not None:
+            state.forget(sum([order.order_ids() for order in closed_orders], []))
+
+    def flush(self):
+        """溜まっている約定をParquetに書き込む"""
+        if len(self._rows) == 0:
+            return
+        df = pl.from_dicts(self._rows, infer_schema_length=None)
+        df = df.with_columns(
+            pl.col(column).cast(pl.Float64) for column in FLOAT_COLUMNS if column in df.columns
+        )
+        path = self.history_dir / f"part-{self._part:05d}.parquet"
+        # 書き込み途中のファイルを読まないように一時ファイルに書いてからrenameする
+        tmp_path = path.with_suffix(".parquet.tmp")
+        df.write_parquet(tmp_path)
+        tmp_path.replace(path)
+        self._part += 1
+        self._rows = []
@@ -0,0 +1,878 @@
+"""indicators.py
+"""
+
+import math
+from collections import deque
+
+import numpy as np
+import polars as pl
+
+from ..logging import logger
+
+NAN = float("nan")
+RAD2DEG = 180.0 / math.pi
+DEG2RAD = math.pi / 180.0
+
+# 移動和の誤差が蓄積しないように、この回数ごとに窓の値から和を計算し直す
+RESYNC_INTERVAL = 1024
+
+
+def _is_zero(value: float) -> bool:
+    return -1e-8 < value < 1e-8
+
+
+def _std(values: deque[float]) -> float:
+    """母標準偏差。TA-Libと同じく分散が1e-8未満の場合は0"""
+    mean = math.fsum(values) / len(values)
+    variance = math.fsum((x - mean) ** 2 for x in values) / len(values)
+    return math.sqrt(variance) if variance >= 1e-8 else 0.0
+
+
+class _Window:
+    """直近`size`個の値と、その和を保持する"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.values: deque[float] = deque(maxlen=size)
+        self.total = 0.0
+        self._updates = 0
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def is_full(self) -> bool:
+        return len(self.values) == self.size
+
+    def append(self, value: float):
+        if len(self.values) == self.size:
+            self.total -= self.values[0]
+        self.values.append(value)
+        self.total += value
+        self._updates += 1
+        if self._updates % RESYNC_INTERVAL == 0:
+            self.total = math.fsum(self.values)
+
+
+class _SMA:
+    def __init__(self, period: int):
+        self.window = _Window(period)
+
+    def update(self, value: float) -> float:
+        if math.isnan(value):
+            return NAN
+        self.window.append(value)
+        if not self.window.is_full():
+            return NAN
+        return self.window.total / self.window.size
+
+
+class _EMA:
+    """TA-Libと同じく、最初の`period`個の単純平均を初期値とする指数移動平均。NaNの入力は無視する"""
+
+    def __init__(self, period: int):
+        self.period = period
+        self.k = 2.0 / (period + 1)
+        self.value = NAN
+        self._seed: list[float] | None = []
+
+    def update(self, value: float) -> float:
+        if math.isnan(value):
+            return NAN
+        if self._seed is not None:
+            self._seed.append(value)
+            if len(self._seed) < self.period:
+                return NAN
+            self.value = math.fsum(self._seed) / self.period
+            self._seed = None
+            return self.value
+        self.value += self.k * (value - self.value)
+        return self.value
+
+
+class _WMA:
+    """加重移動平均。加重和を1つ前の値から更新する"""
+
+    def __init__(self, period: int):
+        self.period = period
+        self.window = _Window(period)
+        self.weighted = 0.0
+        self.divisor = period * (period + 1) / 2.0
+        self._updates = 0
+
+    def update(self, value: float) -> float:
+        if self.window.is_full():
+            self.weighted += self.period * value - self.window.total
+        else:
+            self.weighted += (len(self.window) + 1) * value
+        self.window.append(value)
+        self._updates += 1
+        if self._updates % RESYNC_INTERVAL == 0:
+            self.weighted = math.fsum((i + 1) * v for i, v in enumerate(self.window.values))
+        if not self.window.is_full():
+            return NAN
+        return self.weighted / self.divisor
+
+
+class _Extreme:
+    """直近`size`本の最大値(最小値)と、そのbarの番号。同じ値の場合は新しいbarを優先する"""
+
+    def __init__(self, size: int, is_max: bool):
+        self.size = size
+        self.is_max = is_max
+        self._deque: deque[tuple[int, float]] = deque()
+
+    def update(self, index: int, value: float) -> tuple[float, int]:
+        d = self._deque
+        if self.is_max:
+            while d and d[-1][1] <= value:
+                d.pop()
+        else:
+            while d and d[-1][1] >= value:
+                d.pop()
+        d.append((index, value))
+        while d[0][0] <= index - self.size:
+            d.popleft()
+        return d[0][1], d[0][0]
+
+
+class Indicator:
+    """1本のbarごとに状態を更新する指標。`names`の順に値を返す。値が計算できない間はNaN"""
+
+    names: tuple[str, ...] = ()
+
+    def update(
+        self, open_: float, high: float, low: float, close: float, volume: float
+    ) -> tuple[float, ...]:
+        raise NotImplementedError
+
+
+class ATR(Indicator):
+    names = ("ATR",)
+
+    def __init__(self, period: int = 14):
+        self.period = period
+        self.prev_close = NAN
+        self.value = NAN
+        self._seed: list[float] | None = []
+
+    def update(self, open_, high, low, close, volume):
+        prev_close, self.prev_close = self.prev_close, close
+        if math.isnan(prev_close):
+            return (NAN,)
+        tr = max(high, prev_close) - min(low, prev_close)
+        if self._seed is not None:
+            self._seed.append(tr)
+            if len(self._seed) < self.period:
+                return (NAN,)
+            self.value = math.fsum(self._seed) / self.period
+            self._seed = None
+        else:
+            self.value = (self.value * (self.period - 1) + tr) / self.period
+        return (self.value,)
+
+
+class DirectionalMovement(Indicator):
+    names = ("DX", "ADX", "ADXR")
+
+    def __init__(self, period: int = 14):
+        self.period = period
+        self.prev: tuple[float, float, float] | None = None
+        self.count = 0
+        self.plus_dm = self.minus_dm = self.tr = 0.0
+        self.dx = NAN
+        self.adx = NAN
+        self._dx_sum = 0.0
+        self._dx_count = 0
+        self._adx_history: deque[float] = deque(maxlen=period)
+
+    def update(self, open_, high, low, close, volume):
+        prev, self.prev = self.prev, (high, low, close)
+        if prev is None:
+            return (NAN, NAN, NAN)
+        prev_high, prev_low, prev_close = prev
+        diff_p, diff_m = high - prev_high, prev_low - low
+        plus_dm = minus_dm = 0.0
+        if diff_m > 0 and diff_p < diff_m:
+            minus_dm = diff_m
+        elif diff_p > 0 and diff_p > diff_m:
+            plus_dm = diff_p
+        tr = max(high, prev_close) - min(low, prev_close)
+
+        n = self.period
+        self.count += 1
+        if self.count < n:
+            self.plus_dm += plus_dm
+            self.minus_dm += minus_dm
+            self.tr += tr
+            return (NAN, NAN, NAN)
+        self.plus_dm += plus_dm - self.plus_dm / n
+        self.minus_dm += minus_dm - self.minus_dm / n
+        self.tr += tr - self.tr / n
+
+        dx = NAN
+        if not _is_zero(self.tr):
+            plus_di = 100.0 * self.plus_dm / self.tr
+            minus_di = 100.0 * self.minus_dm / self.tr
+            if not _is_zero(plus_di + minus_di):
+                dx = 100.0 * abs(minus_di - plus_di) / (plus_di + minus_di)
+        self.dx = dx if not math.isnan(dx) else (0.0 if math.isnan(self.dx) else self.dx)
+
+        if self._dx_count < n:
+            self._dx_count += 1
+            self._dx_sum += 0.0 if math.isnan(dx) else dx
+            if self._dx_count < n:
+                return (self.dx, NAN, NAN)
+            self.adx = self._dx_sum / n
+        elif not math.isnan(dx):
+            self.adx = (self.adx * (n - 1) + dx) / n
+
+        self._adx_history.append(self.adx)
+        adxr = NAN
+        if len(self._adx_history) == n:
+            adxr = (self.adx + self._adx_history[0]) / 2.0
+        return (self.dx, self.adx, adxr)
+
+
+class APO(Indicator):
+    names = ("APO",)
+
+    def __init__(self, fast_period: int = 12, slow_period: int = 26, use_ema: bool = True):
+        self.use_ema = use_ema
+        self.fast = _EMA(fast_period) if use_ema else _SMA(fast_period)
+        self.slow = _EMA(slow_period) if use_ema else _SMA(slow_period)
+        self.fast_start = slow_period - fast_period if use_ema else 0  # `MACD`と同じ
+        self.index = -1
+
+    def update(self, open_, high, low, close, volume):
+        self.index += 1
+        fast = self.fast.update(close) if self.index >= self.fast_start else NAN
+        return (fast - self.slow.update(close),)
+
+
+class Aroon(Indicator):
+    names = ("AROON_aroondown", "AROON_aroonup", "AROONOSC")
+
+    def __init__(self, period: int = 14):
+        self.period = period
+        self.index = -1
+        self.highest = _Extreme(period + 1, is_max=True)
+        self.lowest = _Extreme(period + 1, is_max=False)
+
+    def update(self, open_, high, low, close, volume):
+        self.index += 1
+        _, high_index = self.highest.update(self.index, high)
+        _, low_index = self.lowest.update(self.index, low)
+        if self.index < self.period:
+            return (NAN, NAN, NAN)
+        factor = 100.0 / self.period
+        down = factor * (self.period - (self.index - low_index))
+        up = factor * (self.period - (self.index - high_index))
+        return (down, up, factor * (high_index - low_index))
+
+
+class CCI(Indicator):
+    names = ("CCI",)
+
+    def __init__(self, period: int = 14):
+        self.window: deque[float] = deque(maxlen=period)
+
+    def update(self, open_, high, low, close, volume):
+        tp = (high + low + close) / 3.0
+        self.window.append(tp)
+        if len(self.window) < self.window.maxlen:
+            return (NAN,)
+        mean = math.fsum(self.window) / len(self.window)
+        mean_dev = math.fsum(abs(x - mean) for x in self.window) / len(self.window)
+        if tp - mean != 0.0 and mean_dev != 0.0:
+            return ((tp - mean) / (0.015 * mean_dev),)
+        return (0.0,)
+
+
+class MACD(Indicator):
+    names = ("MACD_macd", "MACD_macdsignal", "MACD_macdhist")
+
+    def __init__(self, fast_period: int = 12, slow_period: int = 26, signal_period: int = 9):
+        self.fast = _EMA(fast_period)
+        self.slow = _EMA(slow_period)
+        self.signal = _EMA(signal_period)
+        # TA-Libと同じく、短期のEMAは長期のEMAと同じbarで計算が始まるように遅らせて開始する
+        self.fast_start = slow_period - fast_period
+        self.index = -1
+
+    def update(self, open_, high, low, close, volume):
+        self.index += 1
+        fast = self.fast.update(close) if self.index >= self.fast_start else NAN
+        macd = fast - self.slow.update(close)
+        signal = self.signal.update(macd)
+        if math.isnan(signal):
+            return (NAN, NAN, NAN)
+        return (macd, signal, macd - signal)
+
+
+class MFI(Indicator):
+    names = ("MFI",)
+
+    def __init__(self, period: int = 14):
+        self.prev_tp = NAN
+        self.positive = _Window(period)
+        self.negative = _Window(period)
+
+    def update(self, open_, high, low, close, volume):
+        tp = (high + low + close) / 3.0
+        prev_tp, self.prev_tp = self.prev_tp, tp
+        if math.isnan(prev_tp):
+            return (NAN,)
+        self.positive.append(tp * volume if tp > prev_tp else 0.0)
+        self.negative.append(tp * volume if tp < prev_tp else 0.0)
+        if not self.positive.is_full():
+            return (NAN,)
+        total = self.positive.total + self.negative.total
+        if total < 1.0:
+            return (0.0,)
+        return (100.0 * self.positive.total / total,)
+
+
+class MOM(Indicator):
+    names = ("MOM",)
+
+    def __init__(self, period: int = 10):
+        self.window: deque[float] = deque(maxlen=period + 1)
+
+    def update(self, open_, high, low, close, volume):
+        self.window.append(close)
+        if len(self.window) < self.window.maxlen:
+            return (NAN,)
+        return (close - self.window[0],)
+
+
+class RSI(Indicator):
+    names = ("RSI",)
+
+    def __init__(self, period: int = 14):
+        self.period = period
+        self.prev_close = NAN
+        self.count = 0
+        self.gain = self.loss = 0.0
+
+    def update(self, open_, high, low, close, volume):
+        prev_close, self.prev_close = self.prev_close, close
+        if math.isnan(prev_close):
+            return (NAN,)
+        diff = close - prev_close
+        gain, loss = max(diff, 0.0), max(-diff, 0.0)
+        n = self.period
+        self.count += 1
+        if self.count < n:
+            self.gain += gain
+            self.loss += loss
+            return (NAN,)
+        if self.count == n:
+            self.gain = (self.gain + gain) / n
+            self.loss = (self.loss + loss) / n
+        else:
+            self.gain = (self.gain * (n - 1) + gain) / n
+            self.loss = (self.loss * (n - 1) + loss) / n
+        total = self.gain + self.loss
+        if _is_zero(total):
+            return (0.0,)
+        return (100.0 * self.gain / total,)
+
+
+class Stochastic(Indicator):
+    names = ("STOCH_slowk", "STOCH_slowd", "STOCHF_fastk")
+
+    def __init__(
+        self, fastk_period: int = 5, slowk_period: int = 3, slowd_period: int = 3, fastd_period: int = 3
+    ):
+        self.fastk_period = fastk_period
+        self.fastf_lookback = fastk_period + fastd_period - 2  # STOCHFの出力が始まるbar
+        self.index = -1
+        self.highest = _Extreme(fastk_period, is_max=True)
+        self.lowest = _Extreme(fastk_period, is_max=False)
+        self.slowk = _SMA(slowk_period)
+        self.slowd = _SMA(slowd_period)
+
+    def update(self, open_, high, low, close, volume):
+        self.index += 1
+        highest, _ = self.highest.update(self.index, high)
+        lowest, _ = self.lowest.update(self.index, low)
+        if self.index < self.fastk_period - 1:
+            return (NAN, NAN, NAN)
+        diff = (highest - lowest) / 100.0
+        fastk = (close - lowest) / diff if diff != 0.0 else 0.0
+        slowk = self.slowk.update(fastk)
+        slowd = self.slowd.update(slowk)
+        if self.index < self.fastf_lookback:
+            fastk = NAN
+        if math.isnan(slowd):
+            return (NAN, NAN, fastk)
+        return (slowk, slowd, fastk)
+
+
+class ULTOSC(Indicator):
+    names = ("ULTOSC",)
+
+    def __init__(self, period1: int = 7, period2: int = 14, period3: int = 28):
+        self.prev_close = NAN
+        self.windows = [(_Window(p), _Window(p)) for p in sorted([period1, period2, period3])]
+
+    def update(self, open_, high, low, close, volume):
+        prev_close, self.prev_close = self.prev_close, close
+        if math.isnan(prev_close):
+            return (NAN,)
+        true_low = min(low, prev_close)
+        bp, tr = close - true_low, max(high, prev_close) - true_low
+        for bp_window, tr_window in self.windows:
+            bp_window.append(bp)
+            tr_window.append(tr)
+        if not self.windows[-1][0].is_full():
+            return (NAN,)
+        total = 0.0
+        for weight, (bp_window, tr_window) in zip([4.0, 2.0, 1.0], self.windows):
+            if not _is_zero(tr_window.total):
+                total += weight * bp_window.total / tr_window.total
+        return (100.0 * total / 7.0,)
+
+
+class WILLR(Indicator):
+    names = ("WILLR",)
+
+    def __init__(self, period: int = 14):
+        self.period = period
+        self.index = -1
+        self.highest = _Extreme(period, is_max=True)
+        self.lowest = _Extreme(period, is_max=False)
+
+    def update(self, open_, high, low, close, volume):
+        self.index += 1
+        highest, _ = self.highest.update(self.index, high)
+        lowest, _ = self.lowest.update(self.index, low)
+        if self.index < self.period - 1:
+            return (NAN,)
+        diff = (highest - lowest) / -100.0
+        return ((highest - close) / diff if diff != 0.0 else 0.0,)
+
+
+class _HilbertBuffer:
+    """TA-Libの`DO_HILBERT_TRANSFORM`の1系列(偶数/奇数のbarのどちらか)分の状態"""
+
+    A = 0.0962
+    B = 0.5769
+
+    def __init__(self):
+        self.values = [0.0, 0.0, 0.0]
+        self.prev = 0.0
+        self.prev_input = 0.0
+
+    def transform(self, value: float, index: int, adjusted_prev_period: float) -> float:
+        temp = self.A * value
+        result = -self.values[index] + temp
+        self.values[index] = temp
+        result -= self.prev
+        self.prev = self.B * self.prev_input
+        result += self.prev
+        self.prev_input = value
+        return result * adjusted_prev_period
+
+
+class _HilbertCore:
+    """TA-LibのHT_*系の指標が共通で使う、価格のWMAとHilbert変換による周期の推定。
+    TA-Libと同じく、先頭の`start`本はWMAの計算だけに使う。
+    """
+
+    def __init__(self, start: int):
+        self.start = start
+        self.index = -1
+        self.prices: deque[float] = deque(maxlen=50)
+        self.smoothed = NAN
+        self.buffers = {
+            (name, parity): _HilbertBuffer()
+            for name in ["detrender", "q1", "ji", "jq"]
+            for parity in [0, 1]
+        }
+        self.hilbert_index = 0
+        self.i1_prev2 = [0.0, 0.0]  # [偶数, 奇数]番目のbarで使うI1の2本前の値
+        self.i1_prev3 = [0.0, 0.0]
+        self.prev_i2 = self.prev_q2 = 0.0
+        self.re = self.im = 0.0
+        self.period = 0.0
+        self.smooth_period = 0.0
+        self.in_phase = self.quadrature = NAN
+
+    def update(self, price: float) -> bool:
+        """barを1本追加する。周期の推定を開始している場合はTrue"""
+        self.index += 1
+        self.prices.append(price)
+        if len(self.prices) < 4:
+            return False
+        p = self.prices
+        self.smoothed = (4.0 * p[-1] + 3.0 * p[-2] + 2.0 * p[-3] + p[-4]) / 10.0
+        if self.index < self.start:
+            return False
+
+        adjusted_prev_period = 0.075 * self.period + 0.54
+        parity = self.index % 2
+        idx = self.hilbert_index
+        buffers = self.buffers
+        detrender = buffers["detrender", parity].transform(self.smoothed, idx, adjusted_prev_period)
+        q1 = buffers["q1", parity].transform(detrender, idx, adjusted_prev_period)
+        in_phase = self.i1_prev3[parity]
+        ji = buffers["ji", parity].transform(in_phase, idx, adjusted_prev_period)
+        jq = buffers["jq", parity].transform(q1, idx, adjusted_prev_period)
+        if parity == 0:
+            self.hilbert_index = (idx + 1) % 3
+        q2 = 0.2 * (q1 + ji) + 0.8 * self.prev_q2
+        i2 = 0.2 * (in_phase - jq) + 0.8 * self.prev_i2
+        other = 1 - parity
+        self.i1_prev3[other] = self.i1_prev2[other]
+        self.i1_prev2[other] = detrender
+        self.in_phase, self.quadrature = in_phase, q1
+
+        self.re = 0.2 * (i2 * self.prev_i2 + q2 * self.prev_q2) + 0.8 * self.re
+        self.im = 0.2 * (i2 * self.prev_q2 - q2 * self.prev_i2) + 0.8 * self.im
+        self.prev_q2, self.prev_i2 = q2, i2
+        prev_period = self.period
+        if self.im != 0.0 and self.re != 0.0:
+            self.period = 360.0 / (math.atan(self.im / self.re) * RAD2DEG)
+        self.period = min(self.period, 1.5 * prev_period)
+        self.period = max(self.period, 0.67 * prev_period)
+        self.period = min(max(self.period, 6.0), 50.0)
+        self.period = 0.2 * self.period + 0.8 * prev_period
+        self.smooth_period = 0.33 * self.period + 0.67 * self.smooth_period
+        return True
+
+
+class HilbertCycle(Indicator):
+    names = ("HT_DCPERIOD", "HT_PHASOR_inphase", "HT_PHASOR_quadrature")
+    LOOKBACK = 32
+
+    def __init__(self):
+        self.core = _HilbertCore(start=12)
+
+    def update(self, open_, high, low, close, volume):
+        self.core.update(close)
+        if self.core.index < self.LOOKBACK:
+            return (NAN, NAN, NAN)
+        return (self.core.smooth_period, self.core.in_phase, self.core.quadrature)
+
+
+class HilbertPhase(Indicator):
+    names = ("HT_DCPHASE", "HT_TRENDMODE", "HT_TRENDLINE")
+    LOOKBACK = 63
+
+    def __init__(self):
+        self.core = _HilbertCore(start=37)
+        self.smooth_prices: deque[float] = deque([0.0] * 50, maxlen=50)
+        self.dc_phase = 0.0
+        self.sine = self.lead_sine = 0.0
+        self.i_trend = [0.0, 0.0, 0.0]
+        self.days_in_trend = 0
+
+    def update(self, open_, high, low, close, volume):
+        core = self.core
+        if not core.update(close):
+            return (NAN, NAN, NAN)
+        self.smooth_prices.append(core.smoothed)
+        smooth_period = core.smooth_period
+        dc_period_int = int(smooth_period + 0.5)
+
+        # Dominant Cycle Phase
+        prev_dc_phase = self.dc_phase
+        real_part = imag_part = 0.0
+        for i in range(dc_period_int):
+            angle = i * 2.0 * math.pi / dc_period_int
+            value = self.smooth_prices[-1 - i]
+            real_part += math.sin(angle) * value
+            imag_part += math.cos(angle) * value
+        if abs(imag_part) > 0.0:
+            self.dc_phase = math.atan(real_part / imag_part) * RAD2DEG
+        elif real_part < 0.0:
+            self.dc_phase -= 90.0
+        elif real_part > 0.0:
+            self.dc_phase += 90.0
+        self.dc_phase += 90.0
+        self.dc_phase += 360.0 / smooth_period
+        if imag_part < 0.0:
+            self.dc_phase += 180.0
+        if self.dc_phase > 315.0:
+            self.dc_phase -= 360.0
+        prev_sine, prev_lead_sine = self.sine, self.lead_sine
+        self.sine = math.sin(self.dc_phase * DEG2RAD)
+        self.lead_sine = math.sin((self.dc_phase + 45.0) * DEG2RAD)
+
+        # Trendline
+        average = 0.0
+        if dc_period_int > 0:
+            average = math.fsum(core.prices[-1 - i] for i in range(dc_period_int)) / dc_period_int
+        i_trend = self.i_trend
+        trendline = (4.0 * average + 3.0 * i_trend[0] + 2.0 * i_trend[1] + i_trend[2]) / 10.0
+        self.i_trend = [average, i_trend[0], i_trend[1]]
+
+        # Trend mode
+        trend = 1
+        if (self.sine > self.lead_sine and prev_sine <= prev_lead_sine) or (
+            self.sine < self.lead_sine and prev_sine >= prev_lead_sine
+        ):
+            self.days_in_trend = 0
+            trend = 0
+        self.days_in_trend += 1
+        if self.days_in_trend < 0.5 * smooth_period:
+            trend = 0
+        phase_change = self.dc_phase - prev_dc_phase
+        if smooth_period != 0.0 and (
+            0.67 * 360.0 / smooth_period < phase_change < 1.5 * 360.0 / smooth_period
+        ):
+            trend = 0
+        if trendline != 0.0 and abs((core.smoothed - trendline) / trendline) >= 0.015:
+            trend = 1
+
+        if core.index < self.LOOKBACK:
+            return (NAN, NAN, NAN)
+        return (self.dc_phase, float(trend), trendline)
+
+
+class BETA(Indicator):
+    names = ("BETA",)
+
+    def __init__(self, period: int = 5):
+        self.prev: tuple[float, float] | None = None
+        self.returns: deque[tuple[float, float]] = deque(maxlen=period)
+
+    def update(self, open_, high, low, close, volume):
+        prev, self.prev = self.prev, (high, low)
+        if prev is None:
+            return (NAN,)
+        x = (high - prev[0]) / prev[0] if prev[0] != 0.0 else 0.0
+        y = (low - prev[1]) / prev[1] if prev[1] != 0.0 else 0.0
+        self.returns.append((x, y))
+        n = len(self.returns)
+        if n < self.returns.maxlen:
+            return (NAN,)
+        s_x = math.fsum(r[0] for r in self.returns)
+        s_y = math.fsum(r[1] for r in self.returns)
+        s_xx = math.fsum(r[0] * r[0] for r in self.returns)
+        s_xy = math.fsum(r[0] * r[1] for r in self.returns)
+        denominator = n * s_xx - s_x * s_x
+        if _is_zero(denominator):
+            return (0.0,)
+        return ((n * s_xy - s_x * s_y) / denominator,)
+
+
+class LinearRegression(Indicator):
+    names = ("LINEARREG", "LINEARREG_ANGLE", "LINEARREG_INTERCEPT", "LINEARREG_SLOPE")
+
+    def __init__(self, period: int = 14):
+        self.window: deque[float] = deque(maxlen=period)
+        n = period
+        self.sum_x = n * (n - 1) / 2.0
+        self.divisor = n * (n * n - 1) / 12.0  # sum((x - mean(x))^2) * n / n
+
+    def update(self, open_, high, low, close, volume):
+        self.window.append(close)
+        n = self.window.maxlen
+        if len(self.window) < n:
+            return (NAN,) * 4
+        sum_y = math.fsum(self.window)
+        sum_xy = math.fsum(i * y for i, y in enumerate(self.window))
+        slope = (sum_xy - self.sum_x * sum_y / n) / self.divisor
+        intercept = (sum_y - slope * self.sum_x) / n
+        return (intercept + slope * (n - 1), math.atan(slope) * RAD2DEG, intercept, slope)
+
+
+class StandardDeviation(Indicator):
+    names = ("STDDEV",)
+
+    def __init__(self, period: int = 5, nbdev: float = 1.0):
+        self.window: deque[float] = deque(maxlen=period)
+        self.nbdev = nbdev
+
+    def update(self, open_, high, low, close, volume):
+        self.window.append(close)
+        if len(self.window) < self.window.maxlen:
+            return (NAN,)
+        return (_std(self.window) * self.nbdev,)
+
+
+class BollingerBands(Indicator):
+    names = ("BBANDS_upperband", "BBANDS_middleband", "BBANDS_lowerband")
+
+    def __init__(self, period: int = 20, nbdev_up: float = 2.0, nbdev_dn: float = 2.0):
+        self.window: deque[float] = deque(maxlen=period)
+        self.nbdev_up, self.nbdev_dn = nbdev_up, nbdev_dn
+
+    def update(self, open_, high, low, close, volume):
+        self.window.append(close)
+        if len(self.window) < self.window.maxlen:
+            return (NAN, NAN, NAN)
+        mean = math.fsum(self.window) / len(self.window)
+        std = _std(self.window)
+        return (mean + std * self.nbdev_up, mean, mean - std * self.nbdev_dn)
+
+
+class MovingAverages(Indicator):
+    names = ("MA", "EMA", "DEMA", "TEMA", "WMA", "TRIMA", "MIDPOINT")
+
+    def __init__(self, period: int = 30, midpoint_period: int = 14):
+        self.ma = _SMA(period)
+        self.ema = [_EMA(period) for _ in range(3)]
+        self.wma = _WMA(period)
+        # 三角移動平均は2つの単純移動平均の合成と等しい
+        if period % 2 == 0:
+            self.trima = (_SMA(period // 2), _SMA(period // 2 + 1))
+        else:
+            self.trima = (_SMA((period + 1) // 2), _SMA((period + 1) // 2))
+        self.midpoint_period = midpoint_period
+        self.index = -1
+        self.highest = _Extreme(midpoint_period, is_max=True)
+        self.lowest = _Extreme(midpoint_period, is_max=False)
+
+    def update(self, open_, high, low, close, volume):
+        e1 = self.ema[0].update(close)
+        e2 = self.ema[1].update(e1)
+        e3 = self.ema[2].update(e2)
+        dema = 2.0 * e1 - e2
+        tema = 3.0 * e1 - 3.0 * e2 + e3
+        if math.isnan(e2):
+            dema = NAN
+        if math.isnan(e3):
+            tema = NAN
+        trima = self.trima[1].update(self.trima[0].update(close))
+
+        self.index += 1
+        highest, _ = self.highest.update(self.index, close)
+        lowest, _ = self.lowest.update(self.index, close)
+        midpoint = (highest + lowest) / 2.0 if self.index >= self.midpoint_period - 1 else NAN
+        return (self.ma.update(close), e1, dema, tema, self.wma.update(close), trima, midpoint)
+
+
+class T3(Indicator):
+    names = ("T3",)
+
+    def __init__(self, period: int = 5, vfactor: float = 0.7):
+        self.ema = [_EMA(period) for _ in range(6)]
+        a = vfactor
+        self.c1 = -a * a * a
+        self.c2 = 3.0 * a * a + 3.0 * a * a * a
+        self.c3 = -6.0 * a * a - 3.0 * a - 3.0 * a * a * a
+        self.c4 = 1.0 + 3.0 * a + a * a * a + 3.0 * a * a
+
+    def update(self, open_, high, low, close, volume):
+        e = []
+        value = close
+        for ema in self.ema:
+            value = ema.update(value)
+            e.append(value)
+        if math.isnan(e[5]):
+            return (NAN,)
+        return (self.c1 * e[5] + self.c2 * e[4] + self.c3 * e[3] + self.c4 * e[2],)
+
+
+class KAMA(Indicator):
+    names = ("KAMA",)
+
+    def __init__(self, period: int = 30):
+        self.period = period
+        self.closes: deque[float] = deque(maxlen=period + 1)
+        self.sum_roc = _Window(period)
+        self.const_max = 2.0 / (period + 1)
+        self.const_diff = 2.0 / 3.0 - self.const_max
+        self.value = NAN
+
+    def update(self, open_, high, low, close, volume):
+        if len(self.closes) > 0:
+            self.sum_roc.append(abs(close - self.closes[-1]))
+        self.closes.append(close)
+        if len(self.closes) < self.closes.maxlen:
+            return (NAN,)
+        if math.isnan(self.value):
+            self.value = self.closes[-2]
+        period_roc = close - self.closes[0]
+        sum_roc = self.sum_roc.total
+        if sum_roc <= period_roc or _is_zero(sum_roc):
+            ratio = 1.0
+        else:
+            ratio = abs(period_roc / sum_roc)
+        smoothing = (ratio * self.const_diff + self.const_max) ** 2
+        self.value += (close - self.value) * smoothing
+        return (self.value,)
+
+
+def default_indicators() -> list[Indicator]:
+    """`Trader0.train_features`とATRを計算する指標。
+    パラメータはTA-Lib(0.6系)のデフォルト値。バッチ計算と異なるパラメータを使う場合は`verify`で検出できる。
+    """
+    return [
+        ATR(),
+        DirectionalMovement(),
+        APO(),
+        Aroon(),
+        CCI(),
+        MACD(),
+        MFI(),
+        MOM(),
+        RSI(),
+        Stochastic(),
+        ULTOSC(),
+        WILLR(),
+        HilbertCycle(),
+        HilbertPhase(),
+        BETA(),
+        LinearRegression(),
+        StandardDeviation(),
+        BollingerBands(),
+        MovingAverages(),
+        T3(),
+        KAMA(),
+    ]
+
+
+class StreamingFeatures:
+    """barを1本追加するごとに全ての指標を定数時間で更新する。
+    1本あたりの計算量はbarのバッファの長さによらないので、短い時間足でも毎回全期間を計算し直す必要が無い。
+
+    EMAなどの再帰的な指標は計算を始めたbarに依存するので、直近`data_length`本だけで計算した値とは僅かに異なる。
+    実装がバッチ計算と一致しているかは`verify`で確認できる。
+    """
+
+    def __init__(self, indicators: list[Indicator] | None = None):
+        self.indicators = default_indicators() if indicators is None else indicators
+        self.names = [name for indicator in self.indicators for name in indicator.names]
+        self.values: dict[str, float] = dict.fromkeys(self.names, NAN)
+        self.count = 0
+
+    def update(self, open: float, high: float, low: float, close: float, volume: float):
+        """確定したbarを1本追加する"""
+        values = self.values
+        for indicator in self.indicators:
+            for name, value in zip(indicator.names, indicator.update(open, high, low, close, volume)):
+                values[name] = value
+        self.count += 1
+
+    def extend(self, df: pl.DataFrame):
+        """`df`の全てのbarを古い順に追加する"""
+        columns = [
+            df[name].cast(pl.Float64).to_numpy() for name in ["open", "high", "low", "close", "volume"]
+        ]
+        for o, h, l, c, v in zip(*columns):
+            self.update(float(o), float(h), float(l), float(c), float(v))
+
+    def vector(self, features: list[str]) -> np.ndarray:
+        """`features`の順に並べた最新の値"""
+        return np.array([self.values[name] for name in features], dtype=np.float64)
+
+    def verify(self, batch: pl.DataFrame, features: list[str], rtol: float = 1e-6) -> dict[str, float]:
+        """現在の値(`predict`で使う値)と、同じbarまでをバッチ計算した`batch`の最後の行を比較する。
+        相対誤差が`rtol`を超えた特徴量はwarningを出力する。特徴量ごとの相対誤差を返す。
+        """
+        errors = {}
+        for name in features:
+            expected = float(batch[name][-1])
+            actual = self.values[name]
+            if math.isnan(expected) and math.isnan(actual):
+                errors[name] = 0.0
+                continue
+            errors[name] = abs(actual - expected) / max(abs(expected), 1e-8)
+        mismatched = {name: error for name, error in errors.items() if not error <= rtol}
+        if len(mismatched) > 0:
+            logger.warning(f"Streaming features differ from batch calculation : {mismatched}")
+        return errors
@@ -0,0 +1,130 @@
+"""kline_downloader.py
+"""
+
+import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import requests
+
+from ..logging import logger
+from . import gmo
+from .kline_store import DAY_START_HOUR, KlineStore, default_store, is_closed_day
+from .metrics import registry as metrics
+
+# (symbol, interval, YYYYMMDD)
+Task = tuple[str, str, str]
+
+
+def last_closed_date(now: datetime.datetime | None = None) -> datetime.date:
+    """klineが確定済みの最後の日"""
+    if now is None:
+        now = datetime.datetime.now()
+    return (now - datetime.timedelta(days=1, hours=DAY_START_HOUR)).date()
+
+
+class KlineDownloader:
+    """複数のシンボル・時間足の確定済みのklineを日単位で並行に取得し、`KlineStore`に保存する。
+
+    取得済みかどうかは`KlineStore`のファイルの有無で判定するので、中断しても次回は残りの日だけを取得する。
+    上場前などデータの無い日はファイルが作られないので、`checkpoint_path`に記録して再取得しない。
+    rate limitは`GmoClient`のpublic APIのセッションで制限し、rate limitのエラーは`GmoClient`が再実行する。
+    """
+
+    def __init__(
+        self,
+        store: KlineStore = default_store,
+        client: gmo.GmoClient | None = None,
+        max_workers: int = 6,
+        max_retries: int = 3,
+        checkpoint_path: Path | None = None,
+    ):
+        self.store = store
+        self.client = client
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.checkpoint_path = (
+            store.root / "empty_days.txt" if checkpoint_path is None else checkpoint_path
+        )
+        self._empty_days: set[str] = set()
+        if self.checkpoint_path.exists():
+            self._empty_days = set(self.checkpoint_path.read_text().split())
+        self._lock = threading.Lock()
+
+    def tasks(
+        self,
+        symbols: list[str],
+        intervals: list[str | datetime.timedelta],
+        start_date: datetime.date,
+        end_date: datetime.date | None = None,
+    ) -> list[Task]:
+        """`start_date`から`end_date`までのうち、まだ取得していない確定済みの日の一覧を新しい順に返す"""
+        if end_date is None:
+            end_date = last_closed_date()
+        intervals = [
+            gmo.convert_timedelta_to_str(i) if isinstance(i, datetime.timedelta) else i
+            for i in intervals
+        ]
+        tasks = []
+        date = end_date
+        while date >= start_date:
+            if is_closed_day(date):
+                date_str = date.strftime("%Y%m%d")
+                for symbol in symbols:
+                    for interval in intervals:
+                        task = (symbol, interval, date_str)
+                        if "/".join(task) in self._empty_days:
+                            continue
+                        if not self.store.path(*task).exists():
+                            tasks.append(task)
+            date -= datetime.timedelta(days=1)
+        return tasks
+
+    def download(
+        self,
+        start_date: datetime.date,
+        end_date: datetime.date | None = None,
+        symbols: list[str] = gmo.LEVERAGE_SYMBOLS,
+        intervals: list[str | datetime.timedelta] = ["1min"],
+    ) -> list[Task]:
+        """`start_date`から`end_date`までのklineを取得して保存し、取得に失敗した日の一覧を返す"""
+        tasks = self.tasks(symbols, intervals, start_date, end_date)
+        logger.info("Downloading {} days of klines".format(len(tasks)))
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self._download, task): task for task in tasks}
+            for i, future in enumerate(as_completed(futures), start=1):
+                try:
+                    future.result()
+                except Exception:
+                    logger.exception("Failed to download klines : {}".format(futures[future]))
+                    failed.append(futures[future])
+                if i % 100 == 0:
+                    logger.info("Downloaded {}/{} days of klines".format(i, len(tasks)))
+        return failed
+
+    def _download(self, task: Task):
+        symbol, interval, date_str = task
+        client = gmo.get_client() if self.client is None else self.client
+        for retry in range(self.max_retries + 1):
+            try:
+                with metrics.timer("download.klines"):
+                    res = client.public_api(
+                        "/v1/klines", {"symbol": symbol, "interval": interval, "date": date_str}
+                    )
+                break
+            except requests.RequestException:
+                if retry == self.max_retries:
+                    raise
+                time.sleep(2**retry)
+        data = res.get("data", [])
+        if len(data) > 0:
+            self.store.save(symbol, interval, date_str, gmo.parse_klines(data))
+            return
+        with self._lock:
+            self._empty_days.add("/".join(task))
+            self.checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.checkpoint_path, "a") as f:
+                f.write("/".join(task) + "\n")
@@ -0,0 +1,94 @@
+"""kline_store.py
+"""
+
+import datetime
+import threading
+from pathlib import Path
+
+import polars as pl
+
+from ..constants import PROJECT_ROOT
+
+KLINE_STORE_DIR = PROJECT_ROOT / "data" / "klines"
+
+# GMOのklinesは日本時間6:00で日付が切り替わる
+DAY_START_HOUR = 6
+
+
+def is_closed_day(date: datetime.datetime | datetime.date, now: datetime.datetime | None = None) -> bool:
+    """`date`の日のklineが確定済み(今後更新されない)かどうかを返す"""
+    if now is None:
+        now = datetime.datetime.now()
+    day_end = datetime.datetime(date.year, date.month, date.day) + datetime.timedelta(
+        days=1, hours=DAY_START_HOUR
+    )
+    return now >= day_end
+
+
+class KlineStore:
+    """確定済みのklineを日単位でParquetファイルに保存するストア。
+    `{root}/{symbol}/{interval}/{YYYYMMDD}.parquet`に保存する。
+    確定済みの日のデータは不変なので、一度保存したら再取得しない。
+    """
+
+    def __init__(self, root: Path = KLINE_STORE_DIR, max_memory_entries: int = 64):
+        self.root = root
+        self.max_memory_entries = max_memory_entries
+        self._memory: dict[tuple[str, str, str], pl.DataFrame] = {}
+        # `KlineDownloader`は複数のスレッドから保存するので、`_memory`の読み書きはロックする
+        self._lock = threading.Lock()
+
+    def path(self, symbol: str, interval: str, date_str: str) -> Path:
+        return self.root / symbol / interval / f"{date_str}.parquet"
+
+    def load(self, symbol: str, interval: str, date_str: str) -> pl.DataFrame | None:
+        """保存済みのklineを返す。保存されていない場合はNone"""
+        key = (symbol, interval, date_str)
+        with self._lock:
+            df = self._memory.get(key)
+        if df is not None:
+            return df
+
+        path = self.path(symbol, interval, date_str)
+        if not path.exists():
+            return None
+        df = pl.read_parquet(path)
+        self._remember(key, df)
+        return df
+
+    def save(self, symbol: str, interval: str, date_str: str, df: pl.DataFrame):
+        """確定済みのklineを保存する"""
+        if len(df) == 0:
+            return
+        path = self.path(symbol, interval, date_str)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # 書き込み途中のファイルを読まないように一時ファイルに書いてからrenameする
+        tmp_path = path.with_suffix(".parquet.tmp")
+        df.write_parquet(tmp_path)
+        tmp_path.replace(path)
+        self._remember((symbol, interval, date_str), df)
+
+    def load_range(
+        self, symbol: str, interval: str, start_date: datetime.date, end_date: datetime.date
+    ) -> pl.DataFrame:
+        """`start_date`から`end_date`までの保存済みのklineをまとめて読み込む"""
+        paths = []
+        date = start_date
+        while date <= end_date:
+            path = self.path(symbol, interval, date.strftime("%Y%m%d"))
+            if path.exists():
+                paths.append(path)
+            date += datetime.timedelta(days=1)
+        if len(paths) == 0:
+            return pl.DataFrame()
+        return pl.read_parquet(paths).sort("datetime")
+
+    def _remember(self, key: tuple[str, str, str], df: pl.DataFrame):
+        with self._lock:
+            self._memory.pop(key, None)
+            if len(self._memory) >= self.max_memory_entries:
+                self._memory.pop(next(iter(self._memory)))
+            self._memory[key] = df
+
+
+default_store = KlineStore()
@@ -0,0 +1,29 @@
+"""margin.py
+"""
+
+import threading
+
+from . import gmo
+
+
+class SharedMargin:
+    """1回取得した取引余力を複数の売買ロジックで共有する。
+    発注に使う分は`reserve`で差し引くので、同じループ内で余力を超えて発注しない。
+    """
+
+    def __init__(self):
+        self.available_amount = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        res = gmo.private_api("/v1/account/margin", parameters={}, method="GET")
+        with self._lock:
+            self.available_amount = float(res["data"]["availableAmount"])
+
+    def reserve(self, amount: float) -> bool:
+        """`amount`だけ余力がある場合は差し引いてTrue、そうでない場合はFalseを返す"""
+        with self._lock:
+            if self.available_amount <= amount:
+                return False
+            self.available_amount -= amount
+            return True
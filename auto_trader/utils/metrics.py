@@ -0,0 +1,110 @@
+"""metrics.py
+"""
+
+import contextlib
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from ..logging import logger
+
+
+class Metric:
+    """1つの計測対象の呼び出し回数、エラー回数、直近の処理時間"""
+
+    def __init__(self, window: int = 2048):
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.latencies: deque[float] = deque(maxlen=window)
+
+    def add(self, seconds: float, error: bool = False):
+        self.count += 1
+        self.errors += int(error)
+        self.total_seconds += seconds
+        self.latencies.append(seconds)
+
+    def percentile(self, q: float) -> float:
+        if len(self.latencies) == 0:
+            return 0.0
+        return float(np.percentile(np.fromiter(self.latencies, dtype=np.float64), q))
+
+    def summary(self) -> dict[str, float]:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "mean_ms": self.total_seconds / max(self.count, 1) * 1000,
+            "p50_ms": self.percentile(50) * 1000,
+            "p99_ms": self.percentile(99) * 1000,
+        }
+
+
+class MetricsRegistry:
+    """APIのエンドポイントごと、ループの処理ごとの計測結果を保持する。
+    `timer`で囲んだ処理の時間と、例外が発生した回数を記録する。
+    """
+
+    def __init__(self, window: int = 2048):
+        self.window = window
+        self._metrics: dict[str, Metric] = {}
+        self._lock = threading.Lock()
+        self._last_logged = time.monotonic()
+
+    def record(self, name: str, seconds: float, error: bool = False):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Metric(self.window)
+            self._metrics[name].add(seconds, error)
+
+    @contextlib.contextmanager
+    def timer(self, name: str):
+        """`with registry.timer(name):`で囲んだ処理の時間を記録する"""
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.record(name, time.perf_counter() - start, error)
+
+    def get(self, name: str) -> dict[str, float] | None:
+        with self._lock:
+            metric = self._metrics.get(name)
+            return None if metric is None else metric.summary()
+
+    def snapshot(self, prefix: str = "") -> dict[str, dict[str, float]]:
+        """`prefix`で始まる全ての計測結果を返す"""
+        with self._lock:
+            return {
+                name: metric.summary()
+                for name, metric in sorted(self._metrics.items())
+                if name.startswith(prefix)
+            }
+
+    def reset(self):
+        with self._lock:
+            self._metrics.clear()
+
+    def log_summary(self, prefix: str = ""):
+        lines = [
+            "{:<40} count={:<8} errors={:<5} mean={:8.2f}ms p50={:8.2f}ms p99={:8.2f}ms".format(
+                name, s["count"], s["errors"], s["mean_ms"], s["p50_ms"], s["p99_ms"]
+            )
+            for name, s in self.snapshot(prefix).items()
+        ]
+        logger.info("Metrics summary\n" + "\n".join(lines))
+
+    def maybe_log_summary(self, interval: float = 60.0):
+        """前回の出力から`interval`秒以上経過している場合は計測結果をログに出力する"""
+        now = time.monotonic()
+        if now - self._last_logged < interval:
+            return
+        self._last_logged = now
+        self.log_summary()
+
+
+registry = MetricsRegistry()
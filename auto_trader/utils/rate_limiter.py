@@ -0,0 +1,95 @@
+"""rate_limiter.py
+"""
+
+import contextlib
+import contextvars
+import enum
+import heapq
+import itertools
+import threading
+import time
+
+
+class Priority(enum.IntEnum):
+    """private APIの呼び出しの優先度。値が小さいほど先に実行する"""
+
+    LOSSCUT = 0  # losscutの決済注文
+    ORDER = 1  # 新規注文、キャンセル、状態の取得
+    REPRICE = 2  # 目標価格の更新
+    SUMMARY = 3  # 取引履歴の集計
+
+
+_current_priority: contextvars.ContextVar[Priority] = contextvars.ContextVar(
+    "current_priority", default=Priority.ORDER
+)
+
+
+@contextlib.contextmanager
+def priority(value: Priority):
+    """`with priority(Priority.LOSSCUT):`で囲んだ処理のAPI呼び出しの優先度を設定する"""
+    token = _current_priority.set(value)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+def current_priority() -> Priority:
+    return _current_priority.get()
+
+
+class PriorityTokenBucket:
+    """優先度付きのトークンバケット。
+    1秒に`rate`個のトークンが補充され(最大`burst`個)、1回の呼び出しで1個消費する。
+    トークンが無い場合は失敗させずに待たせ、待っている呼び出しは優先度の高い順、同じ優先度なら到着順に実行する。
+    """
+
+    def __init__(self, rate: float, burst: int | None = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._updated_at = time.monotonic()
+        self._waiting: list[tuple[int, int]] = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(float(self.burst), self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def acquire(self, priority: Priority | None = None) -> float:
+        """トークンを1個取得するまで待つ。待った秒数を返す"""
+        if priority is None:
+            priority = current_priority()
+        start = time.monotonic()
+        entry = (int(priority), next(self._counter))
+        with self._condition:
+            heapq.heappush(self._waiting, entry)
+            while True:
+                self._refill()
+                if self._waiting[0] == entry and self._tokens >= 1:
+                    self._tokens -= 1
+                    heapq.heappop(self._waiting)
+                    # 次に待っている呼び出しを起こす
+                    self._condition.notify_all()
+                    return time.monotonic() - start
+                self._condition.wait(timeout=max((1 - self._tokens) / self.rate, 0.001))
+
+    def pending(self) -> int:
+        """トークン待ちの呼び出しの数"""
+        with self._condition:
+            return len(self._waiting)
+
+
+class PriorityRateLimiter:
+    """GMOのprivate APIのrate limitに合わせて、GETとPOSTを別々のバケットで制限する"""
+
+    def __init__(self, get_rate: float = 6.0, post_rate: float = 6.0, burst: int | None = None):
+        self.buckets = {
+            "GET": PriorityTokenBucket(get_rate, burst),
+            "POST": PriorityTokenBucket(post_rate, burst),
+        }
+
+    def acquire(self, method: str, priority: Priority | None = None) -> float:
+        return self.buckets["GET" if method == "GET" else "POST"].acquire(priority)
@@ -0,0 +1,166 @@
+"""ticker_feed.py
+"""
+
+import datetime
+import json
+import threading
+import time
+from typing import Callable
+
+import websocket
+
+from ..logging import logger
+
+PUBLIC_WS_END_POINT = "wss://api.coin.z.com/ws/public/v1"
+
+
+class TickerFeed:
+    """WebSocketのtickerチャンネルを購読し、シンボルごとの最新価格を保持する。
+    価格が更新されるたびに登録されたlistenerを呼び出す。接続が切れた場合は自動で再接続する。
+    """
+
+    channel = "ticker"
+
+    def __init__(
+        self,
+        symbols: list[str],
+        url: str = PUBLIC_WS_END_POINT,
+        subscribe_interval: float = 1.0,
+        reconnect_interval: float = 1.0,
+        max_reconnect_interval: float = 30.0,
+    ):
+        self.symbols = symbols
+        self.url = url
+        self.subscribe_interval = subscribe_interval  # GMOは購読リクエストを1秒に1回に制限している
+        self.reconnect_interval = reconnect_interval
+        self.max_reconnect_interval = max_reconnect_interval
+        self.last_prices: dict[str, float] = {}
+        self.updated_at: dict[str, datetime.datetime] = {}
+        self.last_received_at: datetime.datetime | None = None  # メッセージかpongを最後に受信した時刻
+        self.connected = False
+        self._received: set[str] = set()  # 現在の接続で価格を受信したシンボル
+        self._listeners: list[Callable[[str, float], None]] = []
+        self._running = False
+        self._ws: websocket.WebSocketApp | None = None
+        self._thread: threading.Thread | None = None
+        self._backoff = reconnect_interval
+
+    def add_listener(self, listener: Callable[[str, float], None]):
+        """価格の更新時に`listener(symbol, price)`を呼び出す"""
+        self._listeners.append(listener)
+
+    def get_price(self, symbol: str) -> float | None:
+        return self.last_prices.get(symbol)
+
+    def is_alive(
+        self, symbol: str | None = None, max_age: datetime.timedelta = datetime.timedelta(seconds=60)
+    ) -> bool:
+        """接続中で、`max_age`以内にメッセージかpong(30秒ごと)を受信している場合はTrue。
+        価格が変わらないシンボルのtickerは送られてこないので、シンボルごとの更新時刻では判定しない。
+        `symbol`を指定した場合は、現在の接続でそのシンボルの価格を受信済みであることも確認する。
+        """
+        if not self.connected or self.last_received_at is None:
+            return False
+        if datetime.datetime.now() - self.last_received_at > max_age:
+            return False
+        return symbol is None or symbol in self._received
+
+    def handle_message(self, message: str):
+        """tickerのメッセージを処理する"""
+        data = json.loads(message)
+        if data.get("channel") != "ticker":
+            return
+        self._update_price(data["symbol"], float(data["last"]))
+
+    def _update_price(self, symbol: str, price: float):
+        self.last_prices[symbol] = price
+        self.updated_at[symbol] = datetime.datetime.now()
+        self._received.add(symbol)
+        for listener in self._listeners:
+            try:
+                listener(symbol, price)
+            except Exception:
+                logger.exception(f"Failed to run ticker listener : symbol = {symbol}, price = {price}")
+
+    def start_subscribe(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop_subscribe(self):
+        self._running = False
+        if self._ws is not None:
+            self._ws.close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        self._backoff = self.reconnect_interval
+        while self._running:
+            self._ws = websocket.WebSocketApp(
+                self.url,
+                on_open=self._on_open,
+                on_message=self._on_message,
+                on_pong=lambda ws, message: self._touch(),
+                on_close=self._on_close,
+            )
+            self._ws.run_forever(ping_interval=30, ping_timeout=10)
+            self.connected = False
+            if not self._running:
+                break
+            logger.warning(f"Ticker feed disconnected. Reconnect after {self._backoff} seconds.")
+            time.sleep(self._backoff)
+            self._backoff = min(self._backoff * 2, self.max_reconnect_interval)
+        self.connected = False
+
+    def _touch(self):
+        self.last_received_at = datetime.datetime.now()
+
+    def _on_message(self, ws: websocket.WebSocketApp, message: str):
+        self._touch()
+        self.handle_message(message)
+
+    def _on_open(self, ws: websocket.WebSocketApp):
+        # 切断中の価格は古いので、再接続後に受信するまではそのシンボルをpollingでチェックする
+        self._received.clear()
+        for i, symbol in enumerate(self.symbols):
+            if i > 0:
+                time.sleep(self.subscribe_interval)
+            ws.send(json.dumps({"command": "subscribe", "channel": self.channel, "symbol": symbol}))
+        self._touch()
+        self.connected = True
+        self._backoff = self.reconnect_interval  # 接続できた場合は再接続の間隔を戻す
+        logger.info(f"Ticker feed connected : {self.url}")
+
+    def _on_close(self, ws: websocket.WebSocketApp, status_code, message):
+        self.connected = False
+
+
+class TradeFeed(TickerFeed):
+    """WebSocketのtradesチャンネルを購読し、約定ごとに登録されたlistenerを呼び出す。
+    約定価格を最新価格として`TickerFeed`と同じように扱えるので、losscutのチェックにもそのまま使える。
+    """
+
+    channel = "trades"
+
+    def __init__(self, symbols: list[str], **kwargs):
+        super().__init__(symbols, **kwargs)
+        self._trade_listeners: list[Callable[[str, int, float, float], None]] = []
+
+    def add_trade_listener(self, listener: Callable[[str, int, float, float], None]):
+        """約定ごとに`listener(symbol, timestamp, price, size)`を呼び出す。`timestamp`はepochからのミリ秒"""
+        self._trade_listeners.append(listener)
+
+    def handle_message(self, message: str):
+        """tradesのメッセージを処理する"""
+        data = json.loads(message)
+        if data.get("channel") != "trades":
+            return
+        symbol, price, size = data["symbol"], float(data["price"]), float(data["size"])
+        timestamp = int(datetime.datetime.fromisoformat(data["timestamp"]).timestamp() * 1000)
+        for listener in self._trade_listeners:
+            try:
+                listener(symbol, timestamp, price, size)
+            except Exception:
+                logger.exception(f"Failed to run trade listener : symbol = {symbol}, price = {price}")
+        self._update_price(symbol, price)
@@ -0,0 +1,27 @@
+"""conftest.py
+"""
+
+import pytest
+
+from auto_trader.utils import gmo
+from auto_trader.utils.fake_exchange import FakeExchangeServer
+from auto_trader.utils.rate_limiter import PriorityRateLimiter
+
+
+@pytest.fixture
+def server():
+    server = FakeExchangeServer()
+    server.start()
+    gmo.set_client(
+        gmo.GmoClient(
+            public_end_point=server.public_end_point,
+            private_end_point=server.private_end_point,
+            api_key="key",
+            api_secret="secret",
+            rate_limiter=PriorityRateLimiter(get_rate=1000, post_rate=1000),
+            public_rate_limit=None,
+        )
+    )
+    yield server
+    gmo.set_client(None)
+    server.stop()
@@ -0,0 +1,83 @@
+"""test_backtest.py
+"""
+
+import datetime
+
+import numpy as np
+import polars as pl
+
+from auto_trader.backtest import BacktestConfig, grid, run_sweep, simulate, summarize
+
+
+def _bars(open, high, low, close):
+    start = datetime.datetime(2024, 1, 1)
+    return pl.DataFrame(
+        {
+            "datetime": [start + datetime.timedelta(minutes=i) for i in range(len(close))],
+            "open": open,
+            "high": high,
+            "low": low,
+            "close": close,
+            "ATR": [10.0] * len(close),
+        }
+    )
+
+
+def test_simulate():
+    config = BacktestConfig(
+        entry_atr_ratio=1.0, exit_atr_ratio=1.0, losscut_ratio=0.9, warmup=0, volume=1.0
+    )
+    # bar0確定時に90で買い注文 -> bar1で約定 -> bar1確定時に110で利益確定注文 -> bar2で約定
+    df = _bars(
+        open=[100.0, 95.0, 100.0, 100.0],
+        high=[100.0, 100.0, 115.0, 100.0],
+        low=[100.0, 85.0, 95.0, 100.0],
+        close=[100.0, 100.0, 100.0, 100.0],
+    )
+    trades = simulate(df, np.array([1.0, -1.0, -1.0, -1.0]), config)
+    assert trades["reason"].to_list() == ["take_profit"]
+    assert trades["entry_price"][0] == 90.0
+    assert trades["exit_price"][0] == 110.0
+    assert trades["exit_datetime"][0] == df["datetime"][2]
+
+    # losscut(90 * 0.9 = 81)を下回った場合は利益確定より優先する
+    df = _bars(
+        open=[100.0, 95.0, 90.0, 100.0],
+        high=[100.0, 100.0, 115.0, 100.0],
+        low=[100.0, 85.0, 80.0, 100.0],
+        close=[100.0, 100.0, 90.0, 100.0],
+    )
+    trades = simulate(df, np.array([1.0, -1.0, -1.0, -1.0]), config)
+    assert trades["reason"].to_list() == ["losscut"]
+    assert abs(trades["exit_price"][0] - 81.0) < 1e-6
+
+    # 約定しなかった注文は取引に含まれず、最後まで決済されなかった注文は最後の終値で決済する
+    df = _bars(
+        open=[100.0, 95.0, 100.0, 100.0],
+        high=[100.0, 100.0, 100.0, 100.0],
+        low=[100.0, 85.0, 95.0, 95.0],
+        close=[100.0, 100.0, 100.0, 100.0],
+    )
+    trades = simulate(df, np.array([1.0, 1.0, -1.0, -1.0]), config)
+    assert trades["reason"].to_list() == ["end"]
+    assert summarize(trades)["total_pnl"] == 10.0
+
+
+def test_run_sweep():
+    rng = np.random.default_rng(0)
+    close = 100 + rng.standard_normal(500).cumsum()
+    df = _bars(open=close, high=close + 2, low=close - 2, close=close)
+    scores = rng.standard_normal(500)
+    params = grid(entry_atr_ratio=[0.1, 0.5], losscut_ratio=[0.9, 0.99], warmup=[10, 100])
+
+    results = run_sweep(df, scores, params, BacktestConfig(volume=1.0), max_workers=2)
+    assert len(results) == len(params)
+    assert results["total_pnl"].to_list() == sorted(results["total_pnl"].to_list(), reverse=True)
+    # 1プロセスで実行した場合と同じ結果になる
+    for row in results.iter_rows(named=True):
+        config = BacktestConfig(
+            volume=1.0, **{name: row[name] for name in ("entry_atr_ratio", "losscut_ratio", "warmup")}
+        )
+        assert summarize(simulate(df, scores, config)) == {
+            name: row[name] for name in summarize(pl.DataFrame())
+        }
@@ -0,0 +1,107 @@
+"""test_bar_aggregator.py
+"""
+
+import datetime
+
+import numpy as np
+import polars as pl
+import polars.testing
+
+from auto_trader.utils.bar_aggregator import BarAggregator
+
+MINUTE = 60_000
+INTERVALS = [datetime.timedelta(minutes=1), datetime.timedelta(minutes=5)]
+
+
+def _ticks(seed: int = 0, n: int = 2000):
+    rng = np.random.default_rng(seed)
+    # 購読開始はbarの途中から。約定時刻は最大1秒前後する
+    timestamps = 30_000 + np.sort(rng.integers(0, 20 * MINUTE, n)) + rng.integers(-1000, 1000, n)
+    prices = 100 + rng.standard_normal(n).cumsum()
+    sizes = rng.uniform(0.01, 1.0, n)
+    return timestamps, prices, sizes
+
+
+def test_bar_aggregator():
+    timestamps, prices, sizes = _ticks()
+    aggregator = BarAggregator("BTC", INTERVALS, allowed_lateness=datetime.timedelta(seconds=2))
+    closed = []
+    aggregator.add_listener(lambda interval, bar: closed.append((interval, bar[0])))
+    for t, p, s in zip(timestamps, prices, sizes):
+        aggregator.add_tick(int(t), p, s)
+    aggregator.advance(int(timestamps.max()) + 5 * MINUTE)
+    assert aggregator.late_ticks == 0
+
+    for interval in INTERVALS:
+        df = aggregator.to_df(interval)
+        interval_ms = int(interval / datetime.timedelta(milliseconds=1))
+        # 購読開始時に既に始まっていたbarは含まない
+        starts = np.arange(interval_ms, timestamps.max() + 1, interval_ms)
+        assert len(df) == len(starts)
+        assert [bar for i, bar in closed if i == interval] == df["datetime"].to_list()
+        for row, start in zip(df.iter_rows(named=True), starts.tolist()):
+            assert row["datetime"] == datetime.datetime(1970, 1, 1, 9, 0) + datetime.timedelta(
+                milliseconds=start
+            )
+            mask = (timestamps >= start) & (timestamps < start + interval_ms)
+            order = np.argsort(timestamps[mask], kind="stable")
+            assert row["open"] == prices[mask][order][0]
+            assert row["close"] == prices[mask][order][-1]
+            assert row["high"] == prices[mask].max()
+            assert row["low"] == prices[mask].min()
+            assert np.isclose(row["volume"], sizes[mask].sum())
+
+    # まとめて追加した場合も同じbarになる
+    batch = BarAggregator("BTC", INTERVALS)
+    for chunk in np.array_split(np.arange(len(timestamps)), 7):
+        batch.add_ticks(timestamps[chunk], prices[chunk], sizes[chunk])
+    batch.advance(int(timestamps.max()) + 5 * MINUTE)
+    for interval in INTERVALS:
+        polars.testing.assert_frame_equal(batch.to_df(interval), aggregator.to_df(interval))
+
+
+def test_late_ticks():
+    aggregator = BarAggregator("BTC", INTERVALS[:1], allowed_lateness=datetime.timedelta(seconds=1))
+    aggregator.add_tick(0, 100.0, 1.0)
+    aggregator.add_tick(MINUTE + 10, 101.0, 1.0)
+    # 許容範囲内の遅延はbarに含める
+    aggregator.add_tick(2 * MINUTE + 500, 102.0, 1.0)
+    aggregator.add_tick(2 * MINUTE - 10, 99.0, 1.0)
+    assert len(aggregator.to_df(INTERVALS[0])) == 0
+    # 許容範囲を超えて遅延した約定は捨てる
+    aggregator.add_tick(2 * MINUTE + 2000, 103.0, 1.0)
+    aggregator.add_tick(2 * MINUTE - 20, 98.0, 1.0)
+    assert aggregator.late_ticks == 1
+
+    df = aggregator.to_df(INTERVALS[0])
+    assert df["close"].to_list() == [99.0]
+    assert df["low"].to_list() == [99.0]
+    assert df["volume"].to_list() == [2.0]
+
+
+def test_seed():
+    aggregator = BarAggregator("BTC", INTERVALS)
+    start = datetime.datetime(1970, 1, 1, 9, 0)
+    aggregator.seed(
+        INTERVALS[0],
+        pl.DataFrame(
+            {
+                "datetime": [start + datetime.timedelta(minutes=i) for i in range(10)],
+                "open": np.full(10, 100.0),
+                "high": np.full(10, 100.0),
+                "low": np.full(10, 100.0),
+                "close": np.full(10, 100.0),
+                "volume": np.ones(10),
+            }
+        ),
+    )
+    # seedした最後のbarの次のbarは、最初の約定が途中からでも書き込む
+    aggregator.add_tick(10 * MINUTE + 30_000, 101.0, 1.0)
+    aggregator.add_tick(11 * MINUTE + 10_000, 102.0, 1.0)
+    aggregator.advance(12 * MINUTE + 5_000)
+    df = aggregator.to_df(INTERVALS[0])
+    assert df["datetime"].to_list() == [start + datetime.timedelta(minutes=i) for i in range(12)]
+    assert df["close"].to_list()[-2:] == [101.0, 102.0]
+    # seedしていない時間足は、途中から始まったbarを捨てる
+    aggregator.advance(15 * MINUTE + 5_000)
+    assert len(aggregator.to_df(INTERVALS[1])) == 0
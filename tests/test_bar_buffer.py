@@ -0,0 +1,42 @@
+"""test_bar_buffer.py
+"""
+
+import datetime
+
+import polars as pl
+
+from auto_trader.utils.bar_buffer import BarBuffer
+
+
+def test_bar_buffer():
+    start = datetime.datetime(2024, 1, 1)
+    df = pl.DataFrame(
+        {
+            "datetime": [start + datetime.timedelta(minutes=i) for i in range(5)],
+            "open": [float(i) for i in range(5)],
+            "high": [float(i) + 1 for i in range(5)],
+            "low": [float(i) - 1 for i in range(5)],
+            "close": [float(i) for i in range(5)],
+            "volume": [1.0] * 5,
+        }
+    )
+
+    buffer = BarBuffer(3)
+    assert len(buffer) == 0
+    assert buffer.last_datetime is None
+
+    # 容量を超えた分は古いbarから捨てられる
+    buffer.extend(df)
+    assert buffer.is_full
+    assert buffer.to_df()["open"].to_list() == [2.0, 3.0, 4.0]
+    assert buffer.last_datetime == start + datetime.timedelta(minutes=4)
+
+    # 1本ずつ追加した場合もbarは古い順に並ぶ
+    buffer.append(start + datetime.timedelta(minutes=5), 5.0, 6.0, 4.0, 5.0, 1.0)
+    out = buffer.to_df()
+    assert out["open"].to_list() == [3.0, 4.0, 5.0]
+    assert out["datetime"][-1] == start + datetime.timedelta(minutes=5)
+
+    # DataFrameはバッファのメモリを共有している
+    buffer.column("close")[-1] = 100.0
+    assert out["close"][-1] == 100.0
@@ -0,0 +1,50 @@
+"""test_clock.py
+"""
+
+import datetime
+
+from auto_trader.utils.clock import BarScheduler, SimulatedClock, next_boundary
+
+
+def test_next_boundary():
+    dt = datetime.datetime(2024, 12, 31, 23, 59, 30)
+    # 日付・年の切り替わりをまたぐ場合
+    assert next_boundary(dt, datetime.timedelta(minutes=1)) == datetime.datetime(2025, 1, 1)
+    assert next_boundary(dt, datetime.timedelta(minutes=15)) == datetime.datetime(2025, 1, 1)
+    assert next_boundary(dt, datetime.timedelta(hours=1)) == datetime.datetime(2025, 1, 1)
+    dt = datetime.datetime(2024, 1, 1, 23, 20)
+    assert next_boundary(dt, datetime.timedelta(minutes=15)) == datetime.datetime(2024, 1, 1, 23, 30)
+    # 境界ちょうどの場合は次の境界
+    assert next_boundary(dt, datetime.timedelta(minutes=5)) == datetime.datetime(2024, 1, 1, 23, 25)
+
+
+def test_bar_scheduler():
+    clock = SimulatedClock(datetime.datetime(2024, 1, 1, 23, 58, 30).timestamp())
+    scheduler = BarScheduler(clock, datetime.timedelta(minutes=1), poll_interval=20)
+    assert scheduler.next_wall == datetime.datetime(2024, 1, 1, 23, 59)
+
+    woke = []
+    for _ in range(8):
+        poll, bar = scheduler.poll_due(), scheduler.bar_due()
+        woke.append((clock.now().strftime("%H:%M:%S"), poll, bar))
+        scheduler.wait()
+    # 定期処理の間隔を待たずにbarの境界で起きる
+    assert woke == [
+        ("23:58:30", True, False),
+        ("23:58:50", True, False),
+        ("23:59:00", False, True),
+        ("23:59:10", True, False),
+        ("23:59:30", True, False),
+        ("23:59:50", True, False),
+        ("00:00:00", False, True),
+        ("00:00:10", True, False),
+    ]
+
+    # 処理が遅れて複数の境界を過ぎた場合は1回だけ処理して次の境界に進む
+    clock.sleep(150)
+    assert scheduler.poll_due()
+    assert scheduler.bar_due()
+    assert not scheduler.bar_due()
+    assert scheduler.next_wall == datetime.datetime(2024, 1, 2, 0, 4)
+    assert scheduler.seconds_until_next() == 20
+    assert scheduler.seconds_until_next(include_bar=False) == 20
@@ -0,0 +1,55 @@
+"""test_engine.py
+"""
+
+import datetime
+import logging
+import threading
+import time
+
+from auto_trader.trader.engine import TradingEngine
+from auto_trader.utils.clock import SimulatedClock
+
+INTERVALS = [datetime.timedelta(minutes=1), datetime.timedelta(minutes=5)]
+
+
+def _engine(tmp_path) -> TradingEngine:
+    engine = TradingEngine(
+        tmp_path / "model.pkl",
+        tmp_path,
+        clock=SimulatedClock(time.time()),
+        journal_path=tmp_path / "journal.db",
+    )
+    for interval in INTERVALS:
+        trader = engine.add_pipeline("BTC_JPY", interval)
+        trader.preload = lambda: None
+        trader.update_bars = lambda: None
+        trader.on_new_tick_added = lambda: None
+    return engine
+
+
+def test_shared_symbol_journal(server, tmp_path, caplog):
+    server.exchange.set_price("BTC_JPY", 10_000_000)
+    engine = _engine(tmp_path)
+    engine.shared_margin.refresh()
+    for i, trader in enumerate(engine.pipelines):
+        trader.place_new_order(9_900_000 + i * 10_000)
+    order_ids = [trader.orders[0].order_id for trader in engine.pipelines]
+    engine.journal.close()
+
+    # 再起動後は各pipelineが自分の注文だけを復元し、他のpipelineの注文を不明な注文として警告しない
+    engine = _engine(tmp_path)
+    thread = threading.Thread(target=engine.run_loop)
+    with caplog.at_level(logging.WARNING, logger="auto_trader.logging"):
+        thread.start()
+        deadline = time.monotonic() + 10
+        while any(len(trader.orders) == 0 for trader in engine.pipelines):
+            if time.monotonic() > deadline:
+                break  # 停止してから下のassertで失敗させる
+            time.sleep(0.01)
+        engine.stop_loop()
+        thread.join()
+    assert [[order.order_id for order in trader.orders] for trader in engine.pipelines] == [
+        [order_id] for order_id in order_ids
+    ]
+    assert "not in journal" not in caplog.text
+    assert len(server.exchange.positions) == 0
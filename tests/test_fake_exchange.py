@@ -0,0 +1,139 @@
+"""test_fake_exchange.py
+"""
+
+import time
+
+from auto_trader.order import LeverageOrder, OrderState
+from auto_trader.utils import gmo
+from auto_trader.utils.rate_limiter import Priority, current_priority, priority
+
+
+def test_leverage_order_lifecycle(server):
+    exchange = server.exchange
+    exchange.set_price("BTC_JPY", 10_000_000)
+    state = OrderState("BTC_JPY")
+
+    # 指値の新規注文 -> 価格が下がって約定
+    order = LeverageOrder.new_order("BTC_JPY", 9_900_000, 0.01, losscut_price=9_000_000, state=state)
+    state.refresh()
+    assert not order.is_closed(state)
+    exchange.set_price("BTC_JPY", 9_800_000)
+    state.refresh()
+    assert len(state.get_open_positions(order.order_id)) == 1
+
+    # 利益確定注文 -> 価格が上がって決済
+    order.update_target_price(10_100_000, state=state)
+    state.refresh()
+    assert not order.is_closed(state)
+    exchange.set_price("BTC_JPY", 10_200_000)
+    state.refresh()
+    assert order.is_closed(state)
+    assert abs(exchange.cash - (1_000_000 + 0.01 * 200_000)) < 1e-6
+
+    # 1回のrefreshのAPI呼び出し回数は注文数によらない
+    assert exchange.request_counts["/private/v1/activeOrders"] == 4
+
+    # 約定は直近の約定の一覧から取得済みなので、履歴の集計でAPIを呼び出さない
+    assert [e["settleType"] for e in order.summary(state)] == ["OPEN", "CLOSE"]
+    assert "/private/v1/executions" not in exchange.request_counts
+
+
+def test_losscut(server):
+    exchange = server.exchange
+    exchange.set_price("ETH_JPY", 500_000)
+    state = OrderState("ETH_JPY")
+
+    order = LeverageOrder.new_order("ETH_JPY", -1.0, 0.1, losscut_price=450_000, state=state)
+    state.refresh()
+    order.update_target_price(550_000, state=state)
+    exchange.set_price("ETH_JPY", 440_000)
+    state.refresh()
+    order.check_losscut(440_000, state=state)
+    state.refresh()
+    assert order.is_closed(state)
+    assert len(exchange.positions) == 0
+    assert abs(exchange.cash - (1_000_000 - 0.1 * 60_000)) < 1e-6
+
+
+def test_many_positions(server):
+    exchange = server.exchange
+    exchange.set_price("XRP_JPY", 100)
+    orders = [gmo.post_order("XRP_JPY", -1.0, 1)["data"] for _ in range(250)]
+
+    # 1ページ100件なので3ページ分を取得する
+    positions = gmo.get_all_positions("XRP_JPY")
+    assert len({pos["positionId"] for pos in positions}) == 250
+
+    state = OrderState("XRP_JPY")
+    state.refresh()
+    for order_id in orders[:10]:
+        open_positions = state.get_open_positions(order_id)
+        assert len(open_positions) == 1
+        assert state.get_position(open_positions[0]["positionId"]) is open_positions[0]
+        assert gmo.get_open_positions(order_id) == open_positions
+
+
+def test_change_close_order(server):
+    exchange = server.exchange
+    exchange.set_price("BTC_JPY", 10_000_000)
+    state = OrderState("BTC_JPY")
+    order = LeverageOrder.new_order("BTC_JPY", -1.0, 0.01, losscut_price=9_000_000, state=state)
+    state.refresh()
+    order.update_target_price(10_100_000, state=state)
+    state.refresh()
+
+    # 2回目以降は決済注文の価格だけを変更する
+    order.update_target_price(10_300_000, state=state)
+    assert len(order.close_order_ids) == 1
+    assert exchange.request_counts["/private/v1/closeOrder"] == 1
+    assert exchange.request_counts["/private/v1/changeOrder"] == 1
+    assert "/private/v1/cancelOrder" not in exchange.request_counts
+    exchange.set_price("BTC_JPY", 10_200_000)
+    state.refresh()
+    assert not order.is_closed(state)
+    exchange.set_price("BTC_JPY", 10_300_000)
+    state.refresh()
+    assert order.is_closed(state)
+    assert abs(exchange.cash - (1_000_000 + 0.01 * 300_000)) < 1e-6
+
+
+def test_fill_during_refresh(server, monkeypatch):
+    exchange = server.exchange
+    exchange.set_price("BTC_JPY", 10_000_000)
+    state = OrderState("BTC_JPY")
+    order = LeverageOrder.new_order("BTC_JPY", 9_900_000, 0.01, losscut_price=9_000_000, state=state)
+    state.refresh()
+
+    # 有効な注文の取得中に約定した場合も、建玉が残っているので終了とは判定しない
+    get_active_orders = gmo.get_active_orders
+
+    def _get_active_orders(symbol: str) -> list[dict]:
+        time.sleep(0.1)
+        exchange.set_price("BTC_JPY", 9_800_000)
+        return get_active_orders(symbol)
+
+    monkeypatch.setattr(gmo, "get_active_orders", _get_active_orders)
+    state.refresh()
+    assert state.is_order_finished(order.order_id)
+    assert len(state.get_open_positions(order.order_id)) == 1
+    assert not order.is_closed(state)
+
+
+def test_pages_keep_priority(server, monkeypatch):
+    server.exchange.set_price("XRP_JPY", 100)
+    for _ in range(250):
+        gmo.post_order("XRP_JPY", -1.0, 1)
+
+    # 並行に取得するページも呼び出し元の優先度でAPIを呼び出す
+    priorities = []
+    private_api = gmo.GmoClient.private_api
+
+    def _private_api(self, path: str, parameters: dict, method: str, priority: Priority | None = None):
+        priorities.append(current_priority())
+        return private_api(self, path, parameters, method, priority)
+
+    monkeypatch.setattr(gmo.GmoClient, "private_api", _private_api)
+    with priority(Priority.LOSSCUT):
+        positions = gmo.get_all_positions("XRP_JPY")
+    assert len(positions) == 250
+    assert priorities == [Priority.LOSSCUT] * 5
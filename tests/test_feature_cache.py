@@ -0,0 +1,91 @@
+"""test_feature_cache.py
+"""
+
+import datetime
+
+import numpy as np
+import polars as pl
+import polars.testing
+
+from auto_trader.utils.feature_cache import FeatureCache
+
+calls = []
+
+
+def _calc(df: pl.DataFrame) -> pl.DataFrame:
+    calls.append(len(df))
+    return df.with_columns(pl.col("close").rolling_mean(5).alias("MA"))
+
+
+def _bars(n: int) -> pl.DataFrame:
+    start = datetime.datetime(2024, 1, 1)
+    return pl.DataFrame(
+        {
+            "datetime": [start + datetime.timedelta(minutes=i) for i in range(n)],
+            "close": np.random.default_rng(0).standard_normal(n).cumsum(),
+        }
+    )
+
+
+def test_feature_cache(tmp_path):
+    cache = FeatureCache(_calc, root=tmp_path, lookback=10)
+    df = _bars(1000)
+    calls.clear()
+    polars.testing.assert_frame_equal(cache.get("BTC_JPY", "1min", df[:600]), _calc(df[:600]))
+    # 同じ範囲は計算しない。最初だけ出力される列を確認するために先頭の`lookback`本を計算する
+    polars.testing.assert_frame_equal(cache.get("BTC_JPY", "1min", df[:600]), _calc(df[:600]))
+    assert calls == [10, 600, 600, 600]
+
+    # 追加されたbarは直前の`lookback`本と合わせて計算する
+    calls.clear()
+    polars.testing.assert_frame_equal(cache.get("BTC_JPY", "1min", df[:800]), _calc(df[:800]))
+    assert calls[0] == 10 + 200
+    assert len(list(tmp_path.glob("**/*.arrow"))) == 1
+    # 範囲内のbarは切り出す
+    calls.clear()
+    polars.testing.assert_frame_equal(
+        cache.get("BTC_JPY", "1min", df[100:700]), _calc(df[:800])[100:700]
+    )
+    assert calls == [800]
+
+    # サイズの上限を超えた場合は最後に使ってから長いファイルを削除する
+    size = next(tmp_path.glob("**/*.arrow")).stat().st_size
+    cache.max_bytes = int(size * 1.5)
+    cache.get("ETH_JPY", "1min", df[:800])
+    assert [path.parts[-4] for path in tmp_path.glob("**/*.arrow")] == ["ETH_JPY"]
+
+
+def test_feature_cache_stale_bars(tmp_path):
+    cache = FeatureCache(_calc, root=tmp_path, lookback=10)
+    df = _bars(1000)
+
+    # 確定前の最後のbarを保存した場合は、確定後のbarから計算し直す
+    partial = df[:600].with_columns(
+        pl.when(pl.int_range(pl.len()) == 599).then(0.0).otherwise(pl.col("close")).alias("close")
+    )
+    cache.get("BTC_JPY", "1min", partial)
+    calls.clear()
+    polars.testing.assert_frame_equal(cache.get("BTC_JPY", "1min", df[:800]), _calc(df[:800]))
+    assert calls[0] == 10 + 201
+
+    # 途中のklineが修正された場合も、修正されたbarから計算し直す
+    corrected = df[:800].with_columns(
+        pl.when(pl.int_range(pl.len()) == 300).then(0.0).otherwise(pl.col("close")).alias("close")
+    )
+    calls.clear()
+    polars.testing.assert_frame_equal(cache.get("BTC_JPY", "1min", corrected), _calc(corrected))
+    assert calls[0] == 10 + 500
+    assert len(list(tmp_path.glob("**/*.arrow"))) == 1
+
+
+def test_feature_hash(tmp_path):
+    def _calc_other(df: pl.DataFrame) -> pl.DataFrame:
+        return df.with_columns(pl.col("close").rolling_mean(10).alias("MA10"))
+
+    # 出力される列や実装が異なる場合は別のキャッシュにする
+    df = _bars(100)
+    hashes = {
+        FeatureCache(calc, root=tmp_path, version=version)._feature_hash(df)
+        for calc, version in [(_calc, ""), (_calc_other, ""), (_calc, "v2")]
+    }
+    assert len(hashes) == 3
@@ -0,0 +1,30 @@
+"""test_history.py
+"""
+
+from auto_trader.utils.history import HistoryWriter, read_history
+
+
+class DummyOrder:
+    def __init__(self, order_id: int):
+        self.order_id = order_id
+
+    def summary(self, state=None):
+        return [{"orderId": self.order_id, "side": "BUY", "size": "0.01", "price": "100"}]
+
+    def order_ids(self):
+        return [str(self.order_id)]
+
+
+def test_history_writer(tmp_path):
+    writer = HistoryWriter(tmp_path / "history", flush_interval=60.0, flush_size=3)
+    writer.start()
+    for i in range(5):
+        writer.submit([DummyOrder(i)])
+    writer.submit([])
+    writer.close()
+
+    # 3件溜まった時点で1回、終了時に残りの2件を書き込む
+    assert len(list((tmp_path / "history").glob("part-*.parquet"))) == 2
+    df = read_history(tmp_path / "history")
+    assert df["orderId"].to_list() == [0, 1, 2, 3, 4]
+    assert df["price"].dtype.is_float()
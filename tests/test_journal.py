@@ -0,0 +1,69 @@
+"""test_journal.py
+"""
+
+import datetime
+
+from auto_trader.order import LeverageOrder, OrderJournal, OrderState
+from auto_trader.trader import Trader0
+
+
+def _trader(tmp_path, journal: OrderJournal) -> Trader0:
+    return Trader0(
+        "BTC_JPY",
+        datetime.timedelta(minutes=1),
+        tmp_path / "model.pkl",
+        tmp_path,
+        model=object(),
+        order_state=OrderState("BTC_JPY"),
+        journal=journal,
+    )
+
+
+def test_journal(tmp_path):
+    journal = OrderJournal(tmp_path / "journal.db")
+    order = LeverageOrder(symbol="BTC_JPY", side="BUY", order_id="1", losscut_price=90.0)
+    journal.record("BTC_JPY_1min", order, "new")
+    journal.record("BTC_JPY_1min", order)  # 状態が変わっていない場合は書き込まない
+    order.close_order_ids.append("2")
+    journal.record("BTC_JPY_1min", order)
+    journal.record(
+        "ETH_JPY_1min", LeverageOrder(symbol="ETH_JPY", side="BUY", order_id="3", losscut_price=1)
+    )
+    journal.close()
+
+    # 別のプロセスで開き直しても最新の状態を復元できる
+    journal = OrderJournal(tmp_path / "journal.db")
+    assert journal.load_open("BTC_JPY_1min") == [order]
+    assert journal._conn.execute("SELECT COUNT(*) FROM order_events").fetchone()[0] == 3
+    journal.record("BTC_JPY_1min", order, "closed")
+    assert journal.load_open("BTC_JPY_1min") == []
+    journal.compact()
+    assert journal._conn.execute("SELECT COUNT(*) FROM order_events").fetchone()[0] == 1
+
+
+def test_restore_orders(server, tmp_path):
+    exchange = server.exchange
+    exchange.set_price("BTC_JPY", 10_000_000)
+    trader = _trader(tmp_path, OrderJournal(tmp_path / "journal.db"))
+    trader.place_new_order(9_900_000)
+    trader.place_new_order(9_950_000)
+    exchange.set_price("BTC_JPY", 9_800_000)
+    trader.order_state.refresh()
+    trader.update_order(trader.orders[0], 9_000_000, 10_100_000)
+    trader.update_order(trader.orders[1], 9_000_000, 10_300_000)
+    trader.order_state.refresh()
+    trader.update_order(trader.orders[1], 9_000_000, 10_400_000)
+    # 1つ目の注文だけ決済された状態でプロセスが落ちる
+    first = trader.orders[0]
+    exchange.set_price("BTC_JPY", 10_200_000)
+    trader.journal.close()
+
+    exchange.request_counts.clear()
+    trader = _trader(tmp_path, OrderJournal(tmp_path / "journal.db"))
+    trader.restore_orders()
+    assert len(trader.orders) == 1
+    assert trader.orders[0].order_ids()[0] != first.order_id
+    assert len(trader.orders[0].close_order_ids) == 1  # 価格の変更は同じ決済注文で行う
+    # 取引所の状態はまとめて1回だけ取得する
+    assert exchange.request_counts["/private/v1/activeOrders"] == 1
+    assert exchange.request_counts["/private/v1/openPositions"] == 1
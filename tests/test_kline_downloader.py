@@ -0,0 +1,55 @@
+"""test_kline_downloader.py
+"""
+
+import datetime
+
+import numpy as np
+import polars as pl
+
+from auto_trader.utils.kline_downloader import KlineDownloader
+from auto_trader.utils.kline_store import KlineStore
+from auto_trader.utils.metrics import registry as metrics
+
+
+def _klines(start: datetime.datetime, n: int) -> pl.DataFrame:
+    close = 100 + np.arange(n, dtype=np.float64)
+    return pl.DataFrame(
+        {
+            "datetime": [start + datetime.timedelta(minutes=i) for i in range(n)],
+            "open": close,
+            "high": close + 1,
+            "low": close - 1,
+            "close": close,
+            "volume": np.ones(n),
+        }
+    )
+
+
+def _calls() -> int:
+    summary = metrics.get("download.klines")
+    return 0 if summary is None else summary["count"]
+
+
+def test_kline_downloader(server, tmp_path):
+    # ETHは2日目から、BTCは3日分のデータがある。日付はJST 6:00に切り替わる
+    start = datetime.datetime(2024, 1, 1, 6, 0)
+    server.exchange.add_klines("BTC_JPY", "1min", _klines(start, 3 * 1440))
+    server.exchange.add_klines("ETH_JPY", "1min", _klines(start + datetime.timedelta(days=1), 2 * 1440))
+    store = KlineStore(tmp_path / "klines")
+    symbols = ["BTC_JPY", "ETH_JPY"]
+    dates = (datetime.date(2024, 1, 1), datetime.date(2024, 1, 3))
+
+    # 途中で中断した場合も、次回は残りの日だけを取得する
+    calls = _calls()
+    assert KlineDownloader(store).download(*dates, symbols=symbols[:1]) == []
+    assert _calls() - calls == 3
+    downloader = KlineDownloader(store)
+    assert len(downloader.tasks(symbols, ["1min"], *dates)) == 3
+    assert downloader.download(*dates, symbols=symbols) == []
+    assert _calls() - calls == 6
+    # データの無い日も記録しているので再取得しない
+    assert KlineDownloader(store).tasks(symbols, ["1min"], *dates) == []
+
+    df = store.load_range("ETH_JPY", "1min", *dates)
+    assert len(df) == 2 * 1440
+    assert df["datetime"][0] == start + datetime.timedelta(days=1)
@@ -0,0 +1,96 @@
+"""test_kline_store.py
+"""
+
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import polars as pl
+
+from auto_trader.utils import gmo
+from auto_trader.utils.kline_store import KlineStore, is_closed_day
+
+
+def _klines(start: datetime.datetime, n: int) -> pl.DataFrame:
+    close = 100 + np.arange(n, dtype=np.float64)
+    return pl.DataFrame(
+        {
+            "datetime": [start + datetime.timedelta(minutes=i) for i in range(n)],
+            "open": close,
+            "high": close + 1,
+            "low": close - 1,
+            "close": close,
+            "volume": np.ones(n),
+        }
+    )
+
+
+def test_save_and_load(tmp_path):
+    df = _klines(datetime.datetime(2024, 1, 1, 6, 0), 10)
+    store = KlineStore(tmp_path, max_memory_entries=4)
+    store.save("BTC_JPY", "1min", "20240101", df)
+    assert store.load("BTC_JPY", "1min", "20240101").equals(df)
+    assert store.load("BTC_JPY", "1min", "20240102") is None
+
+    # 別のインスタンスからはファイルから読み込む
+    store = KlineStore(tmp_path)
+    assert store.load("BTC_JPY", "1min", "20240101").equals(df)
+    date = datetime.date(2024, 1, 1)
+    assert store.load_range("BTC_JPY", "1min", date, date + datetime.timedelta(days=1)).equals(df)
+
+
+def test_concurrent_save(tmp_path):
+    store = KlineStore(tmp_path, max_memory_entries=4)
+    df = _klines(datetime.datetime(2024, 1, 1, 6, 0), 10)
+
+    def _save(day: int):
+        date_str = f"202401{day:02d}"
+        store.save("BTC_JPY", "1min", date_str, df)
+        assert store.load("BTC_JPY", "1min", date_str).equals(df)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(_save, range(1, 29)))
+    assert len(store._memory) == 4
+
+
+def test_is_closed_day():
+    # JST 6:00に日付が切り替わるので、1/1のklineは1/2の6:00に確定する
+    date = datetime.date(2024, 1, 1)
+    assert not is_closed_day(date, now=datetime.datetime(2024, 1, 2, 5, 59))
+    assert is_closed_day(date, now=datetime.datetime(2024, 1, 2, 6, 0))
+
+
+def test_get_ohlc_stores_closed_days(server, tmp_path):
+    exchange = server.exchange
+    store = KlineStore(tmp_path)
+    closed = datetime.datetime(2024, 1, 1, 6, 0)
+    today = datetime.datetime.now()
+    exchange.add_klines("BTC_JPY", "1min", _klines(closed, 10))
+    exchange.add_klines(
+        "BTC_JPY", "1min", _klines(datetime.datetime(today.year, today.month, today.day, 6), 10)
+    )
+
+    # 確定済みの日は保存して、2回目はAPIを呼び出さない
+    assert len(gmo.get_ohlc("BTC_JPY", "1min", date=closed, store=store)) == 10
+    assert len(gmo.get_ohlc("BTC_JPY", "1min", date=closed, store=store)) == 10
+    assert exchange.request_counts["/public/v1/klines"] == 1
+
+    # 確定していない当日のklineは更新されるので保存しない
+    assert len(gmo.get_ohlc("BTC_JPY", "1min", date=today, store=store)) == 10
+    assert not store.path("BTC_JPY", "1min", today.strftime("%Y%m%d")).exists()
+    assert store.load("BTC_JPY", "1min", today.strftime("%Y%m%d")) is None
+    assert exchange.request_counts["/public/v1/klines"] == 2
+
+
+def test_get_ohlc_simulated_now(server, tmp_path):
+    store = KlineStore(tmp_path)
+    date = datetime.datetime(2024, 1, 1, 6, 0)
+    server.exchange.add_klines("BTC_JPY", "1min", _klines(date, 10))
+
+    # 確定済みかどうかは渡された時刻で判定する
+    now = datetime.datetime(2024, 1, 1, 6, 10)
+    assert len(gmo.get_ohlc("BTC_JPY", "1min", date=date, store=store, now=now)) == 10
+    assert not store.path("BTC_JPY", "1min", "20240101").exists()
+    now = datetime.datetime(2024, 1, 2, 6, 0)
+    assert len(gmo.get_ohlc("BTC_JPY", "1min", date=date, store=store, now=now)) == 10
+    assert store.path("BTC_JPY", "1min", "20240101").exists()
@@ -0,0 +1,31 @@
+"""test_metrics.py
+"""
+
+import pytest
+
+from auto_trader.utils.metrics import MetricsRegistry
+
+
+def test_timer_records_count_and_errors():
+    registry = MetricsRegistry()
+    for _ in range(3):
+        with registry.timer("api.GET /v1/ticker"):
+            pass
+    with pytest.raises(ValueError):
+        with registry.timer("api.GET /v1/ticker"):
+            raise ValueError
+
+    summary = registry.get("api.GET /v1/ticker")
+    assert summary["count"] == 4
+    assert summary["errors"] == 1
+    assert summary["p99_ms"] >= summary["p50_ms"] >= 0
+    assert registry.get("unknown") is None
+
+
+def test_snapshot_prefix():
+    registry = MetricsRegistry()
+    registry.record("api.GET /v1/ticker", 0.01)
+    registry.record("trader0.refresh", 0.02)
+    assert list(registry.snapshot("api.")) == ["api.GET /v1/ticker"]
+    registry.reset()
+    assert registry.snapshot() == {}
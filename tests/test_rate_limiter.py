@@ -0,0 +1,57 @@
+"""test_rate_limiter.py
+"""
+
+import threading
+import time
+import types
+
+from auto_trader.utils import rate_limiter
+from auto_trader.utils.rate_limiter import Priority, PriorityTokenBucket, priority
+
+
+def _wait_until(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_higher_priority_goes_first(monkeypatch):
+    # トークンはテストで時刻を進めた時だけ補充する
+    now = [0.0]
+    monkeypatch.setattr(rate_limiter, "time", types.SimpleNamespace(monotonic=lambda: now[0]))
+    bucket = PriorityTokenBucket(rate=10, burst=1)
+    bucket.acquire()  # トークンを使い切る
+
+    order = []
+
+    def call(value: Priority):
+        with priority(value):
+            bucket.acquire()
+        order.append(value)
+
+    threads = [threading.Thread(target=call, args=(Priority.SUMMARY,)) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    _wait_until(lambda: bucket.pending() == 3)
+    threads.append(threading.Thread(target=call, args=(Priority.LOSSCUT,)))
+    threads[-1].start()
+    _wait_until(lambda: bucket.pending() == 4)
+
+    # 1個ずつ補充し、前の呼び出しが記録されてから次のトークンを補充するので、記録の順番が取得の順番になる
+    for i in range(len(threads)):
+        now[0] += 1.0
+        _wait_until(lambda: len(order) == i + 1)
+    for thread in threads:
+        thread.join()
+
+    assert order == [Priority.LOSSCUT] + [Priority.SUMMARY] * 3
+
+
+def test_queues_instead_of_failing():
+    bucket = PriorityTokenBucket(rate=50, burst=5)
+    start = time.monotonic()
+    for _ in range(15):
+        bucket.acquire()
+    # 最初の5回はすぐに実行され、残りの10回は1秒に50回のペースで実行される
+    assert 0.15 < time.monotonic() - start < 1.0
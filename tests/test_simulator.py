@@ -0,0 +1,70 @@
+"""test_simulator.py
+"""
+
+import datetime
+import time
+
+import numpy as np
+import polars as pl
+
+from auto_trader.old.auto_runner import AutoRunner
+from auto_trader.old.base import BaseStrategy
+from auto_trader.old.data_fetcher import SimulatorDataFetcher
+
+
+class RecordStrategy(BaseStrategy):
+    def __init__(self, fetcher: SimulatorDataFetcher):
+        self.fetcher = fetcher
+        self.batches = []
+        self.run_times = []
+
+    def add_new_batch(self, batch):
+        self.batches.append(batch)
+
+    def run(self):
+        self.run_times.append(self.fetcher.clock.time())
+
+    def stop(self):
+        pass
+
+
+def _trades(n: int) -> pl.DataFrame:
+    start = datetime.datetime(2024, 1, 1, 9)
+    rng = np.random.default_rng(0)
+    seconds = np.sort(rng.uniform(0, 3600, n))
+    return pl.DataFrame(
+        {
+            "datetime": [start + datetime.timedelta(seconds=s) for s in seconds],
+            "side": rng.choice(["BUY", "SELL"], n).tolist(),
+            "symbol": ["BTC"] * n,
+            "price": 100 + rng.standard_normal(n).cumsum(),
+            "size": rng.uniform(0.01, 1.0, n),
+        }
+    )
+
+
+def test_replay():
+    df = _trades(1000)
+    fetcher = SimulatorDataFetcher("BTC", df)
+    strategy = RecordStrategy(fetcher)
+    AutoRunner([strategy], fetcher).run_replay(step=60)
+
+    # 1分ごとに、その1分間の約定をまとめて受け取る
+    assert len(strategy.run_times) == 60
+    assert np.all(np.diff(strategy.run_times) == 60)
+    timestamps = np.concatenate([batch.timestamp for batch in strategy.batches])
+    expected = df["datetime"].dt.replace_time_zone("Asia/Tokyo").dt.epoch("ms").to_numpy()
+    assert np.array_equal(timestamps, expected)
+    assert np.array_equal(
+        np.concatenate([batch.price for batch in strategy.batches]), df["price"].to_numpy()
+    )
+
+
+def test_accelerated():
+    df = _trades(100)
+    # 1時間分の約定を3600倍速で約1秒で流す
+    fetcher = SimulatorDataFetcher("BTC", df, loop_interval=0.1, speed=3600)
+    fetcher.start_subscribe()
+    time.sleep(0.5)
+    assert 0 < len(fetcher.pop_batch()) < len(df)
+    fetcher.stop_subscribe()
@@ -0,0 +1,70 @@
+"""test_snapshot.py
+"""
+
+import datetime
+
+import numpy as np
+import polars as pl
+
+from auto_trader.order import OrderState
+from auto_trader.trader import Trader0
+from auto_trader.utils.clock import SimulatedClock
+from auto_trader.utils.indicators import StreamingFeatures
+
+INTERVAL = datetime.timedelta(minutes=1)
+
+
+def _trader(tmp_path, clock: SimulatedClock) -> Trader0:
+    return Trader0(
+        "BTC_JPY",
+        INTERVAL,
+        tmp_path / "model.pkl",
+        tmp_path,
+        data_length=30,
+        model=object(),
+        snapshot_path=tmp_path / "snapshot.pkl",
+        order_state=OrderState("BTC_JPY"),
+        streaming_features=True,
+        clock=clock,
+    )
+
+
+def test_snapshot(server, tmp_path):
+    # 確定済みの日のklineはストアに保存されるので、今日の日付で登録する
+    start = datetime.datetime.combine(datetime.date.today(), datetime.time(10, 0))
+    rng = np.random.default_rng(0)
+    close = 1e7 + rng.standard_normal(120).cumsum() * 1e4
+    df = pl.DataFrame(
+        {
+            "datetime": [start + INTERVAL * i for i in range(120)],
+            "open": close - 1e3,
+            "high": close + 2e3,
+            "low": close - 2e3,
+            "close": close,
+            "volume": rng.uniform(0.1, 1.0, 120),
+        }
+    )
+    server.exchange.add_klines("BTC_JPY", "1min", df)
+
+    clock = SimulatedClock((start + datetime.timedelta(hours=1, seconds=30)).timestamp())
+    trader = _trader(tmp_path, clock)
+    trader.warm_start()
+    assert trader.bars.last_datetime == start + datetime.timedelta(minutes=59)
+    trader.save_snapshot()
+
+    # 再起動後は停止中に確定したbarだけを追加し、特徴量の計算を続ける
+    clock.set_time(clock.time() + 5 * 60)
+    restarted = _trader(tmp_path, clock)
+    assert restarted.load_snapshot()
+    restarted.update_bars()
+    assert restarted.bars.last_datetime == start + datetime.timedelta(minutes=64)
+    expected = StreamingFeatures()
+    expected.extend(df[:65])
+    assert restarted.features.count == expected.count
+    np.testing.assert_array_equal(
+        np.array(list(restarted.features.values.values())), np.array(list(expected.values.values()))
+    )
+
+    # `data_length`本以上のbarが足りない場合は使わない
+    clock.set_time(clock.time() + 30 * 60)
+    assert not _trader(tmp_path, clock).load_snapshot()
@@ -0,0 +1,32 @@
+"""test_tick_batch.py
+"""
+
+import datetime
+
+from auto_trader.old.base import BaseDataFetcher
+from auto_trader.old.types import TickBatch
+from auto_trader.old.types.tick_batch import SIDE_BUY, SIDE_SELL
+
+
+def test_pop_batch():
+    fetcher = BaseDataFetcher("BTC")
+    assert len(fetcher.pop_batch()) == 0
+
+    fetcher.put(SIDE_BUY, 100.0, 0.1, 1_000)
+    fetcher.put(SIDE_SELL, 101.0, 0.2, 2_000)
+    fetcher.put_batch(
+        TickBatch.from_columns("BTC", [SIDE_BUY] * 2, [102.0, 103.0], [0.3, 0.4], [3_000, 4_000])
+    )
+    fetcher.put(SIDE_BUY, 104.0, 0.5, 5_000)
+
+    # 追加した順に1つのbatchとして取り出せる
+    batch = fetcher.pop_batch()
+    assert batch.symbol == "BTC"
+    assert batch.price.tolist() == [100.0, 101.0, 102.0, 103.0, 104.0]
+    assert batch.timestamp.tolist() == [1_000, 2_000, 3_000, 4_000, 5_000]
+    assert len(fetcher.pop_batch()) == 0
+
+    ticks = batch.to_ticks()
+    assert [tick.side for tick in ticks] == ["BUY", "SELL", "BUY", "BUY", "BUY"]
+    assert ticks[1].volume == 0.2
+    assert ticks[1].timestamp == datetime.datetime(1970, 1, 1, 0, 0, 2, tzinfo=datetime.timezone.utc)
@@ -0,0 +1,112 @@
+"""test_ticker_feed.py
+"""
+
+import base64
+import datetime
+import hashlib
+import json
+import socket
+import struct
+import threading
+import time
+
+from auto_trader.utils.ticker_feed import TickerFeed
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def _recv_frame(conn: socket.socket) -> bytes:
+    """クライアントからのframe(mask付き)を1つ読み込む"""
+    header = conn.recv(2)
+    length = header[1] & 0x7F
+    if length == 126:
+        length = struct.unpack(">H", conn.recv(2))[0]
+    elif length == 127:
+        length = struct.unpack(">Q", conn.recv(8))[0]
+    mask = conn.recv(4)
+    payload = b""
+    while len(payload) < length:
+        payload += conn.recv(length - len(payload))
+    return bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+
+def _send_text(conn: socket.socket, text: str):
+    payload = text.encode()
+    assert len(payload) < 126
+    conn.sendall(bytes([0x81, len(payload)]) + payload)
+
+
+def _serve(server: socket.socket, prices: list[float], subscribed: list[dict]):
+    """接続ごとに1つ価格を送信して切断する、GMOのWebSocketの代わり"""
+    for price in prices:
+        conn, _ = server.accept()
+        request = conn.recv(4096).decode()
+        key = [
+            line.split(":")[1].strip()
+            for line in request.split("\r\n")
+            if line.lower().startswith("sec-websocket-key")
+        ][0]
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+        conn.sendall(
+            (
+                "HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                f"Sec-WebSocket-Accept: {accept}\r\n\r\n"
+            ).encode()
+        )
+        subscribed.append(json.loads(_recv_frame(conn)))
+        _send_text(conn, json.dumps({"channel": "ticker", "symbol": "BTC_JPY", "last": str(price)}))
+        time.sleep(0.1)
+        conn.close()
+
+
+def test_ticker_feed_reconnect():
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    subscribed = []
+    thread = threading.Thread(target=_serve, args=(server, [100.0, 200.0], subscribed), daemon=True)
+    thread.start()
+
+    received = []
+    feed = TickerFeed(
+        ["BTC_JPY"], url=f"ws://127.0.0.1:{server.getsockname()[1]}", reconnect_interval=0.1
+    )
+    feed.add_listener(lambda symbol, price: received.append((symbol, price)))
+    feed.start_subscribe()
+
+    # 切断後に再接続して、2回目の接続の価格も受信する
+    deadline = time.time() + 5
+    while len(received) < 2 and time.time() < deadline:
+        time.sleep(0.05)
+    feed.stop_subscribe()
+    server.close()
+
+    assert received == [("BTC_JPY", 100.0), ("BTC_JPY", 200.0)]
+    assert feed.get_price("BTC_JPY") == 200.0
+    assert subscribed[0] == {"command": "subscribe", "channel": "ticker", "symbol": "BTC_JPY"}
+
+
+class _DummyWebSocket:
+    def send(self, data: str):
+        pass
+
+
+def test_ticker_feed_is_alive():
+    feed = TickerFeed(["BTC_JPY", "ETH_JPY"], subscribe_interval=0.0)
+    ws = _DummyWebSocket()
+    feed._on_open(ws)
+    feed._on_message(ws, json.dumps({"channel": "ticker", "symbol": "BTC_JPY", "last": "100"}))
+
+    # 価格の変わらないシンボルがあっても接続は生きている
+    assert feed.is_alive()
+    assert feed.is_alive("BTC_JPY")
+    assert not feed.is_alive("ETH_JPY")
+
+    # pongも含めて何も受信していない場合は切れている
+    feed.last_received_at -= datetime.timedelta(minutes=2)
+    assert not feed.is_alive("BTC_JPY")
+
+    # 再接続後は価格を受信するまでpollingでチェックする
+    feed._on_open(ws)
+    assert feed.is_alive()
+    assert not feed.is_alive("BTC_JPY")
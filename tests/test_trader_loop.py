@@ -0,0 +1,82 @@
+"""test_trader_loop.py
+"""
+
+import asyncio
+import datetime
+import threading
+import time
+
+from auto_trader.order import LeverageOrder, OrderState
+from auto_trader.trader import Trader0
+from auto_trader.utils.clock import SimulatedClock
+from auto_trader.utils.rate_limiter import Priority, current_priority
+
+
+def test_losscut_during_slow_bar(server, tmp_path, monkeypatch):
+    exchange = server.exchange
+    exchange.set_price("BTC_JPY", 10_000_000)
+    trader = Trader0(
+        "BTC_JPY",
+        datetime.timedelta(minutes=1),
+        tmp_path / "model.pkl",
+        tmp_path,
+        model=object(),
+        order_state=OrderState("BTC_JPY"),
+        clock=SimulatedClock(time.time()),
+    )
+    trader.warm_start = lambda: None
+    trader.predict = lambda: (0.0, 9_000_000, 10_500_000)
+    # `max_concurrency`より多くの注文の目標価格の更新が遅い
+    slow = [LeverageOrder.new_order("BTC_JPY", -1.0, 0.01, losscut_price=9_000_000) for _ in range(9)]
+    fast = LeverageOrder.new_order("BTC_JPY", -1.0, 0.01, losscut_price=9_900_000)
+    trader.orders += [*slow, fast]
+    slow_ids = {order.order_id for order in slow}
+
+    repricing = threading.Event()
+    update_target_price = LeverageOrder.update_target_price
+
+    def _update_target_price(self, target_price: float, state: OrderState | None = None):
+        if self.order_id in slow_ids:
+            repricing.set()
+            time.sleep(1.0)
+        update_target_price(self, target_price, state)
+
+    monkeypatch.setattr(LeverageOrder, "update_target_price", _update_target_price)
+
+    async def _run():
+        task = asyncio.create_task(trader.run_loop_async(max_concurrency=8))
+        while not repricing.is_set():
+            await asyncio.sleep(0.01)
+        # 遅いbarの処理中も、他の注文のlosscutと終了の検出は遅れない
+        exchange.set_price("BTC_JPY", 9_800_000)
+        start = time.monotonic()
+        while fast in trader.orders:
+            assert time.monotonic() - start < 0.8
+            await asyncio.sleep(0.01)
+        assert all(order in trader.orders for order in slow)
+        trader.stop_loop()
+        await task
+
+    asyncio.run(_run())
+    assert len(exchange.positions) == 0
+
+
+def test_price_update_losscut_priority(tmp_path, monkeypatch):
+    trader = Trader0(
+        "BTC_JPY",
+        datetime.timedelta(minutes=1),
+        tmp_path / "model.pkl",
+        tmp_path,
+        model=object(),
+        order_state=OrderState("BTC_JPY"),
+    )
+    trader.orders.append(LeverageOrder(symbol="BTC_JPY", side="BUY", order_id="1", losscut_price=90.0))
+    priorities = []
+    monkeypatch.setattr(
+        LeverageOrder,
+        "check_losscut",
+        lambda self, price, state=None: priorities.append(current_priority()),
+    )
+    # WebSocketの価格更新からのlosscutもlosscutの優先度でAPIを呼び出す
+    trader.on_price_updated("BTC_JPY", 80.0)
+    assert priorities == [Priority.LOSSCUT]
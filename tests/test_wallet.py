@@ -3,12 +3,16 @@
 
 import datetime
 
-import auto_trader
+import numpy as np
+import pytest
+
+import auto_trader.old.types
+import auto_trader.old.wallet
 
 
 def test_wallet():
     initial_cash = 100000
-    wallet = auto_trader.wallet.Wallet(initial_cash=initial_cash)
+    wallet = auto_trader.old.wallet.Wallet(initial_cash=initial_cash)
     assert wallet.get_current_total_assets({}) == initial_cash
 
     # トレード可能量の計算
@@ -22,7 +26,7 @@ def test_wallet():
     assert position.volume == 0
 
     # ポジションの更新
-    trade_history = auto_trader.types.TradeHistory(
+    trade_history = auto_trader.old.types.TradeHistory(
         symbol="BTC_JPY", volume=3.0, price=30000, fee=0.001, timestamp=datetime.datetime.now()
     )
     wallet.update_wallet(trade_history)
@@ -35,7 +39,7 @@ def test_wallet():
     assert abs(asset - (70000 - fee)) < 1e-6
 
     # ポジションの更新
-    trade_history = auto_trader.types.TradeHistory(
+    trade_history = auto_trader.old.types.TradeHistory(
         symbol="BTC_JPY", volume=-1.0, price=35000, fee=0.001, timestamp=datetime.datetime.now()
     )
     wallet.update_wallet(trade_history)
@@ -48,3 +52,33 @@ def test_wallet():
     # トレード可能量の計算
     tradable_volume = wallet.calc_trade_volume("BTC_JPY", 20000, -8.0, 0.001)
     assert abs(tradable_volume + 4.0) < 1e-6
+
+
+def test_wallet_batch():
+    wallet = auto_trader.old.wallet.Wallet(initial_cash=5e5, capacity=2)
+    symbols = [f"SYM{i}" for i in range(40)]
+    histories = [
+        auto_trader.old.types.TradeHistory(
+            symbol=symbol, volume=1.0 + i, price=100.0, fee=0.0, timestamp=datetime.datetime.now()
+        )
+        for i, symbol in enumerate(symbols * 2)
+    ]
+    wallet.update_wallet_batch(histories)
+    assert wallet.get_target_position("SYM1").volume == 2.0 + 42.0
+    assert abs(wallet.current_cash - (5e5 - 100.0 * sum(h.volume for h in histories))) < 1e-6
+
+    # barごとの総資産をまとめて計算する
+    prices = np.full((3, len(symbols)), 100.0) * np.array([[1.0], [1.1], [0.9]])
+    position_value = 5e5 - wallet.current_cash
+    assert np.allclose(wallet.valuate(prices), 5e5 + position_value * np.array([0.0, 0.1, -0.1]))
+
+    # 現金が不足する場合は何も反映せず、新しいsymbolも追加しない
+    cash = wallet.current_cash
+    unseen = auto_trader.old.types.TradeHistory(
+        symbol="NEW", volume=1.0, price=100.0, fee=0.0, timestamp=datetime.datetime.now()
+    )
+    with pytest.raises(RuntimeError):
+        wallet.update_wallet_batch([*histories, unseen])
+    assert wallet.current_cash == cash
+    assert "NEW" not in wallet.symbol_index
+    assert len(wallet.symbols) == len(symbols)